@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Adaptación de calidad por cliente según el enlace medido
+Cada cliente se mueve por una escalera de resolución/calidad/FPS: baja un
+escalón cuando su envío se atasca (escrituras lentas, cola llena, pérdidas
+RTCP) y sube cuando lleva un rato holgado. Los escalones se sirven desde las
+cachés compartidas, así que dos clientes en el mismo escalón no duplican trabajo
+"""
+
+import time
+import logging
+from typing import Dict, Optional
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Escalera de calidad, de mejor a peor (bitrate solo para H.264/WebRTC)
+ESCALONES = [
+    {'nombre': 'alta', 'ancho': 640, 'alto': 480, 'calidad': 70, 'fps': 30, 'bitrate': 1_500_000},
+    {'nombre': 'media', 'ancho': 480, 'alto': 360, 'calidad': 60, 'fps': 20, 'bitrate': 800_000},
+    {'nombre': 'baja', 'ancho': 320, 'alto': 240, 'calidad': 50, 'fps': 10, 'bitrate': 350_000},
+    {'nombre': 'minima', 'ancho': 160, 'alto': 120, 'calidad': 40, 'fps': 5, 'bitrate': 120_000},
+]
+
+# Escalón con el que empieza cada cliente (el 480x360 @ calidad 60 de siempre)
+ESCALON_INICIAL = 1
+
+# Tiempo máximo de envío de un frame antes de considerar el enlace saturado (s)
+LATENCIA_OBJETIVO = 0.25
+
+# Pérdida RTCP a partir de la cual se baja de escalón (fracción 0-1)
+PERDIDA_MAXIMA = 0.05
+
+# Socket.IO y WebRTC: retraso de cola tolerado sobre el RTT mínimo del enlace (s). El RTT
+# de un enlace móvil ya ronda 50-150 ms sin congestión: lo que indica saturación
+# es cuánto crece sobre ese mínimo, no su valor absoluto
+RETRASO_COLA_MAXIMO = 0.15
+
+# Ventana en la que se busca el RTT mínimo (s); se renueva para seguir cambios de ruta
+VENTANA_RTT_BASE = 30.0
+
+# Ventana de medida del caudal confirmado por acks (s)
+VENTANA_CAUDAL = 2.0
+
+# Histéresis: bajar es rápido, subir exige un rato sin congestión
+ESPERA_BAJAR = 1.0
+ESPERA_SUBIR = 8.0
+
+# Peso de cada medida nueva en la media exponencial
+ALFA_LATENCIA = 0.3
+
+
+class ControlAdaptativo:
+    """Escalón de calidad de un cliente, decidido a partir de sus medidas de envío"""
+
+    def __init__(self, escalon: int = ESCALON_INICIAL, latencia_objetivo: float = LATENCIA_OBJETIVO):
+        self.escalon = escalon
+        self.latencia_objetivo = latencia_objetivo
+        self.latencia = 0.0            # Media exponencial del tiempo de envío (s)
+        self.perdida = 0.0
+        self.rtt = 0.0
+        # RTT mínimo: el de esta ventana y el de la anterior (ver registrar_ack)
+        self.rtt_base = float('inf')
+        self.rtt_base_ventana = float('inf')
+        self.rtt_base_anterior = float('inf')
+        self.inicio_ventana_rtt = time.time()
+        # Caudal confirmado por acks
+        self.caudal = 0.0              # bit/s
+        self.bytes_caudal = 0
+        self.inicio_caudal = time.time()
+        self.ultimo_cambio = time.time()
+        self.ultima_congestion = time.time()
+        self.bajadas = 0
+        self.subidas = 0
+
+    @property
+    def perfil(self) -> Dict:
+        """Parámetros del escalón actual"""
+        return ESCALONES[self.escalon]
+
+    def registrar_envio(self, duracion: float, bytes_pendientes: int = 0, tamano_frame: int = 0) -> bool:
+        """
+        Medida de una escritura local (MJPEG): no sirve para tiempos de ida y
+        vuelta, que incluyen el RTT del enlace (ver registrar_ack)
+
+        Args:
+            duracion: Segundos que tardó la escritura del frame
+            bytes_pendientes: Bytes aún en el buffer de salida tras escribir
+            tamano_frame: Tamaño del frame enviado
+
+        Returns:
+            True si cambió el escalón
+        """
+        self.latencia += ALFA_LATENCIA * (duracion - self.latencia)
+        intervalo = 1.0 / self.perfil['fps']
+
+        # Saturado: la escritura no cabe en el intervalo entre frames, supera el
+        # objetivo de latencia, o hay más de un frame esperando en el buffer
+        congestionado = (self.latencia > min(self.latencia_objetivo, intervalo)
+                         or (tamano_frame and bytes_pendientes > tamano_frame))
+        # Holgado: sobraría tiempo incluso al ritmo del escalón superior
+        superior = ESCALONES[max(self.escalon - 1, 0)]
+        holgado = not bytes_pendientes and self.latencia < 0.3 / superior['fps']
+        return self._evaluar(congestionado, holgado)
+
+    def registrar_ack(self, rtt: float, tamano_frame: int = 0) -> bool:
+        """
+        Medida del ack de un frame enviado por Socket.IO
+
+        El enlace se da por saturado cuando el RTT suavizado supera en
+        RETRASO_COLA_MAXIMO al mínimo reciente (los frames esperan en alguna
+        cola), no por el RTT en sí
+
+        Args:
+            rtt: Segundos desde el envío hasta el ack (o hasta darlo por perdido)
+            tamano_frame: Bytes del frame confirmado (0 si se perdió)
+
+        Returns:
+            True si cambió el escalón
+        """
+        ahora = time.time()
+        # Un frame perdido no dice nada del RTT mínimo
+        self._medir_rtt(rtt, ahora, valido=bool(tamano_frame))
+
+        self.bytes_caudal += tamano_frame
+        if ahora - self.inicio_caudal >= VENTANA_CAUDAL:
+            self.caudal = self.bytes_caudal * 8 / (ahora - self.inicio_caudal)
+            self.bytes_caudal = 0
+            self.inicio_caudal = ahora
+
+        congestionado = not tamano_frame or self.latencia > RETRASO_COLA_MAXIMO
+        holgado = self.latencia < RETRASO_COLA_MAXIMO / 4
+        return self._evaluar(congestionado, holgado)
+
+    def registrar_rtcp(self, fraccion_perdida: Optional[float], rtt: Optional[float]) -> bool:
+        """
+        Medida de los informes RTCP de un receptor WebRTC
+
+        Igual que con los acks, el RTT cuenta por lo que crece sobre el mínimo
+        reciente: un enlace lento pero estable no es un enlace saturado
+
+        Args:
+            fraccion_perdida: Fracción de paquetes perdidos (0-1), si el informe la trae
+            rtt: RTT del informe en segundos, si el informe lo trae
+
+        Returns:
+            True si cambió el escalón
+        """
+        self.perdida = fraccion_perdida or 0.0
+        if rtt:
+            self._medir_rtt(rtt, time.time())
+        congestionado = self.perdida > PERDIDA_MAXIMA or self.latencia > RETRASO_COLA_MAXIMO
+        holgado = self.perdida < PERDIDA_MAXIMA / 5 and self.latencia < RETRASO_COLA_MAXIMO / 4
+        return self._evaluar(congestionado, holgado)
+
+    def _medir_rtt(self, rtt: float, ahora: float, valido: bool = True):
+        """
+        Actualizar el RTT suavizado, el mínimo reciente y el retraso de cola
+        (self.latencia) con una medida nueva
+
+        Args:
+            rtt: RTT medido (s)
+            ahora: Instante de la medida
+            valido: False si la medida no puede rebajar el RTT mínimo
+        """
+        if ahora - self.inicio_ventana_rtt >= VENTANA_RTT_BASE:
+            self.rtt_base_anterior, self.rtt_base_ventana = self.rtt_base_ventana, float('inf')
+            self.inicio_ventana_rtt = ahora
+        if valido:
+            self.rtt_base_ventana = min(self.rtt_base_ventana, rtt)
+        self.rtt_base = min(self.rtt_base_anterior, self.rtt_base_ventana, rtt)
+
+        self.rtt = rtt if not self.rtt else self.rtt + ALFA_LATENCIA * (rtt - self.rtt)
+        self.latencia = max(self.rtt - self.rtt_base, 0.0)
+
+    def _evaluar(self, congestionado: bool, holgado: bool) -> bool:
+        ahora = time.time()
+        anterior = self.escalon
+
+        if congestionado:
+            self.ultima_congestion = ahora
+            if self.escalon < len(ESCALONES) - 1 and ahora - self.ultimo_cambio >= ESPERA_BAJAR:
+                self.escalon += 1
+                self.bajadas += 1
+        elif (holgado and self.escalon > 0
+              and ahora - self.ultima_congestion >= ESPERA_SUBIR
+              and ahora - self.ultimo_cambio >= ESPERA_SUBIR):
+            self.escalon -= 1
+            self.subidas += 1
+
+        if self.escalon == anterior:
+            return False
+        self.ultimo_cambio = ahora
+        logger.info(f'📶 Escalón {ESCALONES[anterior]["nombre"]} → {self.perfil["nombre"]} '
+                    f'(latencia {self.latencia * 1000:.0f} ms, pérdida {self.perdida:.1%}, '
+                    f'rtt {self.rtt * 1000:.0f} ms)')
+        return True
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            'escalon': self.perfil['nombre'],
+            'latencia_ms': round(self.latencia * 1000, 1),
+            'perdida': round(self.perdida, 3),
+            'rtt_ms': round(self.rtt * 1000, 1),
+            'rtt_base_ms': round(self.rtt_base * 1000, 1) if self.rtt_base != float('inf') else None,
+            'caudal_kbps': round(self.caudal / 1000, 1),
+            'bajadas': self.bajadas,
+            'subidas': self.subidas
+        }
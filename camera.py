@@ -2,17 +2,25 @@
 """
 Sistema de Cámara con Detección de Objetos usando YOLOv8
 Detecta personas y perros, y graba cuando se detectan
+Admite varias cámaras (frontal, trasera, cabina) con una sola inferencia por lotes
 """
 
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import logging
 import threading
 import time
-from datetime import datetime
 from pathlib import Path
 import base64
+from movimiento import DetectorMovimiento
+from seguimiento import SeguidorObjetos
+from inferencia import crear_backend, BACKEND_INFERENCIA
+from grabacion import GrabadorClips
+from retencion import obtener_retencion
+from zonas import ZonaInteres
+from eventos import EventosDeteccion
+from typing import Dict, Optional
+from contextlib import contextmanager
 
 # ==================== CONFIGURACIÓN ====================
 logger = logging.getLogger(__name__)
@@ -20,23 +28,322 @@ logger = logging.getLogger(__name__)
 # Clases a detectar
 CLASES_DETECTAR = ['person', 'dog']  # YOLOv8 names: 'person' y 'dog'
 
+# Cámaras del coche: id → índice de /dev/video (None = la primera que funcione en 0-4)
+# Ejemplo con varias: {'frontal': 0, 'trasera': 2, 'cabina': 4}
+CAMARAS = {'frontal': None}
+
+# Zonas de interés por cámara: polígonos en coordenadas relativas (0-1) del frame.
+# Al modelo solo llega el rectángulo que los contiene y se descartan las detecciones
+# que pisan fuera. Cámara sin entrada = frame completo
+# Ejemplo: {'frontal': [[(0.1, 0.35), (0.9, 0.35), (1.0, 1.0), (0.0, 1.0)]]}
+ZONAS_INTERES = {}
+
+# Lado de la entrada del modelo en píxeles (640 = tamaño de entrenamiento de YOLOv8;
+# 416 tiene ~2.4 veces menos FLOPs y basta para personas y perros a pocos metros)
+TAMANO_INFERENCIA = 416
+
+# Ejecutar YOLO solo cuando hay movimiento (o a un latido lento si la escena está quieta)
+USAR_DETECTOR_MOVIMIENTO = True
+
 # Configuración de grabación
 VIDEO_OUTPUT_DIR = Path('videos_grabados')
 VIDEO_OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Variante JPEG por defecto para el streaming (ancho, alto, calidad)
+JPEG_ANCHO = 480
+JPEG_ALTO = 360
+JPEG_CALIDAD = 60
+
+# Cajas y etiquetas en el stream por defecto (cada consumidor puede pedir el frame
+# limpio). La grabación y la inferencia siempre usan el frame sin dibujar
+DIBUJAR_DETECCIONES = True
+
+# Segundos sin lectores tras los que se descarta una variante JPEG
+TTL_VARIANTE_JPEG = 5.0
+
+# Buffers de frame preasignados por cámara (la captura los rellena en sitio)
+TAMANO_ANILLO = 6
+
+# ==================== OVERLAY ====================
+# Tamaño de cada etiqueta por (clase, confianza a 2 decimales): es justo el texto que
+# se pinta, así que cv2.getTextSize solo se llama la primera vez que aparece
+_etiquetas: Dict[tuple, tuple] = {}
+
+def dibujar_detecciones(frame, detecciones):
+    """Dibujar las cajas y etiquetas de las detecciones sobre el frame (en sitio)"""
+    for deteccion in detecciones:
+        clase_nombre = deteccion['clase']
+        x1, y1, x2, y2 = deteccion['bbox']
+        
+        clave = (clase_nombre, round(deteccion['confianza'], 2))
+        etiqueta = _etiquetas.get(clave)
+        if etiqueta is None:
+            texto = f'{clase_nombre} {clave[1]:.2f}'
+            etiqueta = _etiquetas[clave] = (
+                texto, cv2.getTextSize(texto, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0])
+        texto, text_size = etiqueta
+        
+        # Dibujar rectángulo con más grosor para mejor visibilidad
+        color = (0, 255, 0) if clase_nombre == 'person' else (255, 0, 0)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)
+        
+        # Fondo relleno para la etiqueta y texto blanco encima
+        cv2.rectangle(frame, (x1, y1 - text_size[1] - 10), (x1 + text_size[0], y1), color, -1)
+        cv2.putText(frame, texto, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    
+    return frame
+
+
+# ==================== CACHÉ DE FRAMES CODIFICADOS ====================
+class VarianteJPEG:
+    """Último frame codificado a una resolución y calidad concretas, con o sin overlay"""
+    
+    def __init__(self, ancho, alto, calidad, con_detecciones=True):
+        self.ancho = ancho
+        self.alto = alto
+        self.calidad = calidad
+        self.con_detecciones = con_detecciones
+        self.secuencia = -1       # Frame al que corresponde `datos`
+        self.datos = None         # Bytes JPEG
+        self.datos_b64 = None     # Base64 de `datos`, calculado solo si alguien lo pide
+        self.redimensionado = None  # Buffer reutilizado para el resize
+        self.ultimo_uso = time.time()
+        self.codificaciones = 0
+        self.aciertos = 0
+        # Un lector codifica y los demás de la misma variante esperan su resultado
+        self.lock = threading.Lock()
+    
+    def codificar(self, frame, secuencia):
+        """Codificar `frame` si la variante no tiene ya ese número de frame"""
+        self.ultimo_uso = time.time()
+        if self.secuencia == secuencia:
+            self.aciertos += 1
+            return
+        
+        if self.ancho and self.alto and frame.shape[:2] != (self.alto, self.ancho):
+            if self.redimensionado is None:
+                self.redimensionado = np.empty((self.alto, self.ancho, 3), dtype=np.uint8)
+            cv2.resize(frame, (self.ancho, self.alto), dst=self.redimensionado)
+            frame = self.redimensionado
+        
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.calidad])
+        if not ret:
+            raise RuntimeError('cv2.imencode falló')
+        
+        self.datos = buffer.tobytes()
+        self.datos_b64 = None
+        self.secuencia = secuencia
+        self.codificaciones += 1
+
+
+class CacheFramesJPEG:
+    """JPEG versionados del frame actual: cada frame se codifica como mucho una vez
+    por variante (ancho, alto, calidad), compartido entre todos los lectores
+    
+    El coste de codificar deja de crecer con el número de clientes: MJPEG,
+    WebRTC y cada `solicitar_frame` leen los mismos bytes cacheados
+    """
+    
+    def __init__(self, ttl_variante=TTL_VARIANTE_JPEG):
+        self.ttl_variante = ttl_variante
+        self.variantes: Dict[tuple, VarianteJPEG] = {}
+        self.lock = threading.Lock()  # Solo protege el diccionario de variantes
+        self.ultima_limpieza = time.time()
+        self.variantes_descartadas = 0
+    
+    def _variante(self, clave):
+        """Variante para `clave`, creándola si hace falta y descartando las que nadie usa"""
+        ahora = time.time()
+        with self.lock:
+            if ahora - self.ultima_limpieza >= 1.0:
+                self.ultima_limpieza = ahora
+                caducadas = [c for c, v in self.variantes.items()
+                             if c != clave and ahora - v.ultimo_uso > self.ttl_variante]
+                for c in caducadas:
+                    del self.variantes[c]
+                    logger.info(f'🗑️ Variante JPEG {c} descartada (sin lectores)')
+                self.variantes_descartadas += len(caducadas)
+            
+            variante = self.variantes.get(clave)
+            if variante is None:
+                variante = self.variantes[clave] = VarianteJPEG(*clave)
+            return variante
+    
+    def obtener(self, frame, secuencia, ancho=JPEG_ANCHO, alto=JPEG_ALTO,
+                calidad=JPEG_CALIDAD, base64_=False, con_detecciones=True):
+        """
+        JPEG del frame `secuencia` en la variante pedida
+        
+        Args:
+            frame: Frame BGR (solo se usa si la variante no lo tiene ya codificado)
+            secuencia: Número de frame, la versión de la caché
+            ancho, alto: Resolución de salida (None = la del frame)
+            calidad: Calidad JPEG (0-100)
+            base64_: Si True devuelve el JPEG en Base64 (también cacheado)
+            con_detecciones: Si `frame` lleva el overlay (es parte de la variante)
+        
+        Returns:
+            (datos, secuencia) con datos en bytes (o str si base64_)
+        """
+        variante = self._variante((ancho, alto, calidad, con_detecciones))
+        with variante.lock:
+            variante.codificar(frame, secuencia)
+            if not base64_:
+                return variante.datos, variante.secuencia
+            if variante.datos_b64 is None:
+                variante.datos_b64 = base64.b64encode(variante.datos).decode('utf-8')
+            return variante.datos_b64, variante.secuencia
+    
+    def obtener_estadisticas(self):
+        """Codificaciones y aciertos por variante"""
+        with self.lock:
+            variantes = list(self.variantes.values())
+        return {
+            'variantes': [{'ancho': v.ancho, 'alto': v.alto, 'calidad': v.calidad,
+                           'con_detecciones': v.con_detecciones, 'secuencia': v.secuencia, 'codificaciones': v.codificaciones,
+                           'aciertos': v.aciertos} for v in variantes],
+            'descartadas': self.variantes_descartadas
+        }
+
+
+# ==================== ANILLO DE FRAMES ====================
+class RanuraFrame:
+    """Un buffer de frame del anillo, con su copia para dibujar y su contador de préstamos
+    
+    El overlay no lo pinta la captura: se dibuja la primera vez que un
+    consumidor lo pide y lo comparten todos los que lo piden después
+    """
+    
+    __slots__ = ('buffer', 'dibujado', 'con_dibujo', 'detecciones', 'secuencia', 'instante',
+                 'refs', 'lock')
+    
+    def __init__(self, forma):
+        self.buffer = np.empty(forma, dtype=np.uint8)
+        self.dibujado = None       # Buffer del overlay, se reserva la primera vez que hace falta
+        self.con_dibujo = False    # `dibujado` corresponde ya a este frame
+        self.detecciones = []      # Objetos a dibujar en este frame
+        self.secuencia = 0
+        self.instante = 0.0
+        self.refs = 0              # Publicación + lectores que lo tienen prestado
+        self.lock = threading.Lock()
+    
+    def reiniciar(self, detecciones):
+        """Nuevo frame en la ranura (solo la captura, con la ranura sin préstamos)"""
+        self.detecciones = detecciones
+        self.con_dibujo = False
+    
+    def _dibujar(self):
+        """Copiar el frame al buffer del overlay (reutilizado) y dibujar, una vez por frame"""
+        with self.lock:
+            if self.con_dibujo:
+                return
+            if self.dibujado is None or self.dibujado.shape != self.buffer.shape:
+                self.dibujado = np.empty_like(self.buffer)
+            np.copyto(self.dibujado, self.buffer)
+            dibujar_detecciones(self.dibujado, self.detecciones)
+            self.con_dibujo = True
+    
+    def vista(self, con_detecciones=True):
+        """Vista de solo lectura del frame (con o sin overlay)"""
+        frame = self.buffer
+        if con_detecciones and self.detecciones:
+            self._dibujar()
+            frame = self.dibujado
+        vista = frame.view()
+        vista.flags.writeable = False
+        return vista
+
+
+class AnilloFrames:
+    """Anillo de buffers preasignados para la captura, sin reservar memoria por frame
+    
+    La captura rellena una ranura libre con `cap.read(image=buffer)` y la
+    publica; los lectores toman prestada la publicada y la devuelven al
+    terminar. Una ranura con préstamos nunca se sobrescribe; si no queda
+    ninguna libre el anillo crece (y se cuenta en las estadísticas)
+    """
+    
+    def __init__(self, num_ranuras=TAMANO_ANILLO, forma=(480, 640, 3)):
+        self.num_ranuras = num_ranuras
+        self.forma = forma
+        self.ranuras = [RanuraFrame(forma) for _ in range(num_ranuras)]
+        self.actual = None
+        self.lock = threading.Lock()
+        self.siguiente = 0
+        self.ampliaciones = 0
+    
+    def libre(self):
+        """Ranura que la captura puede sobrescribir"""
+        with self.lock:
+            for _ in range(len(self.ranuras)):
+                ranura = self.ranuras[self.siguiente]
+                self.siguiente = (self.siguiente + 1) % len(self.ranuras)
+                if ranura.refs == 0:
+                    if ranura.buffer.shape != self.forma:
+                        ranura.buffer = np.empty(self.forma, dtype=np.uint8)
+                    return ranura
+            
+            # Todos los buffers prestados (lectores lentos): ampliar el anillo
+            ranura = RanuraFrame(self.forma)
+            self.ranuras.append(ranura)
+            self.ampliaciones += 1
+            logger.warning(f'⚠️ Anillo de frames ampliado a {len(self.ranuras)} ranuras')
+            return ranura
+    
+    def adoptar(self, ranura, frame):
+        """OpenCV devolvió un array nuevo (otra resolución): usarlo como buffer de la ranura"""
+        ranura.buffer = frame
+        self.forma = frame.shape
+    
+    def publicar(self, ranura):
+        """Hacer de `ranura` el frame actual; la anterior queda libre cuando nadie la use"""
+        with self.lock:
+            ranura.refs += 1
+            if self.actual is not None:
+                self.actual.refs -= 1
+            self.actual = ranura
+    
+    def prestar(self):
+        """Tomar prestada la ranura actual (devolverla con soltar())"""
+        with self.lock:
+            ranura = self.actual
+            if ranura is not None:
+                ranura.refs += 1
+            return ranura
+    
+    def retener(self, ranura):
+        """Préstamo adicional de una ranura que ya se tiene (p. ej. para el grabador)"""
+        with self.lock:
+            ranura.refs += 1
+    
+    def soltar(self, ranura):
+        with self.lock:
+            ranura.refs -= 1
+    
+    def obtener_estadisticas(self):
+        with self.lock:
+            return {
+                'ranuras': len(self.ranuras),
+                'prestadas': sum(1 for r in self.ranuras if r.refs > 0),
+                'ampliaciones': self.ampliaciones
+            }
+
+
 # ==================== CLASE DE CÁMARA ====================
 class CameraManager:
-    def __init__(self, cargar_yolo=False):
+    def __init__(self, cargar_yolo=False, camara_id='frontal', indice=None):
         """Inicializar gestor de cámara
         
         Args:
             cargar_yolo: Si True, carga el modelo YOLOv8 (más recursos)
+            camara_id: Nombre de la cámara (frontal, trasera, cabina...)
+            indice: Índice de /dev/video; None = buscar en 0-4
         """
+        self.camara_id = camara_id
+        self.indice = indice
         self.cap = None
         self.modelo = None
-        self.frame_actual = None
         self.grabando = False
-        self.video_writer = None
         self.detecciones = []
         self.fps = 30
         self.ancho = 640
@@ -44,6 +351,46 @@ class CameraManager:
         self.lock = threading.Lock()
         self.cargar_yolo = cargar_yolo
         
+        # Pipeline captura → inferencia: la captura solo guarda el frame más nuevo
+        # y el worker de inferencia siempre coge el último, saltándose los viejos
+        self.secuencia = 0                 # Número del último frame capturado (0 = ninguno aún)
+        self.secuencia_deteccion = 0       # Frame al que corresponden self.detecciones
+        self.nuevo_frame = threading.Condition(self.lock)
+        self.thread_inferencia = None
+        self.frames_saltados = 0
+        self.fps_captura = 0.0
+        self.fps_inferencia = 0.0
+        self.ultima_secuencia_inferida = 0
+        self.inferencias_ventana = 0
+        self.inicio_ventana_inferencia = time.time()
+        
+        # Evento compartido con GestorCamaras para despertar la inferencia por lotes
+        self.aviso_frame = None
+        
+        # JPEG compartidos entre todos los lectores del stream
+        self.cache_jpeg = CacheFramesJPEG()
+        
+        # Buffers de captura reutilizados y ranura que tiene prestada la inferencia
+        self.anillo = AnilloFrames(forma=(self.alto, self.ancho, 3))
+        self.ranura_inferencia = None
+        
+        # Grabación en su propio worker, con pre-grabación y writer abierto por adelantado
+        self.grabador = GrabadorClips(camara_id, VIDEO_OUTPUT_DIR, fps=self.fps,
+                                      soltar=self.anillo.soltar,
+                                      retencion=obtener_retencion(VIDEO_OUTPUT_DIR))
+        
+        # Seguimiento entre inferencias: IDs estables y cajas predichas en cada frame
+        self.seguidor = SeguidorObjetos()
+        
+        # Zona de interés: recorte y máscara precalculados para esta cámara
+        self.zona = ZonaInteres(ZONAS_INTERES.get(camara_id))
+        
+        # Entradas/salidas de objetos agrupadas en lotes pequeños para los clientes
+        self.eventos = EventosDeteccion(camara_id)
+        
+        # Puerta de movimiento delante del modelo
+        self.detector_movimiento = DetectorMovimiento() if USAR_DETECTOR_MOVIMIENTO else None
+        
         # Cargar modelo YOLOv8 solo si se solicita
         if self.cargar_yolo:
             self.cargar_modelo()
@@ -51,22 +398,34 @@ class CameraManager:
         # **IMPORTANTE: Conectar cámara en el main thread, no en capturar_frames**
         # Esto evita problemas de threading en Windows
         
-    def cargar_modelo(self):
-        """Cargar modelo YOLOv8"""
+    def cargar_modelo(self, backend=BACKEND_INFERENCIA):
+        """Cargar modelo YOLOv8 con el backend configurado (ver inferencia.py)
+        
+        Args:
+            backend: 'ultralytics', 'onnx', 'openvino' o 'tflite'
+        """
         try:
-            logger.info('📦 Cargando modelo YOLOv8...')
-            self.modelo = YOLO('yolov8n.pt')  # nano es más rápido
+            logger.info(f'📦 Cargando modelo YOLOv8 ({backend})...')
+            self.modelo = crear_backend(backend, clases=CLASES_DETECTAR, confianza=0.5,
+                                        tamano=TAMANO_INFERENCIA)
             logger.info('✅ Modelo YOLOv8 cargado')
         except Exception as e:
             logger.error(f'❌ Error cargando modelo: {e}')
             
-    def conectar_camara(self, camera_index=0):
-        """Conectar a la cámara (debe llamarse desde main thread en Windows)"""
+    def conectar_camara(self, camera_index=0, excluir=()):
+        """Conectar a la cámara (debe llamarse desde main thread en Windows)
+        
+        Args:
+            excluir: Índices ya abiertos por otras cámaras (solo al buscar en 0-4)
+        """
         try:
-            logger.info(f'📷 Buscando cámara...')
+            logger.info(f'📷 Buscando cámara {self.camara_id}...')
             
-            # Intentar con diferentes índices
-            indices_a_probar = [0, 1, 2, 3, 4]
+            # Índice fijo si está configurado; si no, probar los habituales
+            if self.indice is not None:
+                indices_a_probar = [self.indice]
+            else:
+                indices_a_probar = [i for i in [0, 1, 2, 3, 4] if i not in excluir]
             
             for idx in indices_a_probar:
                 logger.info(f'   Probando índice {idx}...')
@@ -86,8 +445,9 @@ class CameraManager:
                     ret, frame = cap.read()
                     logger.info(f'         Intento {intento+1}: ret={ret}')
                     if ret and frame is not None:
-                        logger.info(f'✅ Cámara encontrada en índice {idx}')
+                        logger.info(f'✅ Cámara {self.camara_id} encontrada en índice {idx}')
                         self.cap = cap
+                        self.indice = idx
                         break
                     time.sleep(0.5)
                 
@@ -98,7 +458,7 @@ class CameraManager:
                     cap.release()
             
             if self.cap is None or not self.cap.isOpened():
-                logger.error('❌ No se encontró ninguna cámara en índices 0-4')
+                logger.error(f'❌ No se encontró la cámara {self.camara_id} en índices {indices_a_probar}')
                 logger.error('   💡 Intenta:')
                 logger.error('      1. Desconecta y reconecta la cámara USB')
                 logger.error('      2. Cierra la app de Cámara de Windows')
@@ -110,8 +470,10 @@ class CameraManager:
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.ancho)
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.alto)
             self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+            # Buffer V4L2 mínimo: siempre leemos el frame más reciente
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
-            logger.info(f'✅ Cámara conectada ({self.ancho}x{self.alto}@{self.fps}fps)')
+            logger.info(f'✅ Cámara {self.camara_id} conectada ({self.ancho}x{self.alto}@{self.fps}fps)')
             return True
             
         except Exception as e:
@@ -121,153 +483,201 @@ class CameraManager:
             return False
             
     def detectar_objetos(self, frame):
-        """Detectar personas y perros en el frame"""
+        """Detectar personas y perros en el frame (no modifica el frame)"""
         if self.modelo is None:
-            return frame, []
+            return []
             
         try:
-            # Ejecutar detección
-            resultados = self.modelo(frame, conf=0.5, verbose=False)
-            detecciones = []
+            return self.modelo.inferir(frame)
+        except Exception as e:
+            logger.error(f'❌ Error en detección: {e}')
+            return []
             
-            # Procesar resultados
-            for result in resultados:
-                for box in result.boxes:
-                    clase_id = int(box.cls[0])
-                    clase_nombre = result.names[clase_id]
-                    confianza = float(box.conf[0])
-                    
-                    # Solo nos interesan personas y perros
-                    if clase_nombre in CLASES_DETECTAR:
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        
-                        # Dibujar rectángulo con más grosor para mejor visibilidad
-                        color = (0, 255, 0) if clase_nombre == 'person' else (255, 0, 0)
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 3)  # Grosor 3 en lugar de 2
-                        
-                        # Dibujar etiqueta con fondo oscuro para mejor legibilidad
-                        etiqueta = f'{clase_nombre} {confianza:.2f}'
-                        text_size = cv2.getTextSize(etiqueta, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                        
-                        # Fondo para el texto
-                        cv2.rectangle(frame, 
-                                    (x1, y1 - text_size[1] - 10),
-                                    (x1 + text_size[0], y1),
-                                    color, -1)  # -1 para rellenar
-                        
-                        # Texto blanco
-                        cv2.putText(frame, etiqueta, (x1, y1 - 5),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-                        
-                        detecciones.append({
-                            'clase': clase_nombre,
-                            'confianza': confianza,
-                            'bbox': (x1, y1, x2, y2)
-                        })
+    def dibujar_detecciones(self, frame, detecciones):
+        """Dibujar las cajas y etiquetas de las detecciones sobre el frame"""
+        return dibujar_detecciones(frame, detecciones)
+        
+    def tomar_frame_inferencia(self):
+        """Frame más reciente pendiente de inferir, si pasa la puerta de movimiento
+        
+        Returns:
+            (recorte de la zona de interés, instante, secuencia) o None si no hay
+            nada que inferir
+        """
+        ranura = self.anillo.prestar()
+        if ranura is None:
+            return None
+        if ranura.secuencia == self.ultima_secuencia_inferida:
+            self.anillo.soltar(ranura)
+            return None
+        instante, secuencia = ranura.instante, ranura.secuencia
+        # Solo la zona de interés (vista sin copia); el movimiento fuera de ella no cuenta
+        frame = self.zona.recortar(ranura.buffer)
+        
+        # Los frames capturados mientras se hacía la inferencia anterior se saltan
+        if self.ultima_secuencia_inferida:
+            self.frames_saltados += secuencia - self.ultima_secuencia_inferida - 1
+        self.ultima_secuencia_inferida = secuencia
+        
+        # Escena quieta: no merece la pena pasar el frame por la red
+        # (si hay objetos seguidos se sigue infiriendo para confirmarlos o soltarlos)
+        if self.detector_movimiento is not None and not self.detector_movimiento.debe_inferir(
+                frame, hay_detecciones=bool(self.seguidor.objetos)):
+            self.anillo.soltar(ranura)
+            return None
+        
+        # La ranura sigue prestada hasta aplicar_detecciones()
+        self.ranura_inferencia = ranura
+        return frame, instante, secuencia
+        
+    def aplicar_detecciones(self, detecciones, instante, secuencia):
+        """Incorporar el resultado del modelo para el frame `secuencia`
+        
+        Las cajas llegan en coordenadas del recorte: se reproyectan al frame
+        completo y se descartan las de fuera de la zona antes de seguirlas o dibujarlas
+        """
+        if self.ranura_inferencia is not None:
+            self.anillo.soltar(self.ranura_inferencia)
+            self.ranura_inferencia = None
+        
+        detecciones = self.zona.reproyectar(detecciones)
+        self.seguidor.actualizar(detecciones, instante)
+        
+        with self.lock:
+            self.secuencia_deteccion = secuencia
+        
+        self.inferencias_ventana += 1
+        transcurrido = time.time() - self.inicio_ventana_inferencia
+        if transcurrido >= 2.0:
+            self.fps_inferencia = self.inferencias_ventana / transcurrido
+            self.inferencias_ventana = 0
+            self.inicio_ventana_inferencia = time.time()
+        
+    def inferir_frames(self):
+        """Worker de inferencia: procesa siempre el frame más reciente (ejecutar en thread)
+        
+        Solo se usa con una cámara suelta; GestorCamaras infiere todas en lote
+        """
+        logger.info("🧠 [INFERENCIA] Worker iniciado")
+        
+        while self.cap is not None and self.cap.isOpened():
+            with self.nuevo_frame:
+                # Esperar a que haya un frame más nuevo que el último procesado
+                if self.secuencia == self.ultima_secuencia_inferida:
+                    self.nuevo_frame.wait(timeout=1.0)
             
-            return frame, detecciones
+            pendiente = self.tomar_frame_inferencia()
+            if pendiente is None:
+                continue
             
-        except Exception as e:
-            logger.error(f'❌ Error en detección: {e}')
-            return frame, []
+            frame, instante, secuencia = pendiente
+            self.aplicar_detecciones(self.detectar_objetos(frame), instante, secuencia)
+        
+        logger.info("⏹️ [INFERENCIA] Worker detenido")
             
     def iniciar_grabacion(self):
-        """Iniciar grabación de video"""
+        """Iniciar grabación de video (incluye los segundos previos de pre-grabación)"""
         if self.grabando:
             return
-            
-        try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            nombre_archivo = VIDEO_OUTPUT_DIR / f'video_{timestamp}.mp4'
-            
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            self.video_writer = cv2.VideoWriter(
-                str(nombre_archivo),
-                fourcc,
-                self.fps,
-                (self.ancho, self.alto)
-            )
-            
-            self.grabando = True
-            logger.info(f'🎥 Grabación iniciada: {nombre_archivo}')
-            
-        except Exception as e:
-            logger.error(f'❌ Error iniciando grabación: {e}')
+        self.grabador.iniciar_clip()
+        self.grabando = True
             
     def detener_grabacion(self):
         """Detener grabación"""
         if not self.grabando:
             return
-            
-        try:
-            if self.video_writer:
-                self.video_writer.release()
-            self.grabando = False
-            logger.info('⏹️ Grabación detenida')
-        except Exception as e:
-            logger.error(f'❌ Error deteniendo grabación: {e}')
-            
-    def escribir_frame_grabacion(self, frame):
-        """Escribir frame a archivo de video"""
-        if self.grabando and self.video_writer:
-            try:
-                self.video_writer.write(frame)
-            except Exception as e:
-                logger.error(f'❌ Error escribiendo frame: {e}')
+        self.grabador.detener_clip()
+        self.grabando = False
                 
     def capturar_frames(self):
-        """Capturar frames continuamente (ejecutar en thread)"""
+        """Capturar frames continuamente (ejecutar en thread)
+        
+        La captura nunca espera a YOLO: publica cada frame y, si hay modelo,
+        un worker aparte hace la inferencia sobre el más reciente
+        """
         try:
             logger.info("📹 [THREAD] Iniciando loop de lectura...")
             
             if self.cap is None or not self.cap.isOpened():
                 logger.error("❌ [THREAD] Cámara no está conectada")
                 return
+            
+            # Arrancar el worker de inferencia desacoplado de la captura
+            if self.modelo is not None and self.thread_inferencia is None:
+                self.thread_inferencia = threading.Thread(target=self.inferir_frames, daemon=True)
+                self.thread_inferencia.start()
+            self.grabador.arrancar()
                 
             frame_count = 0
             tiempo_sin_detecciones = 0
+            frames_ventana = 0
+            inicio_ventana = time.time()
             
             while self.cap.isOpened():
                 try:
-                    ret, frame = self.cap.read()
+                    # Leer directamente en un buffer del anillo (sin reservar memoria)
+                    ranura = self.anillo.libre()
+                    ret, frame = self.cap.read(image=ranura.buffer)
                     
                     if not ret:
                         logger.error('❌ [THREAD] Error leyendo frame')
                         break
+                    if frame is not ranura.buffer:
+                        self.anillo.adoptar(ranura, frame)
                     
                     frame_count += 1
+                    instante = time.time()
                     
-                    # Procesar con YOLOv8 en CADA frame para detección consistente
-                    frame_procesado = frame.copy()
-                    detecciones = []
+                    # Objetos confirmados con su caja predicha para este frame,
+                    # aunque el modelo no haya corrido sobre él
+                    detecciones = self.seguidor.predecir(instante)
                     
-                    if self.modelo is not None:  # Detectar en cada frame
-                        frame_procesado, detecciones = self.detectar_objetos(frame)
+                    # La captura no dibuja: el overlay lo pinta el primer consumidor
+                    # del stream que lo pida (grabación e inferencia usan el frame limpio)
+                    ranura.reiniciar(detecciones)
                     
-                    # Actualizar estado
-                    with self.lock:
-                        self.frame_actual = frame_procesado
+                    # Actualizar estado y avisar al worker de inferencia
+                    with self.nuevo_frame:
+                        self.secuencia += 1
+                        ranura.secuencia = self.secuencia
+                        ranura.instante = instante
+                        self.anillo.publicar(ranura)
                         self.detecciones = detecciones
+                        self.nuevo_frame.notify_all()
+                    if self.aviso_frame is not None:
+                        self.aviso_frame.set()
                     
-                    # Lógica de grabación automática
+                    # Todos los frames van al grabador: pre-grabación o clip en curso.
+                    # Se le presta la ranura y la suelta él al terminar (sin copia)
+                    self.anillo.retener(ranura)
+                    self.grabador.agregar_frame(frame, instante, ranura, detecciones)
+                    
+                    # Eventos de entrada/salida (se entregan como mucho cada INTERVALO_EVENTOS)
+                    self.eventos.actualizar(detecciones, instante)
+                    
+                    # Lógica de grabación automática: se graba mientras haya objetos
+                    # confirmados por el seguimiento, no por aciertos sueltos del modelo
                     if detecciones:  # Se detectó algo
                         if not self.grabando:
                             self.iniciar_grabacion()
                         tiempo_sin_detecciones = 0
-                        if self.grabando:
-                            self.escribir_frame_grabacion(frame_procesado)
                     else:  # No se detectó nada
                         tiempo_sin_detecciones += 1
                         
                         # Detener grabación después de 5 segundos sin detecciones
                         if self.grabando and tiempo_sin_detecciones > (self.fps * 5):
                             self.detener_grabacion()
-                        elif self.grabando:
-                            self.escribir_frame_grabacion(frame_procesado)
                     
                     if frame_count == 1:
                         logger.info(f"✅ [THREAD] ¡Primer frame capturado!")
                     
+                    frames_ventana += 1
+                    transcurrido = time.time() - inicio_ventana
+                    if transcurrido >= 2.0:
+                        self.fps_captura = frames_ventana / transcurrido
+                        frames_ventana = 0
+                        inicio_ventana = time.time()
+                    
                     # Sin logs frecuentes para no afectar rendimiento
                     
                 except Exception as e:
@@ -283,25 +693,74 @@ class CameraManager:
             import traceback
             traceback.print_exc()
                 
-    def obtener_frame_base64(self):
-        """Obtener frame actual codificado en Base64"""
-        with self.lock:
-            if self.frame_actual is None:
-                return None
-                
+    def esperar_frame(self, secuencia, timeout=1.0):
+        """Bloquear hasta que haya un frame posterior a `secuencia`
+        
+        Returns:
+            Secuencia actual (igual a `secuencia` si venció el timeout)
+        """
+        with self.nuevo_frame:
+            if self.secuencia == secuencia:
+                self.nuevo_frame.wait(timeout)
+            return self.secuencia
+        
+    @contextmanager
+    def prestar_frame(self, con_detecciones=DIBUJAR_DETECCIONES):
+        """Tomar prestado el frame actual sin copiarlo (con `with`)
+        
+        Mientras dure el bloque la captura no reutiliza ese buffer
+        
+        Args:
+            con_detecciones: True = con las cajas dibujadas, False = frame crudo
+        
+        Yields:
+            (frame BGR de solo lectura, secuencia) o (None, secuencia) si aún no hay frame
+        """
+        ranura = self.anillo.prestar()
+        if ranura is None:
+            yield None, self.secuencia
+            return
+        try:
+            yield ranura.vista(con_detecciones), ranura.secuencia
+        finally:
+            self.anillo.soltar(ranura)
+        
+    def obtener_frame(self, con_detecciones=DIBUJAR_DETECCIONES):
+        """Copia del frame actual sin codificar
+        
+        La ranura vuelve al anillo al salir, así que hay que copiarla; para
+        leer el frame sin copia, prestar_frame()
+        
+        Returns:
+            (frame BGR, secuencia) o (None, secuencia) si aún no hay frame
+        """
+        with self.prestar_frame(con_detecciones) as (frame, secuencia):
+            return (None if frame is None else frame.copy()), secuencia
+        
+    def obtener_jpeg(self, ancho=JPEG_ANCHO, alto=JPEG_ALTO, calidad=JPEG_CALIDAD, base64_=False,
+                     con_detecciones=DIBUJAR_DETECCIONES):
+        """Frame actual en JPEG desde la caché compartida
+        
+        El frame se toma prestado del anillo: la codificación se hace sin
+        bloquear al thread de captura y sin copiar el frame
+        
+        Returns:
+            (datos, secuencia) o (None, secuencia) si aún no hay frame
+        """
+        with self.prestar_frame(con_detecciones) as (frame, secuencia):
+            if frame is None:
+                return None, secuencia
             try:
-                # Redimensionar para menor tamaño (más rápido)
-                frame_resized = cv2.resize(self.frame_actual, (480, 360))
-                # Codificar frame a JPEG con calidad equilibrada para 60 FPS
-                ret, buffer = cv2.imencode('.jpg', frame_resized, [cv2.IMWRITE_JPEG_QUALITY, 60])
-                if ret:
-                    # Convertir a Base64
-                    frame_b64 = base64.b64encode(buffer).decode('utf-8')
-                    return frame_b64
+                return self.cache_jpeg.obtener(frame, secuencia, ancho, alto, calidad, base64_,
+                                               con_detecciones)
             except Exception as e:
                 logger.error(f'❌ Error codificando frame: {e}')
-                
-        return None
+                return None, secuencia
+        
+    def obtener_frame_base64(self):
+        """Obtener frame actual codificado en Base64"""
+        frame_b64, _ = self.obtener_jpeg(base64_=True)
+        return frame_b64
         
     def obtener_estado(self):
         """Obtener estado actual de la cámara"""
@@ -310,76 +769,295 @@ class CameraManager:
             clases_detectadas = [d['clase'] for d in self.detecciones]
             
             return {
+                'camara_id': self.camara_id,
                 'conectada': self.cap is not None and self.cap.isOpened(),
                 'grabando': self.grabando,
                 'detecciones': num_detecciones,
-                'clases': clases_detectadas
+                'clases': clases_detectadas,
+                'objetos': [{'track_id': d['track_id'], 'clase': d['clase'],
+                             'permanencia': d['permanencia']} for d in self.detecciones],
+                'secuencia': self.secuencia,
+                'secuencia_deteccion': self.secuencia_deteccion,
+                'fps_captura': round(self.fps_captura, 1),
+                'fps_inferencia': round(self.fps_inferencia, 1),
+                'frames_saltados': self.frames_saltados,
+                'movimiento': (self.detector_movimiento.obtener_estadisticas()
+                               if self.detector_movimiento is not None else None),
+                'zona': self.zona.obtener_estadisticas(),
+                'eventos': self.eventos.obtener_estadisticas(),
+                'jpeg': self.cache_jpeg.obtener_estadisticas(),
+                'anillo': self.anillo.obtener_estadisticas(),
+                'grabacion': self.grabador.obtener_estadisticas()
             }
             
     def cerrar(self):
         """Cerrar cámara y limpiar recursos"""
         try:
             self.detener_grabacion()
+            self.grabador.cerrar()
             if self.cap:
                 self.cap.release()
-            logger.info('✅ Cámara cerrada')
+            logger.info(f'✅ Cámara {self.camara_id} cerrada')
         except Exception as e:
             logger.error(f'❌ Error cerrando cámara: {e}')
 
 
+# ==================== VARIAS CÁMARAS ====================
+class GestorCamaras:
+    """Varias cámaras con un thread de captura cada una y una sola inferencia por lotes
+    
+    En cada ciclo se recoge el frame más nuevo de cada cámara que tenga algo
+    pendiente (y pase su puerta de movimiento) y se infieren todos juntos
+    con una única llamada al modelo en vez de N invocaciones separadas
+    """
+    
+    def __init__(self, camaras: Dict[str, Optional[int]] = None, cargar_yolo=False):
+        """
+        Args:
+            camaras: {camara_id: índice} (por defecto CAMARAS)
+            cargar_yolo: Si True, carga el modelo compartido por todas las cámaras
+        """
+        self.aviso_frame = threading.Event()
+        self.camaras: Dict[str, CameraManager] = {}
+        for camara_id, indice in (camaras if camaras is not None else CAMARAS).items():
+            camara = CameraManager(camara_id=camara_id, indice=indice)
+            camara.aviso_frame = self.aviso_frame
+            self.camaras[camara_id] = camara
+        
+        self.modelo = None
+        self.activo = False
+        self.thread_inferencia = None
+        
+        # Estadísticas de la inferencia por lotes
+        self.lotes = 0
+        self.frames_inferidos = 0
+        self.ultimo_lote_ms = 0.0
+        
+        if cargar_yolo:
+            self.cargar_modelo()
+    
+    def cargar_modelo(self, backend=BACKEND_INFERENCIA):
+        """Cargar un único modelo YOLOv8 para todas las cámaras"""
+        try:
+            logger.info(f'📦 Cargando modelo YOLOv8 ({backend}) para {len(self.camaras)} cámara(s)...')
+            self.modelo = crear_backend(backend, clases=CLASES_DETECTAR, confianza=0.5,
+                                        tamano=TAMANO_INFERENCIA)
+            logger.info('✅ Modelo YOLOv8 cargado')
+        except Exception as e:
+            logger.error(f'❌ Error cargando modelo: {e}')
+    
+    def conectar(self):
+        """Conectar todas las cámaras (en main thread); las que fallan se descartan
+        
+        Returns:
+            True si al menos una cámara quedó conectada
+        """
+        ocupados = {c.indice for c in self.camaras.values() if c.indice is not None}
+        for camara_id, camara in list(self.camaras.items()):
+            if camara.conectar_camara(excluir=ocupados):
+                ocupados.add(camara.indice)
+            else:
+                logger.warning(f'⚠️ Cámara {camara_id} no disponible, se descarta')
+                del self.camaras[camara_id]
+        return bool(self.camaras)
+    
+    def iniciar(self, max_espera=5):
+        """Arrancar un thread de captura por cámara y el worker de inferencia por lotes"""
+        self.activo = True
+        
+        # Índice de clips al día (y segmentos cortados por un apagón recuperados)
+        # antes de que los grabadores abran archivos nuevos
+        retencion = obtener_retencion(VIDEO_OUTPUT_DIR)
+        try:
+            retencion.sincronizar(self.camaras.keys())
+        except Exception as e:
+            logger.error(f'❌ Error sincronizando índice de clips: {e}')
+        retencion.arrancar()
+        
+        for camara in self.camaras.values():
+            threading.Thread(target=camara.capturar_frames, daemon=True,
+                             name=f'captura-{camara.camara_id}').start()
+        logger.info(f'🎬 {len(self.camaras)} thread(s) de lectura iniciados')
+        
+        if self.modelo is not None:
+            self.thread_inferencia = threading.Thread(target=self.inferir_lotes, daemon=True)
+            self.thread_inferencia.start()
+        
+        # Esperar a que cada cámara capture su primer frame
+        inicio = time.time()
+        for camara in self.camaras.values():
+            while camara.secuencia == 0 and time.time() - inicio < max_espera:
+                time.sleep(0.1)
+            if camara.secuencia == 0:
+                logger.error(f'❌ Timeout esperando primer frame de {camara.camara_id}')
+            else:
+                logger.info(f'✅ Primer frame capturado ({camara.camara_id})')
+    
+    def inferir_lotes(self):
+        """Worker de inferencia: un lote por ciclo con el último frame de cada cámara"""
+        logger.info("🧠 [INFERENCIA] Worker por lotes iniciado")
+        
+        while self.activo:
+            # Cualquier cámara con frame nuevo despierta el ciclo; limpiar antes de
+            # recoger para no perder avisos que lleguen mientras se infiere
+            self.aviso_frame.wait(timeout=1.0)
+            self.aviso_frame.clear()
+            
+            pendientes = []
+            for camara in list(self.camaras.values()):
+                pendiente = camara.tomar_frame_inferencia()
+                if pendiente is not None:
+                    pendientes.append((camara, pendiente))
+            if not pendientes:
+                continue
+            
+            inicio = time.perf_counter()
+            try:
+                resultados = self.modelo.inferir_lote([frame for _, (frame, _, _) in pendientes])
+            except Exception as e:
+                logger.error(f'❌ Error en detección por lotes: {e}')
+                resultados = [[] for _ in pendientes]
+            self.ultimo_lote_ms = (time.perf_counter() - inicio) * 1000
+            
+            for (camara, (_, instante, secuencia)), detecciones in zip(pendientes, resultados):
+                camara.aplicar_detecciones(detecciones, instante, secuencia)
+            
+            self.lotes += 1
+            self.frames_inferidos += len(pendientes)
+        
+        logger.info("⏹️ [INFERENCIA] Worker por lotes detenido")
+    
+    def obtener(self, camara_id=None) -> Optional[CameraManager]:
+        """Cámara por id (None = la primera configurada)"""
+        if camara_id is None:
+            return next(iter(self.camaras.values()), None)
+        return self.camaras.get(camara_id)
+    
+    def obtener_estado(self):
+        """Estado de todas las cámaras y de la inferencia por lotes"""
+        return {
+            'camaras': {camara_id: camara.obtener_estado()
+                        for camara_id, camara in self.camaras.items()},
+            'inferencia': {
+                'lotes': self.lotes,
+                'tamano_medio_lote': round(self.frames_inferidos / self.lotes, 2) if self.lotes else 0.0,
+                'ultimo_lote_ms': round(self.ultimo_lote_ms, 1)
+            },
+            'retencion': obtener_retencion(VIDEO_OUTPUT_DIR).obtener_estadisticas()
+        }
+    
+    def cerrar(self):
+        """Detener la inferencia y cerrar todas las cámaras"""
+        self.activo = False
+        self.aviso_frame.set()
+        for camara in self.camaras.values():
+            camara.cerrar()
+
+
 # ==================== FUNCIÓN GLOBAL ====================
-camera = None
+gestor = None
+camera = None  # Cámara por defecto (la primera), para el código de una sola cámara
 
-def inicializar_camera(cargar_yolo=False):
-    """Inicializar gestor de cámara global
+def inicializar_camera(cargar_yolo=False, camaras=None):
+    """Inicializar las cámaras configuradas
     
     Args:
         cargar_yolo: Si True, carga YOLOv8 para detección de objetos
+        camaras: {camara_id: índice} (por defecto CAMARAS)
+    
+    Returns:
+        La cámara por defecto, o None si no se conectó ninguna
     """
-    global camera
-    camera = CameraManager(cargar_yolo=cargar_yolo)
+    global gestor, camera
+    gestor = GestorCamaras(camaras, cargar_yolo=cargar_yolo)
     
-    # **IMPORTANTE: Conectar cámara en main thread PRIMERO**
-    logger.info('🔌 Conectando cámara en main thread...')
-    if not camera.conectar_camara():
-        logger.error('❌ No se pudo conectar a la cámara')
+    # **IMPORTANTE: Conectar cámaras en main thread PRIMERO**
+    logger.info('🔌 Conectando cámaras en main thread...')
+    if not gestor.conectar():
+        logger.error('❌ No se pudo conectar a ninguna cámara')
         return None
     
-    logger.info('✅ Cámara conectada')
+    logger.info(f'✅ Cámaras conectadas: {list(gestor.camaras)}')
     
-    # Ahora iniciar thread de captura (solo lectura)
-    thread_captura = threading.Thread(target=camera.capturar_frames, daemon=True)
-    thread_captura.start()
-    logger.info('🎬 Thread de lectura iniciado')
+    # Ahora iniciar threads de captura (solo lectura) e inferencia
+    gestor.iniciar()
     
-    # Esperar a que se capture el primer frame
-    max_espera = 5  # 5 segundos máximo
-    inicio = time.time()
-    while camera.frame_actual is None:
-        time.sleep(0.1)
-        if time.time() - inicio > max_espera:
-            logger.error('❌ Timeout esperando primer frame')
-            break
+    camera = gestor.obtener()
+    return camera
+
+def obtener_camera(camara_id=None):
+    """Obtener el CameraManager de una cámara (None = la de por defecto)"""
+    if gestor is None:
+        return None
+    return gestor.obtener(camara_id)
+
+def listar_camaras():
+    """Ids de las cámaras conectadas"""
+    if gestor is None:
+        return []
+    return list(gestor.camaras)
+
+def obtener_frame(camara_id=None, con_detecciones=DIBUJAR_DETECCIONES):
+    """Copia del frame BGR actual sin codificar y su secuencia"""
+    camara = obtener_camera(camara_id)
+    if camara is None:
+        return None, 0
+    return camara.obtener_frame(con_detecciones)
+
+def obtener_jpeg(camara_id=None, ancho=JPEG_ANCHO, alto=JPEG_ALTO, calidad=JPEG_CALIDAD,
+                 base64_=False, con_detecciones=DIBUJAR_DETECCIONES):
+    """JPEG actual (bytes de la caché compartida) y su secuencia"""
+    camara = obtener_camera(camara_id)
+    if camara is None:
+        return None, 0
+    return camara.obtener_jpeg(ancho, alto, calidad, base64_, con_detecciones)
+
+def suscribir_eventos(callback):
+    """Recibir los lotes de eventos de detección de todas las cámaras
     
-    if camera.frame_actual is not None:
-        logger.info('✅ Primer frame capturado')
+    El callback se llama desde el thread de captura: debe limitarse a encolar
     
-    return camera
+    Returns:
+        Función para cancelar la suscripción
+    """
+    if gestor is None:
+        return lambda: None
+    cancelaciones = [camara.eventos.suscribir(callback) for camara in gestor.camaras.values()]
+    def cancelar():
+        for cancelacion in cancelaciones:
+            cancelacion()
+    return cancelar
+
+def obtener_objetos_activos():
+    """Objetos anunciados ahora mismo en cada cámara (estado inicial de un cliente)"""
+    if gestor is None:
+        return []
+    return [camara.eventos.instantanea() for camara in gestor.camaras.values()]
 
-def obtener_frame_base64():
-    """Obtener frame en Base64 para enviar al frontend"""
-    if camera is None:
+def obtener_frame_base64(camara_id=None):
+    """Obtener frame en Base64 para enviar al frontend (solo para Socket.IO)"""
+    camara = obtener_camera(camara_id)
+    if camara is None:
         return None
-    return camera.obtener_frame_base64()
+    return camara.obtener_frame_base64()
 
-def obtener_estado_camera():
+def obtener_estado_camera(camara_id=None):
     """Obtener estado de la cámara"""
-    if camera is None:
+    camara = obtener_camera(camara_id)
+    if camara is None:
         return {'conectada': False, 'grabando': False}
-    return camera.obtener_estado()
+    return camara.obtener_estado()
+
+def obtener_estado_camaras():
+    """Obtener estado de todas las cámaras y de la inferencia por lotes"""
+    if gestor is None:
+        return {'camaras': {}, 'inferencia': None}
+    return gestor.obtener_estado()
 
 def cerrar_camera():
-    """Cerrar la cámara"""
-    global camera
-    if camera:
-        camera.cerrar()
+    """Cerrar todas las cámaras"""
+    global gestor, camera
+    if gestor:
+        gestor.cerrar()
+    gestor = None
+    camera = None
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+"""
+Motor de transmisión CAN nativo (SocketCAN)
+Envía las tramas desde el propio proceso con un socket raw persistente,
+sin lanzar `cangen` en un subproceso por cada comando
+"""
+
+import socket
+import struct
+import threading
+import heapq
+import time
+from collections import OrderedDict
+import errno
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Interfaz principal y alternativas (vcan0 para pruebas sin coche)
+INTERFAZ_CAN = 'can0'
+INTERFACES_RESPALDO = ['vcan0']
+
+# Misma semántica que `cangen can0 -g 2 ... -n 25`
+RAFAGA_NUM_TRAMAS = 25
+RAFAGA_INTERVALO_MS = 2
+
+# Reintentos cuando la cola TX del kernel está llena (ENOBUFS)
+REINTENTOS_ENOBUFS = 5
+
+# Comandos distintos (por idCAN) que pueden esperar en la cola de transmisión
+CAPACIDAD_COLA = 32
+
+# Tramas precompiladas que se guardan en la caché LRU
+CAPACIDAD_CACHE_TRAMAS = 128
+
+# DLC mínimo de los comandos del backend: antes se lanzaba `cangen -L 5`, así que un
+# datosCAN más corto sale relleno con ceros hasta 5 bytes, como entonces
+DLC_COMANDO = 5
+
+# struct can_frame de Linux: can_id (u32), can_dlc (u8), 3 bytes de relleno, data[8]
+FORMATO_TRAMA = '=IB3x8s'
+TAMANO_TRAMA = struct.calcsize(FORMATO_TRAMA)  # 16 bytes
+
+# El transmisor marca sus tramas en un byte reservado de struct can_frame (__res0),
+# que no sale al bus, para que el receptor reconozca el eco de lo que enviamos
+# (MSG_DONTROUTE solo dice que la trama salió de este equipo y no existe en el loopback)
+OFFSET_MARCA_ECO = 6
+MARCA_ECO = 0x01
+
+CAN_EFF_FLAG = 0x80000000  # Identificador extendido (29 bits)
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+
+
+# ==================== EMPAQUETADO DE TRAMAS ====================
+def parsear_id_can(id_can: str) -> int:
+    """
+    Convierte el idCAN hexadecimal del backend al can_id del kernel
+
+    Igual que cangen: ids de más de 3 dígitos o mayores de 0x7FF son extendidos
+
+    Args:
+        id_can: Identificador en hexadecimal (ej: '14C')
+
+    Returns:
+        can_id listo para empaquetar (con CAN_EFF_FLAG si es extendido)
+    """
+    texto = str(id_can).strip()
+    if texto.lower().startswith('0x'):
+        texto = texto[2:]
+
+    try:
+        valor = int(texto, 16)
+    except ValueError:
+        raise ValueError(f'idCAN no es hexadecimal: {id_can!r}')
+
+    if valor < 0 or valor > CAN_EFF_MASK:
+        raise ValueError(f'idCAN fuera de rango: {id_can!r}')
+
+    if len(texto) > 3 or valor > CAN_SFF_MASK:
+        return valor | CAN_EFF_FLAG
+    return valor
+
+
+def parsear_datos_can(datos_can: str) -> bytes:
+    """
+    Convierte el datosCAN hexadecimal del backend a bytes
+
+    Args:
+        datos_can: Payload en hexadecimal (ej: '8080000080'), admite '.' y espacios
+
+    Returns:
+        Payload en bytes (máximo 8)
+    """
+    texto = str(datos_can).replace('.', '').replace(' ', '').strip()
+
+    if len(texto) % 2 != 0:
+        raise ValueError(f'datosCAN con número impar de dígitos: {datos_can!r}')
+
+    try:
+        datos = bytes.fromhex(texto)
+    except ValueError:
+        raise ValueError(f'datosCAN no es hexadecimal: {datos_can!r}')
+
+    if len(datos) > 8:
+        raise ValueError(f'datosCAN supera 8 bytes (DLC={len(datos)}): {datos_can!r}')
+
+    return datos
+
+
+def empaquetar_trama(can_id: int, datos: bytes) -> bytes:
+    """Empaqueta can_id + payload en el formato binario de struct can_frame"""
+    return struct.pack(FORMATO_TRAMA, can_id, len(datos), datos.ljust(8, b'\x00'))
+
+
+def desempaquetar_trama(trama: bytes) -> Tuple[int, bytes]:
+    """Devuelve (can_id, payload) a partir de una struct can_frame binaria"""
+    can_id, dlc, datos = struct.unpack(FORMATO_TRAMA, trama[:TAMANO_TRAMA])
+    return can_id, datos[:dlc]
+
+
+def construir_trama(id_can: str, datos_can: str) -> bytes:
+    """Parsea y empaqueta una trama a partir de los strings del backend (DLC ≥ DLC_COMANDO)"""
+    datos = parsear_datos_can(datos_can).ljust(DLC_COMANDO, b'\x00')
+    return empaquetar_trama(parsear_id_can(id_can), datos)
+
+
+def formatear_id(can_id: int) -> str:
+    """Formatear un can_id como lo muestra candump (3 u 8 dígitos)"""
+    if can_id & CAN_EFF_FLAG:
+        return f'{can_id & CAN_EFF_MASK:08X}'
+    return f'{can_id & CAN_SFF_MASK:03X}'
+
+
+# ==================== CACHÉ DE TRAMAS ====================
+class CacheTramasCAN:
+    """
+    Caché LRU de tramas ya empaquetadas, indexada por (idCAN, datosCAN) tal cual llegan
+
+    La validación (rango del id, DLC ≤ 8, hexadecimal correcto) se hace solo
+    al insertar; un acierto es una búsqueda en diccionario
+    """
+
+    def __init__(self, capacidad: int = CAPACIDAD_CACHE_TRAMAS):
+        self.capacidad = capacidad
+        self.tramas = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, id_can: str, datos_can: str) -> bytes:
+        """
+        Obtener la trama empaquetada, compilándola la primera vez
+
+        Raises:
+            ValueError: Si idCAN o datosCAN no son válidos
+        """
+        clave = (id_can, datos_can)
+        with self.lock:
+            trama = self.tramas.get(clave)
+            if trama is not None:
+                self.tramas.move_to_end(clave)
+                self.aciertos += 1
+                return trama
+            self.fallos += 1
+
+        # Compilar fuera del lock; si es inválida no se guarda
+        trama = construir_trama(id_can, datos_can)
+        self._insertar(clave, trama)
+        return trama
+
+    def _insertar(self, clave: Tuple[str, str], trama: bytes):
+        """Guardar una trama expulsando la menos usada si se supera la capacidad"""
+        with self.lock:
+            self.tramas[clave] = trama
+            self.tramas.move_to_end(clave)
+            while len(self.tramas) > self.capacidad:
+                self.tramas.popitem(last=False)
+                self.expulsiones += 1
+
+    def precalentar(self, comandos: Iterable[Dict]) -> int:
+        """
+        Precompilar una tabla de comandos conocidos al arrancar
+
+        Args:
+            comandos: Diccionarios con 'idCAN' y 'datosCAN' (mismo formato que el backend)
+
+        Returns:
+            Número de tramas cargadas
+        """
+        cargadas = 0
+        for comando in comandos:
+            id_can = comando.get('idCAN')
+            datos_can = comando.get('datosCAN')
+            try:
+                self._insertar((id_can, datos_can), construir_trama(id_can, datos_can))
+                cargadas += 1
+            except ValueError as e:
+                logger.error(f'❌ Comando inválido en la tabla CAN: {e}')
+
+        logger.info(f'🔥 Caché de tramas CAN precargada ({cargadas} comandos)')
+        return cargadas
+
+    def obtener_estadisticas(self) -> Dict:
+        """Obtener contadores de la caché"""
+        with self.lock:
+            return {
+                'tramas': len(self.tramas),
+                'capacidad': self.capacidad,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones
+            }
+
+
+# ==================== BUS LOOPBACK ====================
+_bus_loopback = None
+_bus_loopback_lock = threading.Lock()
+
+
+def obtener_bus_loopback() -> Tuple[socket.socket, socket.socket]:
+    """
+    Par de sockets compartido que hace de bus CAN cuando no hay can0 ni vcan0
+
+    Lo que se escribe en el primer extremo se lee en el segundo,
+    con el mismo formato binario que un socket CAN_RAW
+
+    Returns:
+        (extremo_tx, extremo_rx)
+    """
+    global _bus_loopback
+    with _bus_loopback_lock:
+        if _bus_loopback is None:
+            tx, rx = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            # Si nadie lee el extremo RX no queremos bloquear la transmisión
+            tx.setblocking(False)
+            _bus_loopback = (tx, rx)
+        return _bus_loopback
+
+
+def marcar_eco(trama: bytes) -> bytes:
+    """Copia de la trama marcada como enviada por nosotros"""
+    marcada = bytearray(trama)
+    marcada[OFFSET_MARCA_ECO] |= MARCA_ECO
+    return bytes(marcada)
+
+
+def es_eco_propio(trama) -> bool:
+    """True si una trama leída del bus la envió un TransmisorCAN con marcar=True"""
+    return bool(trama[OFFSET_MARCA_ECO] & MARCA_ECO)
+
+
+# ==================== TRANSMISOR ====================
+class TransmisorCAN:
+    """Socket CAN_RAW persistente que envía tramas y ráfagas con temporización precisa"""
+
+    def __init__(self, interfaz: str = INTERFAZ_CAN,
+                 respaldo: Optional[List[str]] = None,
+                 permitir_loopback: bool = True,
+                 traza=None, marcar: bool = True):
+        """
+        Args:
+            interfaz: Interfaz SocketCAN principal
+            respaldo: Interfaces alternativas si la principal no existe
+            permitir_loopback: Si True, usa el bus loopback cuando no hay ninguna interfaz
+            traza: GrabadorTraza opcional donde se apunta cada trama enviada
+            marcar: Marcar las tramas para que nuestro receptor ignore su eco
+                    (False al reproducir trazas: lo reproducido debe leerse como recibido)
+        """
+        self.interfaz = interfaz
+        self.respaldo = INTERFACES_RESPALDO if respaldo is None else respaldo
+        self.permitir_loopback = permitir_loopback
+        self.traza = traza
+        self.marcar = marcar
+        self.sock = None
+        self.interfaz_activa = None
+        self.lock = threading.Lock()
+
+        # Estadísticas
+        self.tramas_enviadas = 0
+        self.rafagas_enviadas = 0
+        self.tramas_descartadas = 0
+        self.errores = 0
+        self.ultima_latencia_ms = 0.0
+        self.ultima_duracion_rafaga_ms = 0.0
+
+    def abrir(self) -> bool:
+        """
+        Abrir el socket CAN (can0 → vcan0 → loopback)
+
+        Returns:
+            True si hay un bus disponible para transmitir
+        """
+        if self.sock is not None:
+            return True
+
+        for nombre in [self.interfaz] + list(self.respaldo):
+            try:
+                sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+                sock.bind((nombre,))
+                self.sock = sock
+                self.interfaz_activa = nombre
+                logger.info(f'✅ Socket CAN abierto en {nombre}')
+                return True
+            except (OSError, AttributeError) as e:
+                logger.warning(f'⚠️ No se pudo abrir {nombre}: {e}')
+
+        if self.permitir_loopback:
+            self.sock, _ = obtener_bus_loopback()
+            self.interfaz_activa = 'loopback'
+            logger.warning('⚠️ Sin interfaz CAN, usando bus loopback (solo pruebas)')
+            return True
+
+        logger.error('❌ No hay ninguna interfaz CAN disponible')
+        return False
+
+    def cerrar(self):
+        """Cerrar el socket CAN (el bus loopback compartido se mantiene)"""
+        with self.lock:
+            if self.sock is not None and self.interfaz_activa != 'loopback':
+                try:
+                    self.sock.close()
+                except OSError:
+                    pass
+            self.sock = None
+            self.interfaz_activa = None
+
+    def _escribir(self, trama: bytes) -> bool:
+        """Escribir una trama en el socket reintentando si la cola TX está llena"""
+        for intento in range(REINTENTOS_ENOBUFS):
+            try:
+                self.sock.send(marcar_eco(trama) if self.marcar else trama)
+                self.tramas_enviadas += 1
+                if self.traza is not None:
+                    self.traza.registrar_trama(trama, tx=True)
+                return True
+            except BlockingIOError:
+                # Bus loopback sin lector: la trama se pierde, como en un bus sin nodos
+                self.tramas_descartadas += 1
+                return False
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                time.sleep(0.0005 * (intento + 1))
+
+        self.tramas_descartadas += 1
+        return False
+
+    @staticmethod
+    def _esperar_hasta(instante: float):
+        """Dormir hasta `instante` (perf_counter); el último tramo se hace en espera activa"""
+        while True:
+            restante = instante - time.perf_counter()
+            if restante <= 0:
+                return
+            if restante > 0.001:
+                time.sleep(restante - 0.001)
+
+    def enviar_trama(self, trama: bytes) -> bool:
+        """Enviar una única trama ya empaquetada"""
+        if self.sock is None and not self.abrir():
+            return False
+
+        with self.lock:
+            try:
+                return self._escribir(trama)
+            except OSError as e:
+                self.errores += 1
+                logger.error(f'❌ Error enviando trama CAN: {e}')
+                return False
+
+    def enviar_rafaga(self, trama: bytes,
+                      num_tramas: int = RAFAGA_NUM_TRAMAS,
+                      intervalo_ms: float = RAFAGA_INTERVALO_MS,
+                      instante_recepcion: Optional[float] = None,
+                      cancelar: Optional[threading.Event] = None) -> bool:
+        """
+        Enviar la misma trama `num_tramas` veces separadas `intervalo_ms`
+
+        Los instantes se calculan desde el inicio de la ráfaga, así que
+        el error de un `sleep` no se acumula entre tramas
+
+        Args:
+            trama: Trama empaquetada (ver construir_trama)
+            num_tramas: Número de repeticiones (cangen -n)
+            intervalo_ms: Separación entre tramas (cangen -g)
+            instante_recepcion: perf_counter() de llegada del comando, para medir latencia
+            cancelar: Si se activa, la ráfaga se corta antes de la siguiente trama
+
+        Returns:
+            True si se enviaron todas las tramas
+        """
+        if self.sock is None and not self.abrir():
+            return False
+
+        intervalo = intervalo_ms / 1000.0
+        enviadas = 0
+
+        with self.lock:
+            inicio = time.perf_counter()
+            if instante_recepcion is not None:
+                self.ultima_latencia_ms = (inicio - instante_recepcion) * 1000
+
+            try:
+                for i in range(num_tramas):
+                    if i:
+                        self._esperar_hasta(inicio + i * intervalo)
+                    if cancelar is not None and cancelar.is_set():
+                        break
+                    if self._escribir(trama):
+                        enviadas += 1
+            except OSError as e:
+                self.errores += 1
+                logger.error(f'❌ Error enviando ráfaga CAN: {e}')
+                return False
+
+            self.ultima_duracion_rafaga_ms = (time.perf_counter() - inicio) * 1000
+            self.rafagas_enviadas += 1
+
+        return enviadas == num_tramas
+
+    def enviar_comando(self, id_can: str, datos_can: str, **kwargs) -> bool:
+        """Parsear idCAN/datosCAN del backend y enviar la ráfaga"""
+        return self.enviar_rafaga(construir_trama(id_can, datos_can), **kwargs)
+
+    def obtener_estadisticas(self) -> Dict:
+        """Obtener estadísticas del transmisor"""
+        return {
+            'interfaz': self.interfaz_activa,
+            'tramas_enviadas': self.tramas_enviadas,
+            'rafagas_enviadas': self.rafagas_enviadas,
+            'tramas_descartadas': self.tramas_descartadas,
+            'errores': self.errores,
+            'ultima_latencia_ms': round(self.ultima_latencia_ms, 3),
+            'ultima_duracion_rafaga_ms': round(self.ultima_duracion_rafaga_ms, 3)
+        }
+
+
+# ==================== COLA DE COMANDOS ====================
+class ColaComandosCAN:
+    """
+    Cola acotada y con prioridad de comandos CAN, vaciada por un hilo transmisor
+
+    Los comandos con el mismo can_id se fusionan: solo se envía el último estado.
+    Si llega un comando nuevo para el can_id que se está transmitiendo,
+    la ráfaga en curso se corta para no sacar al bus un estado obsoleto
+    """
+
+    def __init__(self, transmisor: TransmisorCAN, capacidad: int = CAPACIDAD_COLA):
+        """
+        Args:
+            transmisor: Transmisor que envía las ráfagas
+            capacidad: Máximo de can_id distintos esperando
+        """
+        self.transmisor = transmisor
+        self.capacidad = capacidad
+        self.condicion = threading.Condition()
+        self.pendientes = {}   # can_id -> comando
+        self.heap = []         # (-prioridad, secuencia, can_id)
+        self.secuencia = 0
+        self.activo = False
+        self.thread = None
+
+        # Ráfaga en transmisión
+        self.id_en_curso = None
+        self.cancelar_en_curso = threading.Event()
+
+        # Estadísticas
+        self.encolados = 0
+        self.coalescidos = 0
+        self.descartados = 0
+        self.interrumpidos = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.profundidad_maxima = 0
+        self.latencia_media_ms = 0.0
+        self.latencia_maxima_ms = 0.0
+
+    def iniciar(self):
+        """Arrancar el hilo transmisor"""
+        if self.activo:
+            return
+        self.activo = True
+        self.thread = threading.Thread(target=self._bucle_transmision, daemon=True)
+        self.thread.start()
+        logger.info('🚌 Cola de transmisión CAN iniciada')
+
+    def detener(self, timeout: float = 1.0):
+        """Parar el hilo transmisor (los comandos pendientes se descartan)"""
+        with self.condicion:
+            self.activo = False
+            self.cancelar_en_curso.set()
+            self.condicion.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def encolar(self, trama: bytes, prioridad: int = 0, descripcion: str = '',
+                instante_recepcion: Optional[float] = None) -> bool:
+        """
+        Añadir un comando sin bloquear
+
+        Args:
+            trama: Trama empaquetada (ver construir_trama)
+            prioridad: Mayor número = se envía antes
+            descripcion: Texto para los logs
+            instante_recepcion: perf_counter() de llegada del comando
+
+        Returns:
+            False si la cola está llena y el comando se descartó
+        """
+        if instante_recepcion is None:
+            instante_recepcion = time.perf_counter()
+        can_id = struct.unpack_from('=I', trama)[0]
+
+        with self.condicion:
+            self.encolados += 1
+
+            # El estado nuevo deja obsoleta la ráfaga que se está enviando
+            if can_id == self.id_en_curso:
+                self.cancelar_en_curso.set()
+
+            comando = self.pendientes.get(can_id)
+            if comando is not None:
+                # Fusionar: mismo can_id, nos quedamos con el último estado
+                self.coalescidos += 1
+                comando['trama'] = trama
+                comando['descripcion'] = descripcion
+                comando['instante'] = instante_recepcion
+                if prioridad > comando['prioridad']:
+                    comando['prioridad'] = prioridad
+                    heapq.heappush(self.heap, (-prioridad, comando['secuencia'], can_id))
+                return True
+
+            if len(self.pendientes) >= self.capacidad and not self._liberar_hueco(prioridad):
+                self.descartados += 1
+                logger.warning(f'⚠️ Cola CAN llena, descartado {formatear_id(can_id)}')
+                return False
+
+            self.secuencia += 1
+            self.pendientes[can_id] = {
+                'trama': trama,
+                'prioridad': prioridad,
+                'secuencia': self.secuencia,
+                'descripcion': descripcion,
+                'instante': instante_recepcion
+            }
+            heapq.heappush(self.heap, (-prioridad, self.secuencia, can_id))
+            self.profundidad_maxima = max(self.profundidad_maxima, len(self.pendientes))
+            self.condicion.notify()
+            return True
+
+    def _liberar_hueco(self, prioridad: int) -> bool:
+        """Expulsar el comando menos prioritario (y más antiguo) si vale menos que el nuevo"""
+        victima = min(self.pendientes.items(),
+                      key=lambda item: (item[1]['prioridad'], item[1]['secuencia']))
+        if victima[1]['prioridad'] >= prioridad:
+            return False
+        del self.pendientes[victima[0]]
+        self.descartados += 1
+        return True
+
+    def _siguiente(self):
+        """Sacar el comando más prioritario (llamar con la condición adquirida)"""
+        while self.heap:
+            menos_prioridad, secuencia, can_id = heapq.heappop(self.heap)
+            comando = self.pendientes.get(can_id)
+            # Entradas del heap que quedaron obsoletas tras fusionar o expulsar
+            if (comando is None or comando['secuencia'] != secuencia
+                    or comando['prioridad'] != -menos_prioridad):
+                continue
+            del self.pendientes[can_id]
+            return can_id, comando
+        return None, None
+
+    def _bucle_transmision(self):
+        """Hilo que vacía la cola enviando una ráfaga por comando"""
+        while True:
+            with self.condicion:
+                while self.activo and not self.pendientes:
+                    self.condicion.wait()
+                if not self.activo:
+                    return
+                can_id, comando = self._siguiente()
+                if comando is None:
+                    continue
+                self.id_en_curso = can_id
+                self.cancelar_en_curso.clear()
+
+            espera_ms = (time.perf_counter() - comando['instante']) * 1000
+            ok = self.transmisor.enviar_rafaga(comando['trama'],
+                                               instante_recepcion=comando['instante'],
+                                               cancelar=self.cancelar_en_curso)
+
+            with self.condicion:
+                self.id_en_curso = None
+                if ok:
+                    self.enviados += 1
+                elif self.cancelar_en_curso.is_set():
+                    self.interrumpidos += 1
+                else:
+                    self.fallidos += 1
+
+                # Media exponencial de la espera en cola
+                self.latencia_media_ms += 0.1 * (espera_ms - self.latencia_media_ms)
+                self.latencia_maxima_ms = max(self.latencia_maxima_ms, espera_ms)
+
+            if ok:
+                logger.info(f'✅ Comando CAN ejecutado correctamente: {comando["descripcion"]} '
+                            f'({espera_ms:.3f} ms hasta el bus)')
+            elif not self.cancelar_en_curso.is_set():
+                logger.error(f'❌ Ráfaga CAN incompleta en {self.transmisor.interfaz_activa}')
+
+    def obtener_estadisticas(self) -> Dict:
+        """Obtener contadores de la cola"""
+        with self.condicion:
+            return {
+                'profundidad': len(self.pendientes),
+                'profundidad_maxima': self.profundidad_maxima,
+                'capacidad': self.capacidad,
+                'encolados': self.encolados,
+                'coalescidos': self.coalescidos,
+                'descartados': self.descartados,
+                'interrumpidos': self.interrumpidos,
+                'enviados': self.enviados,
+                'fallidos': self.fallidos,
+                'latencia_media_ms': round(self.latencia_media_ms, 3),
+                'latencia_maxima_ms': round(self.latencia_maxima_ms, 3)
+            }
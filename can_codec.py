@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Códec de señales CAN a partir de un fichero DBC
+Decodifica lotes de tramas con NumPy y codifica comandos con nombre a payloads
+"""
+
+import re
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from can_bus import CAN_EFF_FLAG, CAN_EFF_MASK, formatear_id
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Fichero DBC por defecto (junto a este módulo)
+DBC_POR_DEFECTO = Path(__file__).with_name('senales_coche.dbc')
+
+# Nodo del DBC que es esta Raspberry Pi (emisor de los mensajes de comando)
+NODO_PROPIO = 'RPI'
+
+# Subconjunto de la sintaxis DBC que usamos: mensajes (BO_) y señales (SG_)
+PATRON_MENSAJE = re.compile(r'^BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)\s+(\w+)')
+PATRON_SENAL = re.compile(
+    r'^SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*'
+    r'\(([^,]+),([^)]+)\)\s*\[([^|]+)\|([^\]]+)\]\s*"([^"]*)"'
+)
+
+
+# ==================== DEFINICIONES ====================
+class Senal:
+    """Señal de un mensaje con su posición ya convertida a desplazamiento + máscara"""
+
+    def __init__(self, nombre: str, inicio: int, longitud: int, little_endian: bool,
+                 con_signo: bool, factor: float, offset: float,
+                 minimo: float, maximo: float, unidad: str = ''):
+        self.nombre = nombre
+        self.inicio = inicio
+        self.longitud = longitud
+        self.little_endian = little_endian
+        self.con_signo = con_signo
+        self.factor = factor
+        self.offset = offset
+        self.minimo = minimo
+        self.maximo = maximo
+        self.unidad = unidad
+        self.mascara = (1 << longitud) - 1
+
+        if little_endian:
+            # Intel: el bit de inicio es el LSB sobre el payload leído en little-endian
+            self.desplazamiento = inicio
+        else:
+            # Motorola: el bit de inicio es el MSB; se pasa a posición sobre el payload big-endian
+            msb = (7 - inicio // 8) * 8 + inicio % 8
+            self.desplazamiento = msb - longitud + 1
+
+        if self.desplazamiento < 0 or self.desplazamiento + longitud > 64:
+            raise ValueError(f'Señal {nombre} fuera de los 64 bits del payload')
+
+
+class Mensaje:
+    """Mensaje CAN del DBC con sus señales y las tablas precalculadas para NumPy"""
+
+    def __init__(self, can_id: int, nombre: str, dlc: int, emisor: str):
+        self.can_id = can_id
+        self.nombre = nombre
+        self.dlc = dlc
+        self.emisor = emisor
+        self.senales: List[Senal] = []
+
+    def compilar(self):
+        """Precalcular los vectores de desplazamientos, máscaras y escalas"""
+        self.nombres = [s.nombre for s in self.senales]
+        self.desplazamientos = np.array([s.desplazamiento for s in self.senales], dtype=np.uint64)
+        self.mascaras = np.array([s.mascara for s in self.senales], dtype=np.uint64)
+        self.es_motorola = np.array([not s.little_endian for s in self.senales], dtype=bool)
+        self.bits_signo = np.array([(1 << (s.longitud - 1)) if s.con_signo else 0
+                                    for s in self.senales], dtype=np.int64)
+        self.rangos = np.array([1 << s.longitud for s in self.senales], dtype=np.float64)
+        self.factores = np.array([s.factor for s in self.senales], dtype=np.float64)
+        self.offsets = np.array([s.offset for s in self.senales], dtype=np.float64)
+        self.hay_motorola = bool(self.es_motorola.any())
+        self.hay_signo = bool(self.bits_signo.any())
+
+
+# ==================== CÓDEC ====================
+class CodecCAN:
+    """Carga un DBC una vez y decodifica/codifica señales sin manipular bits trama a trama"""
+
+    def __init__(self, ruta_dbc=DBC_POR_DEFECTO):
+        """
+        Args:
+            ruta_dbc: Fichero DBC con los mensajes y señales del coche
+        """
+        self.ruta = Path(ruta_dbc)
+        self.mensajes: Dict[int, Mensaje] = {}
+        self.por_nombre: Dict[str, Mensaje] = {}
+        self.senal_a_mensaje: Dict[str, Mensaje] = {}
+        # Último payload mandado por mensaje: base de los comandos con solo algunas señales
+        self.ultimos_comandos: Dict[int, bytes] = {}
+        self.lock_comandos = threading.Lock()
+        self.cargar()
+
+    def cargar(self):
+        """Parsear el DBC (solo BO_ y SG_; las señales multiplexadas se ignoran)"""
+        mensaje = None
+        with open(self.ruta, encoding='utf-8', errors='replace') as f:
+            for linea in f:
+                linea = linea.strip()
+
+                coincidencia = PATRON_MENSAJE.match(linea)
+                if coincidencia:
+                    dbc_id, nombre, dlc, emisor = coincidencia.groups()
+                    dbc_id = int(dbc_id)
+                    # En DBC el bit 31 marca los identificadores extendidos
+                    if dbc_id & 0x80000000:
+                        can_id = (dbc_id & CAN_EFF_MASK) | CAN_EFF_FLAG
+                    else:
+                        can_id = dbc_id
+                    mensaje = Mensaje(can_id, nombre, int(dlc), emisor)
+                    self.mensajes[can_id] = mensaje
+                    self.por_nombre[nombre] = mensaje
+                    continue
+
+                coincidencia = PATRON_SENAL.match(linea)
+                if coincidencia and mensaje is not None:
+                    (nombre, multiplex, inicio, longitud, orden, signo,
+                     factor, offset, minimo, maximo, unidad) = coincidencia.groups()
+                    if multiplex:
+                        logger.warning(f'⚠️ Señal multiplexada {nombre} no soportada, se ignora')
+                        continue
+                    senal = Senal(nombre, int(inicio), int(longitud), orden == '1',
+                                  signo == '-', float(factor), float(offset),
+                                  float(minimo), float(maximo), unidad)
+                    mensaje.senales.append(senal)
+                    self.senal_a_mensaje[nombre] = mensaje
+
+        for mensaje in self.mensajes.values():
+            mensaje.compilar()
+
+        logger.info(f'📖 DBC cargado: {len(self.mensajes)} mensajes, '
+                    f'{len(self.senal_a_mensaje)} señales ({self.ruta.name})')
+
+    # ---------- Decodificación ----------
+    @staticmethod
+    def _extraer(mensaje: Mensaje, datos: np.ndarray) -> np.ndarray:
+        """
+        Valores físicos de todas las señales del mensaje para un lote de payloads
+
+        Args:
+            datos: Array (N, 8) uint8 con los payloads (rellenados con ceros)
+
+        Returns:
+            Array (N, num_senales) float64
+        """
+        datos = np.ascontiguousarray(datos, dtype=np.uint8)
+        crudo = datos.view('<u8').astype(np.uint64, copy=False)  # (N, 1)
+        if mensaje.hay_motorola:
+            crudo_be = datos.view('>u8').astype(np.uint64)
+            crudo = np.where(mensaje.es_motorola, crudo_be, crudo)
+
+        valores = (crudo >> mensaje.desplazamientos) & mensaje.mascaras
+
+        if mensaje.hay_signo:
+            valores = valores.astype(np.int64)
+            negativos = (valores & mensaje.bits_signo) != 0
+            valores = np.where(negativos, valores - mensaje.rangos, valores)
+
+        return valores * mensaje.factores + mensaje.offsets
+
+    def decodificar_lote(self, ids: np.ndarray, datos: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Decodificar un lote de tramas capturadas en una pasada vectorizada por mensaje
+
+        Args:
+            ids: Array (N,) con los can_id
+            datos: Array (N, 8) uint8 con los payloads
+
+        Returns:
+            {nombre_mensaje: {'indices': filas del lote, señal: valores físicos, ...}}
+        """
+        ids = np.asarray(ids)
+        resultado = {}
+        for can_id in np.unique(ids):
+            mensaje = self.mensajes.get(int(can_id))
+            if mensaje is None or not mensaje.senales:
+                continue
+            indices = np.flatnonzero(ids == can_id)
+            valores = self._extraer(mensaje, datos[indices])
+            decodificado = {'indices': indices}
+            for columna, nombre in enumerate(mensaje.nombres):
+                decodificado[nombre] = valores[:, columna]
+            resultado[mensaje.nombre] = decodificado
+        return resultado
+
+    def decodificar(self, can_id: int, payload: bytes) -> Dict[str, float]:
+        """Decodificar una sola trama (devuelve {} si el ID no está en el DBC)"""
+        mensaje = self.mensajes.get(can_id)
+        if mensaje is None or not mensaje.senales:
+            return {}
+        datos = np.frombuffer(payload[:8].ljust(8, b'\x00'), dtype=np.uint8).reshape(1, 8)
+        valores = self._extraer(mensaje, datos)[0]
+        return dict(zip(mensaje.nombres, valores.tolist()))
+
+    # ---------- Codificación ----------
+    def codificar(self, nombre_mensaje: str, valores: Dict[str, float],
+                  base: Optional[bytes] = None) -> Tuple[int, bytes]:
+        """
+        Codificar valores físicos con nombre en el payload de un mensaje
+
+        Las señales que no se indican conservan su valor: se parte de `base` o,
+        si no se da, del último payload mandado para ese mensaje
+        (ver recordar_comando). Sin ninguno de los dos hay que indicarlas todas,
+        para no mandar a 0 lo que el comando no pretendía tocar
+
+        Args:
+            nombre_mensaje: Nombre del mensaje en el DBC (ej: 'VENTANAS_CMD')
+            valores: {señal: valor físico}; se recortan a [min|max] del DBC
+            base: Payload de partida para las señales que no se indican
+
+        Returns:
+            (can_id, payload de DLC bytes)
+
+        Raises:
+            ValueError: Mensaje o señal desconocidos, o comando parcial sin payload de partida
+        """
+        mensaje = self.por_nombre.get(nombre_mensaje)
+        if mensaje is None:
+            raise ValueError(f'Mensaje desconocido en el DBC: {nombre_mensaje!r}')
+
+        if base is None:
+            with self.lock_comandos:
+                base = self.ultimos_comandos.get(mensaje.can_id)
+        if base is None:
+            faltan = [nombre for nombre in mensaje.nombres if nombre not in valores]
+            if faltan:
+                raise ValueError(f'{nombre_mensaje} no se ha mandado todavía: faltan las señales '
+                                 f'{", ".join(faltan)}')
+            base = b''
+
+        base = base[:8].ljust(8, b'\x00')
+        palabra_le = int.from_bytes(base, 'little')
+        senales = {s.nombre: s for s in mensaje.senales}
+
+        for nombre, valor in valores.items():
+            senal = senales.get(nombre)
+            if senal is None:
+                raise ValueError(f'La señal {nombre!r} no pertenece a {nombre_mensaje}')
+
+            if senal.maximo > senal.minimo:
+                valor = min(max(float(valor), senal.minimo), senal.maximo)
+            crudo = int(round((valor - senal.offset) / senal.factor)) & senal.mascara
+
+            if senal.little_endian:
+                desplazamiento = senal.desplazamiento
+            else:
+                # Mismo bit sobre la palabra big-endian, llevado a la little-endian
+                palabra_be = int.from_bytes(palabra_le.to_bytes(8, 'little'), 'big')
+                palabra_be &= ~(senal.mascara << senal.desplazamiento)
+                palabra_be |= crudo << senal.desplazamiento
+                palabra_le = int.from_bytes(palabra_be.to_bytes(8, 'big'), 'little')
+                continue
+
+            palabra_le &= ~(senal.mascara << desplazamiento)
+            palabra_le |= crudo << desplazamiento
+
+        return mensaje.can_id, palabra_le.to_bytes(8, 'little')[:mensaje.dlc]
+
+    def codificar_senales(self, valores: Dict[str, float]) -> List[Tuple[int, bytes]]:
+        """
+        Codificar señales sueltas agrupándolas por su mensaje
+        (ej: {'ventana_del_izq': 40} → trama de VENTANAS_CMD)
+        """
+        por_mensaje: Dict[str, Dict[str, float]] = {}
+        for nombre, valor in valores.items():
+            mensaje = self.senal_a_mensaje.get(nombre)
+            if mensaje is None:
+                raise ValueError(f'Señal desconocida en el DBC: {nombre!r}')
+            por_mensaje.setdefault(mensaje.nombre, {})[nombre] = valor
+
+        return [self.codificar(nombre, senales) for nombre, senales in por_mensaje.items()]
+
+    def recordar_comando(self, can_id: int, payload: bytes):
+        """Apuntar el payload que se acaba de mandar para un mensaje del DBC"""
+        if can_id in self.mensajes:
+            with self.lock_comandos:
+                self.ultimos_comandos[can_id] = bytes(payload)
+
+    def ids(self, excluir_emisor: Optional[str] = None) -> List[int]:
+        """can_id de todos los mensajes con señales (salvo los que envía `excluir_emisor`)"""
+        return [can_id for can_id, m in self.mensajes.items()
+                if m.senales and m.emisor != excluir_emisor]
+
+    def describir(self, can_id: int) -> str:
+        """Nombre legible de un mensaje para los logs"""
+        mensaje = self.mensajes.get(can_id)
+        return mensaje.nombre if mensaje else formatear_id(can_id)
+
+
+# ==================== INSTANCIA GLOBAL ====================
+_codec: Optional[CodecCAN] = None
+
+
+def obtener_codec() -> CodecCAN:
+    """Códec cargado una sola vez con el DBC por defecto"""
+    global _codec
+    if _codec is None:
+        _codec = CodecCAN()
+    return _codec
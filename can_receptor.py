@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Receptor CAN: escucha el bus, decodifica señales y las envía agrupadas al backend
+Usa filtros del kernel para que el proceso solo despierte con los IDs del DBC
+"""
+
+import socket
+import struct
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from can_codec import NODO_PROPIO, CodecCAN, obtener_codec
+from can_bus import (INTERFAZ_CAN, INTERFACES_RESPALDO, CAN_EFF_FLAG, CAN_SFF_MASK,
+                     CAN_EFF_MASK, TAMANO_TRAMA, obtener_bus_loopback, formatear_id,
+                     es_eco_propio)
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Intervalo de agrupación: como mucho un emit por intervalo
+INTERVALO_EMISION = 0.1  # segundos
+
+# Buffer de recepción del kernel (a 500 kbit/s el bus puede llegar a ~4500 tramas/s)
+BUFFER_RECEPCION = 1024 * 1024
+
+CAN_RTR_FLAG = 0x40000000
+SOL_CAN_RAW = getattr(socket, 'SOL_CAN_RAW', 101)
+CAN_RAW_FILTER = getattr(socket, 'CAN_RAW_FILTER', 1)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+
+# ==================== FILTROS ====================
+def empaquetar_filtros(ids) -> bytes:
+    """Construir el array de struct can_filter para CAN_RAW_FILTER"""
+    filtros = b''
+    for can_id in ids:
+        if can_id & CAN_EFF_FLAG:
+            mascara = CAN_EFF_MASK | CAN_EFF_FLAG | CAN_RTR_FLAG
+        else:
+            mascara = CAN_SFF_MASK | CAN_EFF_FLAG | CAN_RTR_FLAG
+        filtros += struct.pack('=II', can_id, mascara)
+    return filtros
+
+
+# ==================== RECEPTOR ====================
+class ReceptorCAN:
+    """Hilo lector del bus CAN que emite solo los cambios de las señales configuradas"""
+
+    def __init__(self, callback: Optional[Callable[[Dict], None]] = None,
+                 codec: Optional[CodecCAN] = None,
+                 interfaz: str = INTERFAZ_CAN,
+                 respaldo: Optional[List[str]] = None,
+                 intervalo_emision: float = INTERVALO_EMISION,
+                 traza=None, nodo: str = NODO_PROPIO):
+        """
+        Args:
+            callback: Función que recibe el diccionario de señales cambiadas
+            codec: Códec con los mensajes a escuchar (por defecto el DBC del coche)
+            interfaz: Interfaz SocketCAN principal
+            respaldo: Interfaces alternativas si la principal no existe
+            intervalo_emision: Segundos entre emisiones agrupadas
+            traza: GrabadorTraza opcional donde se apunta cada trama recibida
+            nodo: Nodo del DBC que somos: no se escuchan los mensajes que enviamos nosotros
+        """
+        self.callback = callback
+        self.codec = obtener_codec() if codec is None else codec
+        self.ids = set(self.codec.ids(excluir_emisor=nodo))
+        self.interfaz = interfaz
+        self.respaldo = INTERFACES_RESPALDO if respaldo is None else respaldo
+        self.intervalo_emision = intervalo_emision
+        self.traza = traza
+
+        self.sock = None
+        self.interfaz_activa = None
+        self.filtro_software = False
+        self.activo = False
+        self.thread_lectura = None
+        self.thread_emision = None
+
+        # Estado decodificado y cambios pendientes de emitir
+        self.lock = threading.Lock()
+        self.ultimos_payloads = {}
+        self.payloads_pendientes = {}  # can_id -> último payload aún sin decodificar
+        self.valores = {}
+
+        # Estadísticas
+        self.tramas_recibidas = 0
+        self.tramas_repetidas = 0
+        self.tramas_perdidas = 0
+        self.tramas_eco = 0            # Ecos de nuestras propias tramas, descartados
+        self.emisiones = 0
+
+    def abrir(self) -> bool:
+        """Abrir el socket de recepción con los filtros del kernel (can0 → vcan0 → loopback)"""
+        for nombre in [self.interfaz] + list(self.respaldo):
+            try:
+                sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+                sock.setsockopt(SOL_CAN_RAW, CAN_RAW_FILTER, empaquetar_filtros(self.ids))
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_RECEPCION)
+                    # Contador de tramas perdidas por desbordamiento del buffer
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                except OSError as e:
+                    logger.warning(f'⚠️ No se pudo ajustar el buffer de recepción: {e}')
+                sock.bind((nombre,))
+                self.sock = sock
+                self.interfaz_activa = nombre
+                logger.info(f'✅ Receptor CAN escuchando en {nombre} '
+                            f'({len(self.ids)} IDs filtrados en el kernel)')
+                return True
+            except (OSError, AttributeError) as e:
+                logger.warning(f'⚠️ Receptor: no se pudo abrir {nombre}: {e}')
+
+        # Sin SocketCAN: escuchar el bus loopback y filtrar aquí
+        _, self.sock = obtener_bus_loopback()
+        self.interfaz_activa = 'loopback'
+        self.filtro_software = True
+        logger.warning('⚠️ Receptor CAN usando bus loopback (solo pruebas)')
+        return True
+
+    def iniciar(self):
+        """Arrancar los hilos de lectura y de emisión"""
+        if self.activo:
+            return
+        if self.sock is None:
+            self.abrir()
+
+        self.activo = True
+        self.thread_lectura = threading.Thread(target=self._bucle_lectura, daemon=True)
+        self.thread_emision = threading.Thread(target=self._bucle_emision, daemon=True)
+        self.thread_lectura.start()
+        self.thread_emision.start()
+        logger.info('👂 Receptor CAN iniciado')
+
+    def detener(self):
+        """Parar los hilos (el socket se cierra salvo que sea el loopback compartido)"""
+        self.activo = False
+        if self.sock is not None and self.interfaz_activa != 'loopback':
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def _bucle_lectura(self):
+        """Leer tramas en un buffer reutilizado y apuntar solo los payloads que cambian"""
+        buffer = bytearray(TAMANO_TRAMA)
+        vista = memoryview(buffer)
+        tam_ancillary = socket.CMSG_SPACE(4)
+        self.sock.settimeout(0.5)
+
+        while self.activo:
+            try:
+                nbytes, ancdata, flags, _ = self.sock.recvmsg_into([buffer], tam_ancillary)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.activo:
+                    logger.error(f'❌ Error leyendo del bus CAN: {e}')
+                break
+
+            if nbytes < TAMANO_TRAMA:
+                continue
+
+            self.tramas_recibidas += 1
+            for nivel, tipo, datos in ancdata:
+                if nivel == socket.SOL_SOCKET and tipo == SO_RXQ_OVFL and len(datos) >= 4:
+                    self.tramas_perdidas = struct.unpack('=I', datos[:4])[0]
+
+            can_id, dlc = struct.unpack_from('=IB', buffer)
+            if can_id not in self.ids:
+                # Solo ocurre en el loopback, donde no hay filtro del kernel
+                continue
+
+            # Eco de una trama nuestra: ya está en la traza como TX y no es estado del coche
+            if es_eco_propio(buffer):
+                self.tramas_eco += 1
+                continue
+            if self.traza is not None:
+                self.traza.registrar_trama(buffer)
+
+            payload = vista[8:8 + dlc]
+            if self.ultimos_payloads.get(can_id) == payload:
+                self.tramas_repetidas += 1
+                continue
+            payload = bytes(payload)
+            self.ultimos_payloads[can_id] = payload
+            with self.lock:
+                self.payloads_pendientes[can_id] = payload
+
+        logger.info('⏹️ Receptor CAN detenido')
+
+    def _decodificar_pendientes(self) -> Dict:
+        """Decodificar de una vez los payloads nuevos del intervalo y quedarse con los cambios"""
+        with self.lock:
+            if not self.payloads_pendientes:
+                return {}
+            pendientes, self.payloads_pendientes = self.payloads_pendientes, {}
+
+        ids = np.fromiter(pendientes.keys(), dtype=np.uint32, count=len(pendientes))
+        datos = np.frombuffer(b''.join(p.ljust(8, b'\x00') for p in pendientes.values()),
+                              dtype=np.uint8).reshape(-1, 8)
+
+        cambios = {}
+        for decodificado in self.codec.decodificar_lote(ids, datos).values():
+            for nombre, valores in decodificado.items():
+                if nombre == 'indices':
+                    continue
+                valor = valores[-1].item()
+                if self.valores.get(nombre) != valor:
+                    cambios[nombre] = valor
+
+        with self.lock:
+            self.valores.update(cambios)
+        return cambios
+
+    def _bucle_emision(self):
+        """Emitir los cambios acumulados como mucho una vez por intervalo"""
+        while self.activo:
+            time.sleep(self.intervalo_emision)
+            cambios = self._decodificar_pendientes()
+            if not cambios:
+                continue
+
+            self.emisiones += 1
+            if self.callback is not None:
+                try:
+                    self.callback(cambios)
+                except Exception as e:
+                    logger.error(f'❌ Error emitiendo estado CAN: {e}')
+
+    def obtener_estado(self) -> Dict:
+        """Últimos valores decodificados de todas las señales"""
+        with self.lock:
+            return dict(self.valores)
+
+    def obtener_estadisticas(self) -> Dict:
+        """Obtener contadores del receptor"""
+        return {
+            'interfaz': self.interfaz_activa,
+            'ids_filtrados': [formatear_id(can_id) for can_id in sorted(self.ids)],
+            'tramas_recibidas': self.tramas_recibidas,
+            'tramas_repetidas': self.tramas_repetidas,
+            'tramas_perdidas': self.tramas_perdidas,
+            'tramas_eco': self.tramas_eco,
+            'emisiones': self.emisiones
+        }
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+Trazas binarias del bus CAN: grabación, lectura con mmap y reproducción en vcan0
+
+Formato (little-endian):
+    Cabecera de 32 bytes: magic 'CANTRZ01', versión, registros por bloque, instante de creación
+    Registros de 24 bytes: timestamp (f64), can_id (u32), dlc (u8), flags (u8), relleno, datos[8]
+    Cada bloque empieza con un registro índice (flags=INDICE) con el timestamp de su
+    primera trama, así que buscar un instante es una búsqueda binaria sobre los índices
+    y otra dentro del bloque, sin cargar el fichero en memoria
+
+Uso:
+    python3 can_traza.py info trazas_can/can_20250101_120000.bin
+    python3 can_traza.py volcar trazas_can/can_20250101_120000.bin --desde 1735732800
+    python3 can_traza.py reproducir trazas_can/can_20250101_120000.bin --interfaz vcan0
+"""
+
+import os
+import mmap
+import struct
+import threading
+import time
+import logging
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from can_bus import TransmisorCAN, desempaquetar_trama, empaquetar_trama, formatear_id
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+TRAZAS_DIR = Path('trazas_can')
+
+MAGIC = b'CANTRZ01'
+VERSION = 1
+FORMATO_CABECERA = '<8sHHd12x'
+TAMANO_CABECERA = struct.calcsize(FORMATO_CABECERA)  # 32 bytes
+
+FORMATO_REGISTRO = '<dIBB2x8s'
+TAMANO_REGISTRO = struct.calcsize(FORMATO_REGISTRO)  # 24 bytes
+
+# Mismo registro como dtype de NumPy para leer tramos enteros sin copiar
+DTYPE_REGISTRO = np.dtype([
+    ('timestamp', '<f8'), ('can_id', '<u4'), ('dlc', 'u1'),
+    ('flags', 'u1'), ('relleno', 'V2'), ('datos', 'u1', (8,))
+])
+
+# Flags de cada registro
+FLAG_TX = 0x01      # Trama enviada por nosotros (si no, recibida)
+FLAG_INDICE = 0x80  # Registro índice al inicio de cada bloque
+
+REGISTROS_POR_BLOQUE = 1024
+
+# El escritor hace fsync cada N registros o cada T segundos, lo que llegue antes
+REGISTROS_POR_FSYNC = 512
+INTERVALO_FSYNC = 1.0
+
+# Rotación y retención: tamaño máximo de un fichero, de todas las trazas juntas
+# y antigüedad máxima (días; 0 = sin límite)
+MAX_MB_TRAZA = 64
+MAX_MB_TRAZAS = 512
+MAX_DIAS_TRAZAS = 30
+
+
+def nueva_ruta_traza(directorio: Path = TRAZAS_DIR) -> Path:
+    """trazas_can/can_<fecha>.bin, con sufijo si ya existe una de ese mismo segundo"""
+    directorio.mkdir(exist_ok=True)
+    base = f'can_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+    ruta, n = directorio / f'{base}.bin', 1
+    while ruta.exists():
+        ruta, n = directorio / f'{base}_{n}.bin', n + 1
+    return ruta
+
+
+def aplicar_retencion_trazas(directorio: Path = TRAZAS_DIR, max_mb: float = MAX_MB_TRAZAS,
+                             max_dias: float = MAX_DIAS_TRAZAS, conservar: Optional[Path] = None) -> int:
+    """
+    Borrar las trazas más antiguas hasta cumplir la cuota de espacio y la antigüedad
+
+    Args:
+        conservar: Traza en curso, que nunca se borra
+
+    Returns:
+        Número de trazas borradas
+    """
+    trazas = sorted((r for r in Path(directorio).glob('can_*.bin') if r != conservar),
+                    key=lambda r: r.stat().st_mtime)
+    total = sum(r.stat().st_size for r in trazas)
+    if conservar is not None and conservar.exists():
+        total += conservar.stat().st_size
+    ahora = time.time()
+    borradas = 0
+    for ruta in trazas:
+        caducada = max_dias and ahora - ruta.stat().st_mtime > max_dias * 86400
+        if not caducada and total <= max_mb * 1024 ** 2:
+            break
+        total -= ruta.stat().st_size
+        ruta.unlink(missing_ok=True)
+        borradas += 1
+    if borradas:
+        logger.info(f'🧹 Trazas CAN: {borradas} fichero(s) antiguos borrados')
+    return borradas
+
+
+# ==================== ESCRITOR ====================
+class GrabadorTraza:
+    """Escritor append-only de trazas CAN con fsync agrupado"""
+
+    def __init__(self, ruta=None, registros_por_bloque: int = REGISTROS_POR_BLOQUE,
+                 registros_por_fsync: int = REGISTROS_POR_FSYNC,
+                 intervalo_fsync: float = INTERVALO_FSYNC,
+                 max_mb: float = MAX_MB_TRAZA):
+        """
+        Args:
+            ruta: Fichero de traza (por defecto trazas_can/can_<fecha>.bin, con rotación)
+            registros_por_bloque: Tramas entre registros índice
+            registros_por_fsync: Tramas acumuladas antes de forzar escritura + fsync
+            intervalo_fsync: Segundos máximos sin hacer fsync
+            max_mb: Tamaño a partir del cual se pasa a un fichero nuevo (solo con ruta=None)
+        """
+        # Con una ruta explícita se escribe siempre en ella: ni rotación ni retención
+        self.rotar = ruta is None
+        if ruta is None:
+            ruta = nueva_ruta_traza()
+        self.ruta = Path(ruta)
+        self.max_huecos = int(max_mb * 1024 ** 2) // TAMANO_REGISTRO
+        self.registros_por_fsync = registros_por_fsync
+        self.intervalo_fsync = intervalo_fsync
+
+        self.lock = threading.Lock()
+        self.lock_archivo = threading.Lock()
+        self.evento_volcado = threading.Event()
+        self.buffer = bytearray()
+        self.pendientes = 0
+        self.ultimo_timestamp = 0.0
+        self.activo = True
+
+        # Estadísticas
+        self.registros = 0
+        self.fsyncs = 0
+
+        self.archivo = self._abrir(registros_por_bloque)
+        if self.rotar:
+            aplicar_retencion_trazas(self.ruta.parent, conservar=self.ruta)
+
+        self.thread = threading.Thread(target=self._bucle_volcado, daemon=True)
+        self.thread.start()
+        logger.info(f'📼 Traza CAN: {self.ruta}')
+
+    def _abrir(self, registros_por_bloque: int):
+        """Abrir el fichero creando la cabecera o continuando uno existente"""
+        if self.ruta.exists() and self.ruta.stat().st_size >= TAMANO_CABECERA:
+            with open(self.ruta, 'rb') as f:
+                magic, _, self.registros_por_bloque, _ = struct.unpack(
+                    FORMATO_CABECERA, f.read(TAMANO_CABECERA))
+            if magic != MAGIC:
+                raise ValueError(f'{self.ruta} no es una traza CAN')
+
+            # Descartar un registro a medias de una escritura interrumpida
+            huecos = (self.ruta.stat().st_size - TAMANO_CABECERA) // TAMANO_REGISTRO
+            archivo = open(self.ruta, 'r+b')
+            archivo.truncate(TAMANO_CABECERA + huecos * TAMANO_REGISTRO)
+            if huecos:
+                # Se sigue desde el último timestamp escrito
+                archivo.seek(TAMANO_CABECERA + (huecos - 1) * TAMANO_REGISTRO)
+                self.ultimo_timestamp = struct.unpack('<d', archivo.read(8))[0]
+            archivo.seek(0, os.SEEK_END)
+            self.huecos = huecos
+            self.bloques = -(-huecos // (self.registros_por_bloque + 1))
+            return archivo
+
+        self.registros_por_bloque = registros_por_bloque
+        self.huecos = 0
+        self.bloques = 0
+        return self._crear(self.ruta)
+
+    def _crear(self, ruta: Path):
+        """Crear un fichero de traza vacío con su cabecera"""
+        archivo = open(ruta, 'wb')
+        archivo.write(struct.pack(FORMATO_CABECERA, MAGIC, VERSION,
+                                  self.registros_por_bloque, time.time()))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+        return archivo
+
+    def registrar(self, can_id: int, datos: bytes, tx: bool = False,
+                  timestamp: Optional[float] = None):
+        """Añadir una trama a la traza (solo memoria; el disco lo toca el hilo de volcado)
+
+        Los timestamps nunca retroceden (LectorTraza.buscar hace búsqueda binaria):
+        se toman dentro del lock, para que los hilos TX y RX no se adelanten entre
+        sí, y se igualan al anterior si el reloj del sistema da un salto atrás
+        """
+        with self.lock:
+            if not self.activo:
+                return
+            if timestamp is None:
+                timestamp = time.time()
+            timestamp = max(timestamp, self.ultimo_timestamp)
+            self.ultimo_timestamp = timestamp
+            if self.huecos % (self.registros_por_bloque + 1) == 0:
+                self.buffer += struct.pack(FORMATO_REGISTRO, timestamp, self.bloques,
+                                           0, FLAG_INDICE, b'\x00' * 8)
+                self.bloques += 1
+                self.huecos += 1
+
+            self.buffer += struct.pack(FORMATO_REGISTRO, timestamp, can_id, len(datos),
+                                       FLAG_TX if tx else 0, datos.ljust(8, b'\x00'))
+            self.huecos += 1
+            self.registros += 1
+            self.pendientes += 1
+
+            if self.pendientes >= self.registros_por_fsync:
+                self.evento_volcado.set()
+
+    def registrar_trama(self, trama: bytes, tx: bool = False,
+                        timestamp: Optional[float] = None):
+        """Añadir una struct can_frame binaria (la misma que viaja por el socket)"""
+        can_id, datos = desempaquetar_trama(trama)
+        self.registrar(can_id, datos, tx, timestamp)
+
+    def volcar(self):
+        """Escribir a disco lo pendiente y hacer fsync"""
+        with self.lock:
+            if not self.pendientes:
+                return
+            buffer, self.buffer = self.buffer, bytearray()
+            self.pendientes = 0
+            # Fichero lleno: lo que llegue desde ahora se numera para el siguiente
+            rotar = self.rotar and self.activo and self.huecos >= self.max_huecos
+            if rotar:
+                self.huecos = 0
+                self.bloques = 0
+
+        # El fsync puede tardar en la SD: se hace sin bloquear a registrar()
+        with self.lock_archivo:
+            self.archivo.write(buffer)
+            self.archivo.flush()
+            os.fsync(self.archivo.fileno())
+            self.fsyncs += 1
+            if rotar:
+                self.archivo.close()
+                anterior, self.ruta = self.ruta, nueva_ruta_traza(self.ruta.parent)
+                self.archivo = self._crear(self.ruta)
+
+        if rotar:
+            logger.info(f'📼 Traza CAN rotada: {anterior.name} → {self.ruta.name}')
+            aplicar_retencion_trazas(self.ruta.parent, conservar=self.ruta)
+
+    def _bucle_volcado(self):
+        """Volcar cada `registros_por_fsync` tramas o cada `intervalo_fsync` segundos"""
+        while self.activo:
+            self.evento_volcado.wait(self.intervalo_fsync)
+            self.evento_volcado.clear()
+            try:
+                self.volcar()
+            except (OSError, ValueError) as e:
+                logger.error(f'❌ Error escribiendo traza CAN: {e}')
+
+    def cerrar(self):
+        """Volcar lo pendiente y cerrar el fichero"""
+        if not self.activo:
+            return
+        self.activo = False
+        self.evento_volcado.set()
+        self.thread.join(timeout=2)
+        self.volcar()
+        with self.lock_archivo:
+            self.archivo.close()
+        logger.info(f'📼 Traza CAN cerrada ({self.registros} tramas)')
+
+
+# ==================== LECTOR ====================
+class LectorTraza:
+    """Lector de trazas por mmap con búsqueda por instante en O(log n)"""
+
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self.archivo = open(self.ruta, 'rb')
+        self.mm = mmap.mmap(self.archivo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.registros_por_bloque, self.creada = struct.unpack_from(
+            FORMATO_CABECERA, self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{self.ruta} no es una traza CAN')
+
+        # Un registro incompleto al final (corte de luz) se ignora
+        self.huecos = (len(self.mm) - TAMANO_CABECERA) // TAMANO_REGISTRO
+        self.tam_bloque = self.registros_por_bloque + 1
+        self.bloques = -(-self.huecos // self.tam_bloque)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+    def cerrar(self):
+        self.mm.close()
+        self.archivo.close()
+
+    def __len__(self):
+        """Número de tramas (sin contar los registros índice)"""
+        return self.huecos - self.bloques
+
+    def _timestamp(self, hueco: int) -> float:
+        return struct.unpack_from('<d', self.mm, TAMANO_CABECERA + hueco * TAMANO_REGISTRO)[0]
+
+    def buscar(self, instante: float) -> int:
+        """
+        Primer hueco cuyo timestamp es >= instante
+
+        Returns:
+            Índice de hueco (puede ser self.huecos si no hay ninguno)
+        """
+        # Búsqueda binaria sobre los registros índice de cada bloque
+        inicio, fin = 0, self.bloques
+        while inicio < fin:
+            medio = (inicio + fin) // 2
+            if self._timestamp(medio * self.tam_bloque) < instante:
+                inicio = medio + 1
+            else:
+                fin = medio
+        bloque = max(inicio - 1, 0)
+
+        # Búsqueda binaria dentro del bloque (saltando su registro índice)
+        inicio = bloque * self.tam_bloque + 1
+        fin = min((bloque + 1) * self.tam_bloque, self.huecos)
+        while inicio < fin:
+            medio = (inicio + fin) // 2
+            if self._timestamp(medio) < instante:
+                inicio = medio + 1
+            else:
+                fin = medio
+        return inicio
+
+    def _rango(self, desde: Optional[float], hasta: Optional[float]) -> Tuple[int, int]:
+        inicio = 0 if desde is None else self.buscar(desde)
+        fin = self.huecos if hasta is None else self.buscar(hasta)
+        return inicio, fin
+
+    def leer(self, desde: Optional[float] = None,
+             hasta: Optional[float] = None) -> Iterator[Tuple[float, int, bytes, bool]]:
+        """
+        Recorrer las tramas entre dos instantes
+
+        Yields:
+            (timestamp, can_id, datos, tx)
+        """
+        inicio, fin = self._rango(desde, hasta)
+        for hueco in range(inicio, fin):
+            timestamp, can_id, dlc, flags, datos = struct.unpack_from(
+                FORMATO_REGISTRO, self.mm, TAMANO_CABECERA + hueco * TAMANO_REGISTRO)
+            if flags & FLAG_INDICE:
+                continue
+            yield timestamp, can_id, datos[:dlc], bool(flags & FLAG_TX)
+
+    def leer_array(self, desde: Optional[float] = None,
+                   hasta: Optional[float] = None) -> np.ndarray:
+        """
+        Tramas entre dos instantes como array estructurado de NumPy
+        (vista sobre el mmap hasta filtrar los índices; listo para CodecCAN.decodificar_lote)
+        """
+        inicio, fin = self._rango(desde, hasta)
+        registros = np.frombuffer(self.mm, dtype=DTYPE_REGISTRO, count=fin - inicio,
+                                  offset=TAMANO_CABECERA + inicio * TAMANO_REGISTRO)
+        return registros[(registros['flags'] & FLAG_INDICE) == 0]
+
+
+# ==================== REPRODUCCIÓN ====================
+def reproducir(ruta, interfaz: str = 'vcan0', desde: Optional[float] = None,
+               hasta: Optional[float] = None, velocidad: float = 1.0,
+               solo_rx: bool = False) -> int:
+    """
+    Reenviar una traza a un bus respetando los tiempos originales entre tramas
+
+    Args:
+        ruta: Fichero de traza
+        interfaz: Bus de destino (vcan0 para no tocar el coche)
+        desde/hasta: Ventana temporal a reproducir (timestamps)
+        velocidad: 2.0 = el doble de rápido
+        solo_rx: Si True, solo reenvía las tramas que se recibieron del coche
+
+    Returns:
+        Número de tramas enviadas
+
+    Raises:
+        OSError: Si la interfaz no existe (nunca se cae al bus loopback, que no
+            sacaría nada a ningún bus)
+    """
+    transmisor = TransmisorCAN(interfaz=interfaz, respaldo=[], permitir_loopback=False,
+                               marcar=False)
+    if not transmisor.abrir():
+        raise OSError(f'No se puede reproducir: la interfaz CAN {interfaz} no está disponible')
+
+    enviadas = 0
+    with LectorTraza(ruta) as lector:
+        logger.info(f'▶️ Reproduciendo {len(lector)} tramas de {lector.ruta} en {interfaz}')
+        t0_traza = None
+        t0 = time.perf_counter()
+        for timestamp, can_id, datos, tx in lector.leer(desde, hasta):
+            if solo_rx and tx:
+                continue
+            if t0_traza is None:
+                t0_traza = timestamp
+            TransmisorCAN._esperar_hasta(t0 + (timestamp - t0_traza) / velocidad)
+            if transmisor.enviar_trama(empaquetar_trama(can_id, datos)):
+                enviadas += 1
+
+    transmisor.cerrar()
+    logger.info(f'⏹️ Reproducción terminada ({enviadas} tramas)')
+    return enviadas
+
+
+def main():
+    """Herramienta de línea de comandos para inspeccionar y reproducir trazas"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='Trazas binarias del bus CAN')
+    parser.add_argument('accion', choices=['info', 'volcar', 'reproducir'])
+    parser.add_argument('ruta')
+    parser.add_argument('--desde', type=float, default=None, help='timestamp inicial')
+    parser.add_argument('--hasta', type=float, default=None, help='timestamp final')
+    parser.add_argument('--interfaz', default='vcan0')
+    parser.add_argument('--velocidad', type=float, default=1.0)
+    parser.add_argument('--solo-rx', action='store_true')
+    args = parser.parse_args()
+
+    if args.accion == 'reproducir':
+        try:
+            reproducir(args.ruta, args.interfaz, args.desde, args.hasta, args.velocidad, args.solo_rx)
+        except OSError as e:
+            logger.error(f'❌ {e}')
+            raise SystemExit(1)
+        return
+
+    with LectorTraza(args.ruta) as lector:
+        if args.accion == 'info':
+            print(f'Traza: {lector.ruta}')
+            print(f'Creada: {datetime.fromtimestamp(lector.creada)}')
+            print(f'Tramas: {len(lector)} en {lector.bloques} bloques')
+            if len(lector):
+                tramas = lector.leer_array()
+                print(f'Desde: {datetime.fromtimestamp(tramas["timestamp"][0])}')
+                print(f'Hasta: {datetime.fromtimestamp(tramas["timestamp"][-1])}')
+            return
+
+        # Mismo formato que candump -ta
+        for timestamp, can_id, datos, tx in lector.leer(args.desde, args.hasta):
+            sentido = 'TX' if tx else 'RX'
+            print(f'({timestamp:.6f}) {sentido} {formatear_id(can_id)} '
+                  f'[{len(datos)}] {datos.hex(" ").upper()}')
+
+
+if __name__ == '__main__':
+    main()
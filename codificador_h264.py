@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Codificación H.264 compartida para WebRTC
+Cada cámara se codifica UNA vez (encoder V4L2 M2M de la Raspberry, o libx264 por
+software si no está) y todas las conexiones WebRTC reciben los mismos paquetes:
+añadir un espectador solo cuesta la paquetización RTP. Hay un codificador por
+cámara y escalón de calidad (adaptacion.py), y solo corren los que tienen espectadores
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from fractions import Fraction
+from typing import Dict, List, Optional
+
+import av
+import cv2
+import numpy as np
+from aiortc import MediaStreamTrack
+
+from camera import obtener_camera, DIBUJAR_DETECCIONES
+from adaptacion import ESCALONES, ESCALON_INICIAL
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Encoders a probar en orden: hardware de la Pi primero, x264 por software después
+CODECS_H264 = ['h264_v4l2m2m', 'libx264']
+
+# Opciones de cada encoder (sin B-frames y con SPS/PPS en cada keyframe)
+OPCIONES_CODEC = {
+    'h264_v4l2m2m': {},
+    'libx264': {'preset': 'ultrafast', 'tune': 'zerolatency', 'profile': 'baseline',
+                'x264-params': 'repeat-headers=1:bframes=0'},
+}
+
+# Distancia entre keyframes (en segundos; el bitrate y la resolución los da el escalón)
+SEGUNDOS_GOP = 1.0
+
+# Base de tiempos de RTP para vídeo (90 kHz), con un origen común a todos los
+# codificadores para que cambiar de escalón no haga saltar los timestamps
+TIME_BASE_H264 = Fraction(1, 90000)
+INICIO_RELOJ = time.time()
+
+# Paquetes encolados por espectador antes de considerarlo lento
+MAX_PAQUETES_COLA = 30
+
+# Tipos de unidad NAL con las cabeceras del stream
+NAL_SPS = 7
+NAL_PPS = 8
+
+
+def separar_nal(datos: bytes) -> List[bytes]:
+    """Partir un stream Annex B en unidades NAL (cada una con su código de inicio)"""
+    unidades = []
+    inicio = datos.find(b'\x00\x00\x01')
+    while inicio != -1:
+        siguiente = datos.find(b'\x00\x00\x01', inicio + 3)
+        fin = len(datos) if siguiente == -1 else siguiente
+        # Un código de inicio de 4 bytes deja un 0 al final de la unidad anterior
+        if siguiente != -1 and datos[fin - 1] == 0:
+            fin -= 1
+        unidades.append(datos[inicio:fin])
+        inicio = siguiente
+    return unidades
+
+
+def tipo_nal(unidad: bytes) -> int:
+    """Tipo de una unidad NAL con código de inicio de 3 bytes"""
+    return unidad[3] & 0x1F if len(unidad) > 3 else -1
+
+
+def _tipo_imagen_i():
+    """Valor de pict_type para forzar un keyframe (cambia entre versiones de PyAV)"""
+    tipo = getattr(getattr(av.video.frame, 'PictureType', None), 'I', None)
+    return tipo if tipo is not None else 'I'
+
+
+# ==================== CODIFICADOR ====================
+class CodificadorH264:
+    """Codifica los frames de una cámara a H.264 en un escalón de calidad y reparte los paquetes
+
+    El thread de codificación solo corre mientras haya espectadores. Un
+    espectador nuevo, o uno que se quedó atrás, fuerza un keyframe para
+    poder empezar a decodificar sin esperar al siguiente GOP
+    """
+
+    def __init__(self, camara_id: Optional[str] = None, escalon: int = ESCALON_INICIAL,
+                 con_detecciones: bool = DIBUJAR_DETECCIONES):
+        """
+        Args:
+            camara_id: Cámara a codificar (None = la de por defecto)
+            escalon: Índice en adaptacion.ESCALONES (resolución, FPS y bitrate)
+            con_detecciones: Codificar con las cajas dibujadas o el frame limpio
+        """
+        self.camara_id = camara_id
+        self.escalon = escalon
+        self.con_detecciones = con_detecciones
+        self.perfil = ESCALONES[escalon]
+        self.bitrate = self.perfil['bitrate']
+        self.gop = max(int(self.perfil['fps'] * SEGUNDOS_GOP), 1)
+        self.redimensionado = None
+        self.contexto = None
+        self.codec = None
+        self.forma = None
+        self.cabeceras = b''        # SPS + PPS para keyframes que no los traigan
+        self.pedir_clave = True
+        self.suscriptores = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+        # Estadísticas
+        self.frames_codificados = 0
+        self.bytes_codificados = 0
+        self.claves_forzadas = 0
+        self.fps = 0.0
+
+    def _abrir(self, ancho: int, alto: int, fps: int):
+        """Abrir el primer encoder disponible de CODECS_H264"""
+        for nombre in CODECS_H264:
+            try:
+                contexto = av.CodecContext.create(nombre, 'w')
+                contexto.width = ancho
+                contexto.height = alto
+                contexto.pix_fmt = 'yuv420p'
+                contexto.time_base = TIME_BASE_H264
+                contexto.framerate = Fraction(fps, 1)
+                contexto.bit_rate = self.bitrate
+                contexto.gop_size = self.gop
+                contexto.max_b_frames = 0
+                contexto.options = OPCIONES_CODEC.get(nombre, {})
+                contexto.open()
+            except Exception as e:
+                logger.warning(f'⚠️ Encoder {nombre} no disponible: {e}')
+                continue
+            self.contexto = contexto
+            self.codec = nombre
+            self.forma = (alto, ancho)
+            self.pedir_clave = True
+            logger.info(f'✅ H.264 {self.camara_id or "por defecto"} ({self.perfil["nombre"]}): {nombre} '
+                        f'{ancho}x{alto}@{fps} {self.bitrate // 1000} kbps')
+            return
+        raise RuntimeError(f'Ningún encoder H.264 disponible ({CODECS_H264})')
+
+    def _completar_clave(self, paquete):
+        """Asegurar que un keyframe lleva SPS/PPS (algunos encoders solo los ponen al inicio)"""
+        datos = bytes(paquete)
+        unidades = separar_nal(datos)
+        tipos = {tipo_nal(u) for u in unidades}
+        if NAL_SPS in tipos:
+            self.cabeceras = b''.join(u for u in unidades if tipo_nal(u) in (NAL_SPS, NAL_PPS))
+            return paquete
+        if not self.cabeceras:
+            return paquete
+
+        completo = av.Packet(self.cabeceras + datos)
+        completo.pts = paquete.pts
+        completo.dts = paquete.dts
+        completo.time_base = paquete.time_base
+        completo.is_keyframe = True
+        return completo
+
+    def _bucle(self):
+        """Thread de codificación: un frame de cámara → paquetes para todos"""
+        camara = obtener_camera(self.camara_id)
+        logger.info(f'🎞️ [H264] Codificación iniciada ({self.camara_id or "por defecto"})')
+        ultima_secuencia = 0
+        frames_ventana = 0
+        inicio_ventana = time.time()
+        intervalo = 1.0 / self.perfil['fps']
+        ultimo_frame = 0.0
+        ancho, alto = self.perfil['ancho'], self.perfil['alto']
+
+        while True:
+            with self.lock:
+                if camara is None or not self.suscriptores:
+                    # Sin espectadores: liberar el encoder en la misma sección que lo
+                    # decide, para que un suscribir() posterior vea thread=None y arranque otro
+                    self.contexto = None
+                    self.thread = None
+                    break
+            try:
+                secuencia = camara.esperar_frame(ultima_secuencia)
+                if secuencia == ultima_secuencia:
+                    continue
+                # FPS del escalón: los frames que llegan antes de tiempo se saltan
+                ahora = time.time()
+                if ahora - ultimo_frame < intervalo * 0.9:
+                    ultima_secuencia = secuencia
+                    continue
+                ultimo_frame = ahora
+
+                # Frame prestado del anillo de captura mientras se copia a PyAV
+                with camara.prestar_frame(self.con_detecciones) as (frame_bgr, ultima_secuencia):
+                    if frame_bgr is None:
+                        continue
+
+                    # Resolución del escalón (buffer reutilizado)
+                    if frame_bgr.shape[:2] != (alto, ancho):
+                        if self.redimensionado is None:
+                            self.redimensionado = np.empty((alto, ancho, 3), dtype=np.uint8)
+                        cv2.resize(frame_bgr, (ancho, alto), dst=self.redimensionado,
+                                   interpolation=cv2.INTER_AREA)
+                        frame_bgr = self.redimensionado
+
+                    frame = av.VideoFrame.from_ndarray(frame_bgr, format='bgr24')
+
+                if self.contexto is None:
+                    self._abrir(ancho, alto, self.perfil['fps'])
+
+                frame.pts = int((ahora - INICIO_RELOJ) * 90000)
+                frame.time_base = TIME_BASE_H264
+                if self.pedir_clave:
+                    frame.pict_type = _tipo_imagen_i()
+                    self.pedir_clave = False
+                    self.claves_forzadas += 1
+
+                for paquete in self.contexto.encode(frame):
+                    paquete.time_base = TIME_BASE_H264
+                    if paquete.is_keyframe:
+                        paquete = self._completar_clave(paquete)
+                    self.bytes_codificados += paquete.size
+                    self._repartir(paquete)
+
+                self.frames_codificados += 1
+                frames_ventana += 1
+                transcurrido = time.time() - inicio_ventana
+                if transcurrido >= 2.0:
+                    self.fps = frames_ventana / transcurrido
+                    frames_ventana = 0
+                    inicio_ventana = time.time()
+            except Exception as e:
+                logger.error(f'❌ [H264] Error codificando: {e}')
+                time.sleep(0.5)
+
+        logger.info(f'⏹️ [H264] Codificación detenida ({self.camara_id or "por defecto"})')
+
+    def _repartir(self, paquete):
+        """Entregar el mismo paquete a todos los espectadores (sin copias)"""
+        with self.lock:
+            suscriptores = list(self.suscriptores)
+        for suscriptor in suscriptores:
+            suscriptor.loop.call_soon_threadsafe(suscriptor.entregar, paquete, self)
+
+    def suscribir(self, track: 'PistaH264'):
+        """Añadir un espectador; arranca la codificación si era el primero"""
+        with self.lock:
+            self.suscriptores.add(track)
+            self.pedir_clave = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._bucle, daemon=True)
+                self.thread.start()
+        logger.info(f'✅ Espectador H.264 añadido ({len(self.suscriptores)} total)')
+
+    def desuscribir(self, track: 'PistaH264'):
+        with self.lock:
+            self.suscriptores.discard(track)
+        logger.info(f'📴 Espectador H.264 eliminado ({len(self.suscriptores)} total)')
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            'escalon': self.perfil['nombre'],
+            'con_detecciones': self.con_detecciones,
+            'codec': self.codec,
+            'espectadores': len(self.suscriptores),
+            'frames': self.frames_codificados,
+            'bytes': self.bytes_codificados,
+            'fps': round(self.fps, 1),
+            'claves_forzadas': self.claves_forzadas,
+            'descartados': sum(t.descartados for t in list(self.suscriptores))
+        }
+
+
+# ==================== TRACK WEBRTC ====================
+class PistaH264(MediaStreamTrack):
+    """Track de vídeo de aiortc que entrega paquetes H.264 ya codificados
+
+    recv() devuelve av.Packet en vez de av.VideoFrame, así aiortc solo los
+    paquetiza (passthrough) sin volver a codificar por cada conexión
+    """
+
+    kind = 'video'
+
+    def __init__(self, codificador: CodificadorH264):
+        super().__init__()
+        self.codificador = codificador
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=MAX_PAQUETES_COLA)
+        self.esperando_clave = True   # Hasta el primer keyframe no hay nada decodificable
+        self.descartados = 0
+        codificador.suscribir(self)
+
+    def entregar(self, paquete, origen: CodificadorH264):
+        """Encolar un paquete (en el event loop); si la cola se llena, saltar al siguiente keyframe"""
+        if origen is not self.codificador:
+            return  # Paquete rezagado del escalón anterior
+        if self.esperando_clave and not paquete.is_keyframe:
+            self.descartados += 1
+            return
+        if self.cola.full():
+            # Espectador lento: tirar lo pendiente y reengancharse en un keyframe
+            self.descartados += self.cola.qsize() + 1
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.esperando_clave = True
+            self.codificador.pedir_clave = True
+            return
+        self.esperando_clave = False
+        self.cola.put_nowait(paquete)
+
+    async def recv(self):
+        return await self.cola.get()
+
+    def cambiar_codificador(self, codificador: CodificadorH264):
+        """Pasar a otro escalón: engancharse al nuevo stream desde su próximo keyframe"""
+        if codificador is self.codificador:
+            return
+        anterior = self.codificador
+        self.codificador = codificador
+        self.esperando_clave = True
+        anterior.desuscribir(self)
+        codificador.suscribir(self)
+
+    def stop(self):
+        self.codificador.desuscribir(self)
+        super().stop()
+
+
+# ==================== REGISTRO POR CÁMARA ====================
+codificadores: Dict[tuple, CodificadorH264] = {}
+
+
+def obtener_codificador(camara_id: Optional[str] = None, escalon: int = ESCALON_INICIAL,
+                        con_detecciones: bool = DIBUJAR_DETECCIONES) -> CodificadorH264:
+    """Codificador compartido de una cámara en un escalón, con o sin overlay (se crea la primera vez)"""
+    clave = (camara_id, escalon, con_detecciones)
+    if clave not in codificadores:
+        codificadores[clave] = CodificadorH264(camara_id, escalon, con_detecciones)
+    return codificadores[clave]
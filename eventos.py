@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Eventos de detección por cámara
+Convierte los objetos seguidos de cada frame en eventos de entrada y salida
+(con histéresis para no anunciar parpadeos del detector) y en deltas de cajas,
+y los entrega agrupados cada INTERVALO_EVENTOS como JSON pequeño. Un cliente
+puede seguir lo que pasa alrededor del coche sin pedir frames completos
+"""
+
+import threading
+import logging
+from typing import Callable, Dict, List
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Segundos que un objeto debe seguir presente antes de anunciar su entrada
+VENTANA_ENTRADA = 0.5
+
+# Segundos sin ver un objeto antes de anunciar su salida
+VENTANA_SALIDA = 1.5
+
+# Agrupación de eventos: como mucho un lote por intervalo (s)
+INTERVALO_EVENTOS = 0.5
+
+# Desplazamiento mínimo de una caja (px) para incluirla en el lote
+MOVIMIENTO_MINIMO = 8
+
+
+class EventosDeteccion:
+    """Entradas/salidas con histéresis y deltas de cajas de una cámara (thread-safe)
+
+    Los suscriptores se llaman desde el thread que llama a actualizar() (la
+    captura): deben limitarse a encolar el lote
+    """
+
+    def __init__(self, camara_id: str, ventana_entrada: float = VENTANA_ENTRADA,
+                 ventana_salida: float = VENTANA_SALIDA, intervalo: float = INTERVALO_EVENTOS):
+        self.camara_id = camara_id
+        self.ventana_entrada = ventana_entrada
+        self.ventana_salida = ventana_salida
+        self.intervalo = intervalo
+        self.pendientes: Dict[int, float] = {}   # track_id → primer instante visto (sin anunciar)
+        self.activos: Dict[int, Dict] = {}       # track_id → objeto anunciado
+        self.eventos: List[Dict] = []            # Eventos del lote en curso
+        self.suscriptores: List[Callable] = []
+        self.lock = threading.Lock()
+        self.ultimo_lote = 0.0
+
+        # Estadísticas
+        self.lotes = 0
+        self.entradas = 0
+        self.salidas = 0
+        self.descartados = 0                     # Objetos que desaparecieron antes de anunciarse
+
+    def suscribir(self, callback: Callable[[Dict], None]) -> Callable[[], None]:
+        """
+        Recibir cada lote de eventos
+
+        Returns:
+            Función para cancelar la suscripción
+        """
+        with self.lock:
+            self.suscriptores.append(callback)
+
+        def cancelar():
+            with self.lock:
+                if callback in self.suscriptores:
+                    self.suscriptores.remove(callback)
+        return cancelar
+
+    def actualizar(self, objetos: List[Dict], instante: float):
+        """
+        Incorporar los objetos seguidos de un frame
+
+        Args:
+            objetos: Salida de SeguidorObjetos ('track_id', 'clase', 'confianza', 'bbox')
+            instante: time.time() de captura del frame
+        """
+        with self.lock:
+            vistos = set()
+            for objeto in objetos:
+                if not objeto.get('confirmado', True):
+                    continue
+                track_id = objeto['track_id']
+                vistos.add(track_id)
+
+                activo = self.activos.get(track_id)
+                if activo is not None:
+                    activo['bbox'] = objeto['bbox']
+                    activo['ultimo_visto'] = instante
+                    continue
+
+                primer_visto = self.pendientes.setdefault(track_id, instante)
+                if instante - primer_visto >= self.ventana_entrada:
+                    del self.pendientes[track_id]
+                    self.activos[track_id] = {
+                        'clase': objeto['clase'], 'bbox': objeto['bbox'], 'enviada': objeto['bbox'],
+                        'desde': primer_visto, 'ultimo_visto': instante
+                    }
+                    self.eventos.append({
+                        'tipo': 'entrada', 'id': track_id, 'clase': objeto['clase'],
+                        'confianza': round(objeto['confianza'], 2), 'bbox': list(objeto['bbox']),
+                        'ts': round(primer_visto, 2)
+                    })
+                    self.entradas += 1
+
+            # Parpadeos: lo que se va antes de la ventana de entrada no se anuncia
+            for track_id in [t for t in self.pendientes if t not in vistos]:
+                del self.pendientes[track_id]
+                self.descartados += 1
+
+            for track_id, activo in list(self.activos.items()):
+                if track_id not in vistos and instante - activo['ultimo_visto'] >= self.ventana_salida:
+                    del self.activos[track_id]
+                    self.eventos.append({
+                        'tipo': 'salida', 'id': track_id, 'clase': activo['clase'],
+                        'ts': round(activo['ultimo_visto'], 2),
+                        'duracion': round(activo['ultimo_visto'] - activo['desde'], 1)
+                    })
+                    self.salidas += 1
+
+            if instante - self.ultimo_lote < self.intervalo:
+                return
+            lote = self._cerrar_lote(instante)
+            suscriptores = list(self.suscriptores)
+
+        if lote is not None:
+            for callback in suscriptores:
+                try:
+                    callback(lote)
+                except Exception as e:
+                    logger.error(f'❌ Error entregando eventos de detección: {e}')
+
+    def _cerrar_lote(self, instante: float):
+        """Eventos acumulados + cajas que se movieron desde el último envío (None si nada cambió)"""
+        cajas = {}
+        for track_id, activo in self.activos.items():
+            caja, enviada = activo['bbox'], activo['enviada']
+            if max(abs(a - b) for a, b in zip(caja, enviada)) >= MOVIMIENTO_MINIMO:
+                cajas[track_id] = list(caja)
+                activo['enviada'] = caja
+
+        self.ultimo_lote = instante
+        if not self.eventos and not cajas:
+            return None
+        lote = {'camara': self.camara_id, 'ts': round(instante, 2), 'eventos': self.eventos}
+        if cajas:
+            lote['cajas'] = cajas
+        self.eventos = []
+        self.lotes += 1
+        return lote
+
+    def instantanea(self) -> Dict:
+        """Objetos anunciados ahora mismo (para un cliente que se conecta a mitad)"""
+        with self.lock:
+            return {
+                'camara': self.camara_id,
+                'objetos': [{'id': track_id, 'clase': a['clase'], 'bbox': list(a['bbox']),
+                             'desde': round(a['desde'], 2)} for track_id, a in self.activos.items()]
+            }
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            'activos': len(self.activos),
+            'lotes': self.lotes,
+            'entradas': self.entradas,
+            'salidas': self.salidas,
+            'descartados': self.descartados,
+            'suscriptores': len(self.suscriptores)
+        }
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Grabación de clips con pre-grabación, fuera del thread de captura
+Un worker por cámara recibe todos los frames de la captura: mientras no se
+graba los guarda comprimidos en un buffer acotado con los últimos segundos,
+y al dispararse la grabación los vuelca al principio del clip. El siguiente
+writer se abre por adelantado, así que arrancar un clip no cuesta nada.
+Los clips se graban en H.264 dentro de MP4 fragmentado (PyAV) y cada segmento
+cerrado se registra en el índice de retencion.py
+"""
+
+import cv2
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from retencion import ruta_segmento
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Segundos previos a la detección que se incluyen en cada clip (0 = sin pre-grabación)
+SEGUNDOS_PREGRABACION = 5.0
+
+# Tope de memoria del buffer de pre-grabación por cámara (MB)
+MAX_MB_PREGRABACION = 32
+
+# Calidad JPEG de los frames guardados en el buffer
+CALIDAD_PREGRABACION = 85
+
+# Formato de los clips: 'h264' (MP4 fragmentado con PyAV) o 'mp4v' (OpenCV, sin PyAV)
+FORMATO_GRABACION = 'h264'
+
+# Encoders H.264 a probar en orden: hardware de la Pi primero, x264 por software después
+CODECS_GRABACION = ['h264_v4l2m2m', 'libx264']
+
+# Opciones de cada encoder (x264: poca CPU y calidad constante)
+OPCIONES_GRABACION = {
+    'h264_v4l2m2m': {},
+    'libx264': {'preset': 'veryfast', 'crf': '26'},
+}
+
+# Bitrate objetivo para encoders sin control de calidad constante (bps)
+BITRATE_GRABACION = 2_000_000
+
+# Cada keyframe cierra un fragmento del MP4: es lo máximo que se pierde en un corte
+SEGUNDOS_FRAGMENTO = 1.0
+
+# Códec de OpenCV con FORMATO_GRABACION = 'mp4v'
+FOURCC_CLIPS = 'mp4v'
+
+# Frames como máximo esperando al worker. Cada uno retiene un buffer de captura,
+# así que si el almacenamiento se atasca se descartan frames en vez de crecer
+MAX_COLA_GRABACION = 15
+
+# Las grabaciones largas se parten en segmentos por duración o por tamaño
+SEGUNDOS_SEGMENTO = 300
+MAX_MB_SEGMENTO = 200
+
+# Cada cuánto se fuerza a disco lo escrito (s); fsync por frame mataría la SD
+INTERVALO_FSYNC = 2.0
+
+
+# ==================== ESCRITORES ====================
+class EscritorOpenCV:
+    """Clip mp4v con cv2.VideoWriter (sin PyAV; ni fragmentado ni acelerado)"""
+
+    def __init__(self, ruta: Path, fps: float, tamano):
+        self.writer = cv2.VideoWriter(str(ruta), cv2.VideoWriter_fourcc(*FOURCC_CLIPS), fps, tamano)
+        if not self.writer.isOpened():
+            raise IOError(f'cv2.VideoWriter no pudo abrir {ruta}')
+
+    def escribir(self, frame, instante):
+        self.writer.write(frame)
+
+    def cerrar(self):
+        self.writer.release()
+
+
+class EscritorH264:
+    """Clip H.264 en MP4 fragmentado con PyAV
+
+    Con `empty_moov` + `frag_keyframe` el archivo no depende de un índice
+    escrito al final: si se va la luz a mitad de clip es reproducible hasta
+    el último fragmento. Los timestamps son los de captura, así que los
+    frames descartados no aceleran el vídeo
+    """
+
+    codec = None  # Primer encoder de CODECS_GRABACION que abre; False = ninguno (se prueba una vez)
+
+    def __init__(self, ruta: Path, fps: float, tamano):
+        import av
+        self.av = av
+        if EscritorH264.codec is None:
+            EscritorH264.codec = self._elegir_codec(fps, tamano)
+
+        self.contenedor = av.open(str(ruta), mode='w', format='mp4', options={
+            'movflags': 'frag_keyframe+empty_moov+default_base_moof'})
+        self.stream = self.contenedor.add_stream(EscritorH264.codec, rate=int(round(fps)),
+                                                 options=OPCIONES_GRABACION.get(EscritorH264.codec, {}))
+        self.stream.width, self.stream.height = tamano
+        self.stream.pix_fmt = 'yuv420p'
+        self.stream.bit_rate = BITRATE_GRABACION
+        self.stream.time_base = Fraction(1, 1000)
+        self.stream.codec_context.time_base = Fraction(1, 1000)
+        self.stream.codec_context.gop_size = max(int(fps * SEGUNDOS_FRAGMENTO), 1)
+        self.stream.codec_context.max_b_frames = 0
+        # Abrir el encoder y escribir la cabecera ya: es lo lento de arrancar un clip
+        # (sobre todo con h264_v4l2m2m) y este writer se prepara antes de necesitarlo
+        self.contenedor.start_encoding()
+        self.origen = None
+        self.ultimo_pts = -1
+
+    @staticmethod
+    def _elegir_codec(fps, tamano):
+        import av
+        for nombre in CODECS_GRABACION:
+            try:
+                contexto = av.CodecContext.create(nombre, 'w')
+                contexto.width, contexto.height = tamano
+                contexto.pix_fmt = 'yuv420p'
+                contexto.time_base = Fraction(1, int(round(fps)))
+                contexto.options = OPCIONES_GRABACION.get(nombre, {})
+                contexto.open()
+            except Exception as e:
+                logger.warning(f'⚠️ Encoder {nombre} no disponible para grabar: {e}')
+                continue
+            logger.info(f'✅ Grabación H.264 con {nombre}')
+            return nombre
+        raise IOError('Ningún encoder H.264 disponible')
+
+    def escribir(self, frame, instante):
+        if self.origen is None:
+            self.origen = instante
+        # pts en ms desde el primer frame, siempre creciente
+        pts = max(int((instante - self.origen) * 1000), self.ultimo_pts + 1)
+        self.ultimo_pts = pts
+        video = self.av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video.pts = pts
+        video.time_base = self.stream.codec_context.time_base
+        for paquete in self.stream.encode(video):
+            self.contenedor.mux(paquete)
+
+    def cerrar(self):
+        try:
+            for paquete in self.stream.encode(None):
+                self.contenedor.mux(paquete)
+        finally:
+            self.contenedor.close()
+
+
+def crear_escritor(ruta: Path, fps: float, tamano):
+    """Escritor del formato configurado (H.264 fragmentado, o mp4v si no hay PyAV)"""
+    if FORMATO_GRABACION == 'h264' and EscritorH264.codec is not False:
+        try:
+            return EscritorH264(ruta, fps, tamano)
+        except ImportError:
+            EscritorH264.codec = False
+            logger.warning('⚠️ PyAV no instalado: grabando en mp4v con OpenCV')
+        except Exception as e:
+            if EscritorH264.codec is None:
+                EscritorH264.codec = False
+            logger.warning(f'⚠️ Grabación H.264 no disponible ({e}): grabando en mp4v')
+        ruta.unlink(missing_ok=True)
+    return EscritorOpenCV(ruta, fps, tamano)
+
+
+# ==================== BUFFER DE PRE-GRABACIÓN ====================
+class BufferPregrabacion:
+    """Últimos segundos de vídeo en JPEG, acotados por tiempo y por bytes"""
+
+    def __init__(self, segundos=SEGUNDOS_PREGRABACION, max_bytes=MAX_MB_PREGRABACION * 1024 * 1024,
+                 calidad=CALIDAD_PREGRABACION):
+        self.segundos = segundos
+        self.max_bytes = max_bytes
+        self.parametros = [cv2.IMWRITE_JPEG_QUALITY, calidad]
+        self.frames = deque()      # (instante, JPEG como array de bytes)
+        self.bytes = 0
+        self.descartados = 0
+
+    def agregar(self, frame, instante):
+        """Comprimir y guardar un frame, descartando los que salen de la ventana"""
+        if self.segundos <= 0:
+            return
+        ok, datos = cv2.imencode('.jpg', frame, self.parametros)
+        if not ok:
+            return
+        self.frames.append((instante, datos))
+        self.bytes += datos.nbytes
+
+        while self.frames and (self.bytes > self.max_bytes
+                               or instante - self.frames[0][0] > self.segundos):
+            _, viejo = self.frames.popleft()
+            self.bytes -= viejo.nbytes
+            self.descartados += 1
+
+    def vaciar(self):
+        """Sacar todos los frames guardados, del más antiguo al más nuevo"""
+        frames = list(self.frames)
+        self.frames.clear()
+        self.bytes = 0
+        return frames
+
+    def obtener_estadisticas(self) -> Dict:
+        frames = self.frames
+        return {
+            'frames': len(frames),
+            'segundos': round(frames[-1][0] - frames[0][0], 2) if len(frames) > 1 else 0.0,
+            'kb': round(self.bytes / 1024, 1),
+            'descartados': self.descartados
+        }
+
+
+# ==================== GRABADOR ====================
+class GrabadorClips:
+    """Worker de grabación de una cámara
+
+    La captura le pasa cada frame junto con la ranura del anillo que lo
+    contiene (ya retenida); el worker la suelta en cuanto lo ha comprimido
+    o escrito, sin copiar el frame. La cola está acotada: si el almacenamiento
+    se atasca se descartan frames, nunca se frena la captura
+    """
+
+    def __init__(self, camara_id: str, directorio: Path, fps: float = 30,
+                 soltar: Optional[Callable] = None, max_cola: int = MAX_COLA_GRABACION,
+                 retencion=None):
+        """
+        Args:
+            camara_id: Cámara a la que pertenecen los clips (va en el nombre del archivo)
+            directorio: Carpeta de salida
+            fps: FPS con los que se escriben los clips
+            soltar: Función que devuelve al anillo la ranura de cada frame
+            max_cola: Frames como máximo esperando al worker
+            retencion: GestorRetencion donde registrar cada segmento (None = no indexar)
+        """
+        self.camara_id = camara_id
+        self.directorio = Path(directorio)
+        self.fps = fps
+        self.soltar = soltar
+        self.retencion = retencion
+        self.max_cola = max_cola
+        self.pregrabacion = BufferPregrabacion()
+        self.cola = queue.Queue()      # El tope de frames lo aplica agregar_frame()
+        self.diferidas = deque()       # Órdenes sacadas de la cola durante un volcado
+        self.thread = None
+
+        self.writer = None             # Segmento en curso
+        self.ruta = None
+        self.tamano_clip = None
+        self.inicio_segmento = None    # Instante del primer frame del segmento
+        self.fin_segmento = 0.0
+        self.bytes_segmento = 0
+        self.frames_segmento = 0
+        self.clases_segmento = set()   # Metadatos de detección para el índice
+        self.objetos_segmento = set()
+        self.max_simultaneos = 0
+        self.ultimo_fsync = 0.0
+        self.preparado = None          # (writer, ruta, tamaño) abierto por adelantado
+        self.tamano = None             # (ancho, alto) de los frames recibidos
+
+        self.clips = 0
+        self.segmentos = 0
+        self.frames_escritos = 0
+        self.frames_pregrabados = 0    # Frames del buffer volcados a clips
+        self.frames_descartados = 0    # Frames perdidos por cola llena
+        self.cola_maxima = 0
+        self.latencia_escritura = 0.0  # Media exponencial de VideoWriter.write (s)
+        self.fsync_maximo = 0.0
+
+    def arrancar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._bucle, daemon=True)
+            self.thread.start()
+
+    def agregar_frame(self, frame, instante, ranura=None, detecciones: Optional[List[Dict]] = None) -> bool:
+        """Entregar un frame de la captura (nunca bloquea)
+
+        Args:
+            frame: Frame BGR (no se copia)
+            instante: time.time() de captura
+            ranura: Ranura del anillo retenida para el worker
+            detecciones: Objetos del frame, para los metadatos del clip
+
+        Returns:
+            False si se descartó por tener la cola llena (la ranura ya queda soltada)
+        """
+        profundidad = self.cola.qsize()
+        if profundidad >= self.max_cola:
+            self.frames_descartados += 1
+            if ranura is not None and self.soltar:
+                self.soltar(ranura)
+            if self.frames_descartados % 100 == 1:
+                logger.warning(f'⚠️ [GRABACIÓN] {self.camara_id}: almacenamiento lento, '
+                               f'{self.frames_descartados} frames descartados')
+            return False
+        self.cola.put(('frame', frame, instante, ranura, detecciones))
+        self.cola_maxima = max(self.cola_maxima, profundidad + 1)
+        return True
+
+    def iniciar_clip(self):
+        """Empezar un clip con la pre-grabación acumulada hasta este frame"""
+        self.cola.put(('iniciar', time.time()))
+
+    def detener_clip(self):
+        self.cola.put(('detener',))
+
+    def cerrar(self):
+        """Cerrar el clip en curso y parar el worker"""
+        if self.thread is not None:
+            self.cola.put(None)
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    # ---------- Worker ----------
+    def _siguiente(self):
+        if self.diferidas:
+            return self.diferidas.popleft()
+        try:
+            return self.cola.get(timeout=INTERVALO_FSYNC)
+        except queue.Empty:
+            return ('vacia',)
+
+    def _bucle(self):
+        logger.info(f'🎞️ [GRABACIÓN] Worker de {self.camara_id} iniciado')
+        while True:
+            orden = self._siguiente()
+            if orden is None:
+                break
+            try:
+                if orden[0] == 'frame':
+                    self._procesar_frame(*orden[1:])
+                elif orden[0] == 'iniciar':
+                    self._abrir_clip(orden[1])
+                elif orden[0] == 'detener':
+                    self._cerrar_clip()
+                self._sincronizar()
+            except Exception as e:
+                logger.error(f'❌ [GRABACIÓN] Error en {self.camara_id}: {e}')
+
+        # Vaciar lo que quede en la cola para no dejar ranuras retenidas
+        pendientes = list(self.diferidas)
+        self.diferidas.clear()
+        while True:
+            try:
+                pendientes.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        for orden in pendientes:
+            if orden is not None and orden[0] == 'frame' and orden[3] is not None and self.soltar:
+                self.soltar(orden[3])
+        self._cerrar_clip()
+        self._descartar_preparado()
+        logger.info(f'⏹️ [GRABACIÓN] Worker de {self.camara_id} detenido')
+
+    def _procesar_frame(self, frame, instante, ranura, detecciones):
+        try:
+            self.tamano = (frame.shape[1], frame.shape[0])
+            if self.writer is not None:
+                if self._segmento_lleno(instante):
+                    self._cerrar_segmento()
+                    self._abrir_segmento()
+                if self.writer is not None:
+                    self._escribir(frame, instante)
+                    if detecciones:
+                        self.clases_segmento.update(d['clase'] for d in detecciones)
+                        self.objetos_segmento.update(d.get('track_id') for d in detecciones)
+                        self.max_simultaneos = max(self.max_simultaneos, len(detecciones))
+            else:
+                self.pregrabacion.agregar(frame, instante)
+        finally:
+            if ranura is not None and self.soltar:
+                self.soltar(ranura)
+        # Dejar listo el writer del próximo clip o segmento (fuera del préstamo)
+        self._preparar_writer()
+
+    def _escribir(self, frame, instante):
+        if (frame.shape[1], frame.shape[0]) != self.tamano_clip:
+            frame = cv2.resize(frame, self.tamano_clip)
+        if self.inicio_segmento is None:
+            self.inicio_segmento = instante
+            self._marcar_grabando()
+        self.fin_segmento = instante
+        inicio = time.perf_counter()
+        self.writer.escribir(frame, instante)
+        self.latencia_escritura += 0.1 * (time.perf_counter() - inicio - self.latencia_escritura)
+        self.frames_escritos += 1
+        self.frames_segmento += 1
+
+    def _marcar_grabando(self):
+        """Renombrar el segmento al escribir su primer frame
+
+        Un writer preparado ya tiene la cabecera del MP4: si se va la luz, un
+        `.preparado_*` nunca tuvo frames y se borra al arrancar, mientras que
+        un `.grabando_*` es un segmento a medias que se recupera
+        """
+        destino = self.ruta.with_name(self.ruta.name.replace('.preparado_', '.grabando_', 1))
+        try:
+            self.ruta.rename(destino)
+            self.ruta = destino
+        except OSError as e:
+            # Windows no renombra archivos abiertos: se queda como preparado
+            logger.warning(f'⚠️ [GRABACIÓN] No se pudo renombrar {self.ruta}: {e}')
+
+    def _segmento_lleno(self, instante):
+        if self.inicio_segmento is None:
+            return False
+        return (instante - self.inicio_segmento >= SEGUNDOS_SEGMENTO
+                or self.bytes_segmento >= MAX_MB_SEGMENTO * 1024 * 1024)
+
+    def _abrir_writer(self, tamano):
+        ruta = self.directorio / f'.preparado_{self.camara_id}_{time.time_ns()}.mp4'
+        try:
+            return crear_escritor(ruta, self.fps, tamano), ruta, tamano
+        except Exception as e:
+            logger.error(f'❌ [GRABACIÓN] No se pudo abrir {ruta}: {e}')
+            return None
+
+    def _preparar_writer(self):
+        """Abrir el writer del siguiente clip si no hay uno listo para este tamaño"""
+        if self.tamano is None:
+            return
+        if self.preparado is not None:
+            if self.preparado[2] == self.tamano:
+                return
+            self._descartar_preparado()
+        self.preparado = self._abrir_writer(self.tamano)
+
+    def _descartar_preparado(self):
+        if self.preparado is None:
+            return
+        writer, ruta, _ = self.preparado
+        self.preparado = None
+        try:
+            writer.cerrar()
+        except Exception:
+            pass  # Sin frames el contenedor puede quejarse al cerrar; se borra igual
+        ruta.unlink(missing_ok=True)
+
+    def _abrir_segmento(self):
+        """Pasar a escribir en el writer preparado"""
+        self._preparar_writer()
+        if self.preparado is None:
+            return False
+        self.writer, self.ruta, self.tamano_clip = self.preparado
+        self.preparado = None
+        self.inicio_segmento = None
+        self.bytes_segmento = 0
+        self.frames_segmento = 0
+        self.clases_segmento = set()
+        self.objetos_segmento = set()
+        self.max_simultaneos = 0
+        self.ultimo_fsync = time.time()
+        self.segmentos += 1
+        return True
+
+    def _abrir_clip(self, instante):
+        if self.writer is not None:
+            return
+        if self.tamano is None:
+            logger.warning(f'⚠️ [GRABACIÓN] {self.camara_id}: sin frames todavía, clip no iniciado')
+            return
+        if not self._abrir_segmento():
+            return
+
+        # Volcar la pre-grabación: el clip empieza segundos antes de la detección
+        frames = self.pregrabacion.vaciar()
+        self._volcar(frames)
+        self.frames_pregrabados += len(frames)
+        self.clips += 1
+        inicio = frames[0][0] if frames else instante
+        logger.info(f'🎥 Grabación iniciada ({self.camara_id}) con {len(frames)} frames '
+                    f'de pre-grabación ({instante - inicio:.1f} s)')
+
+    def _volcar(self, frames):
+        """Escribir frames JPEG en el segmento sin dejar que se llene la cola
+
+        Mientras se decodifica la pre-grabación la captura sigue: los frames que
+        esperan se comprimen y se añaden al final del volcado, así sus buffers
+        se sueltan y el clip no tiene un hueco justo después de la detección
+        """
+        pendientes = deque(frames)
+        while pendientes:
+            instante, datos = pendientes.popleft()
+            frame = cv2.imdecode(datos, cv2.IMREAD_COLOR)
+            if frame is not None:
+                self._escribir(frame, instante)
+
+            while not self.diferidas and self.cola.qsize() > self.max_cola // 2:
+                orden = self.cola.get_nowait()
+                if orden is None or orden[0] != 'frame':
+                    # Una orden: respetar el orden y dejar de absorber frames
+                    self.diferidas.append(orden)
+                    break
+                _, vivo, instante_vivo, ranura, _ = orden
+                try:
+                    ok, datos = cv2.imencode('.jpg', vivo, self.pregrabacion.parametros)
+                finally:
+                    if ranura is not None and self.soltar:
+                        self.soltar(ranura)
+                if ok:
+                    pendientes.append((instante_vivo, datos))
+
+    def _fsync(self, ruta):
+        """Forzar a disco un archivo o directorio; devuelve su tamaño"""
+        fd = os.open(ruta, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            return os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+    def _sincronizar(self, forzar=False):
+        """fsync por lotes del segmento en curso (cada INTERVALO_FSYNC segundos)"""
+        if self.writer is None:
+            return
+        ahora = time.time()
+        if not forzar and ahora - self.ultimo_fsync < INTERVALO_FSYNC:
+            return
+        self.ultimo_fsync = ahora
+        inicio = time.perf_counter()
+        try:
+            self.bytes_segmento = self._fsync(self.ruta)
+        except OSError as e:
+            logger.warning(f'⚠️ [GRABACIÓN] fsync de {self.ruta} falló: {e}')
+        self.fsync_maximo = max(self.fsync_maximo, time.perf_counter() - inicio)
+
+    def _cerrar_segmento(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.cerrar()
+        except Exception as e:
+            logger.error(f'❌ [GRABACIÓN] Error cerrando {self.ruta}: {e}')
+        self.writer = None
+
+        if not self.frames_segmento:
+            # Clip detenido antes de su primer frame: solo hay cabecera
+            self.ruta.unlink(missing_ok=True)
+            return
+
+        inicio = self.inicio_segmento or time.time()
+        destino = ruta_segmento(self.directorio, self.camara_id, inicio)
+        try:
+            self._fsync(self.ruta)
+            self.ruta.rename(destino)
+            self._fsync(self.directorio)
+        except OSError as e:
+            # Windows no permite fsync de directorios; el archivo ya está en disco
+            if not destino.exists():
+                logger.error(f'❌ [GRABACIÓN] No se pudo renombrar {self.ruta}: {e}')
+                destino = self.ruta
+        logger.info(f'💾 Segmento guardado: {destino}')
+
+        if self.retencion is not None and destino.exists():
+            try:
+                self.retencion.registrar(
+                    self.camara_id, destino, inicio, self.fin_segmento or inicio,
+                    frames=self.frames_segmento, clases=self.clases_segmento,
+                    objetos=len(self.objetos_segmento - {None}),
+                    max_simultaneos=self.max_simultaneos)
+            except Exception as e:
+                logger.error(f'❌ [GRABACIÓN] No se pudo indexar {destino}: {e}')
+
+    def _cerrar_clip(self):
+        if self.writer is None:
+            return
+        self._cerrar_segmento()
+        logger.info(f'⏹️ Grabación detenida ({self.camara_id})')
+
+    def obtener_estadisticas(self) -> Dict:
+        return {
+            'clips': self.clips,
+            'segmentos': self.segmentos,
+            'frames_escritos': self.frames_escritos,
+            'frames_pregrabados': self.frames_pregrabados,
+            'frames_descartados': self.frames_descartados,
+            'cola': self.cola.qsize(),
+            'cola_maxima': self.cola_maxima,
+            'max_cola': self.max_cola,
+            'escritura_ms': round(self.latencia_escritura * 1000, 2),
+            'fsync_maximo_ms': round(self.fsync_maximo * 1000, 1),
+            'pregrabacion': self.pregrabacion.obtener_estadisticas()
+        }
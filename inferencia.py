@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Backends de inferencia intercambiables para la detección de objetos
+Ultralytics (PyTorch), ONNX Runtime, OpenVINO y TFLite int8, todos devolviendo
+las mismas detecciones: {'clase', 'confianza', 'bbox': (x1, y1, x2, y2)}
+
+Uso:
+    python3 inferencia.py --comparar                  # latencia de todos los backends disponibles
+    python3 inferencia.py --comparar --backends onnx tflite --repeticiones 50
+"""
+
+import abc
+import os
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Backend por defecto (se puede cambiar sin tocar código con la variable de entorno)
+BACKEND_INFERENCIA = os.environ.get('BACKEND_INFERENCIA', 'ultralytics')
+
+# Modelo de cada backend (exportados con `yolo export model=yolov8n.pt format=...`)
+RUTAS_MODELO = {
+    'ultralytics': 'yolov8n.pt',
+    'onnx': 'yolov8n.onnx',
+    'openvino': 'yolov8n_openvino_model/yolov8n.xml',
+    'tflite': 'yolov8n_saved_model/yolov8n_full_integer_quant.tflite',
+}
+
+# Parámetros comunes
+TAMANO_ENTRADA = 640
+CONFIANZA_MINIMA = 0.5
+IOU_NMS = 0.45
+HILOS_CPU = 4
+
+# Nombres de las 80 clases de COCO en el orden de YOLOv8
+NOMBRES_COCO = [
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
+    'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat',
+    'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack',
+    'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball',
+    'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket',
+    'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair',
+    'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse',
+    'remote', 'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
+    'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier',
+    'toothbrush'
+]
+
+
+# ==================== PRE/POST-PROCESADO ====================
+class Letterbox:
+    """Redimensiona manteniendo proporción y rellena a un cuadrado, reutilizando el lienzo"""
+
+    def __init__(self, tamano: int = TAMANO_ENTRADA):
+        self.tamano = tamano
+        self.lienzo = np.full((tamano, tamano, 3), 114, dtype=np.uint8)
+        self.forma_origen = None
+        self.escala = 1.0
+        self.relleno = (0, 0)
+
+    def aplicar(self, frame: np.ndarray) -> np.ndarray:
+        """Devuelve el lienzo (tamano x tamano, BGR) con el frame centrado"""
+        alto, ancho = frame.shape[:2]
+        if (alto, ancho) != self.forma_origen:
+            # La geometría solo se recalcula si cambia la resolución de la cámara
+            self.forma_origen = (alto, ancho)
+            self.escala = min(self.tamano / alto, self.tamano / ancho)
+            nuevo_ancho, nuevo_alto = round(ancho * self.escala), round(alto * self.escala)
+            self.relleno = ((self.tamano - nuevo_ancho) // 2, (self.tamano - nuevo_alto) // 2)
+            self.dimensiones = (nuevo_ancho, nuevo_alto)
+            self.lienzo[:] = 114
+
+        dx, dy = self.relleno
+        ancho_r, alto_r = self.dimensiones
+        cv2.resize(frame, self.dimensiones, dst=self.lienzo[dy:dy + alto_r, dx:dx + ancho_r],
+                   interpolation=cv2.INTER_LINEAR)
+        return self.lienzo
+
+    def deshacer(self, cajas: np.ndarray) -> np.ndarray:
+        """Llevar cajas (x1, y1, x2, y2) del lienzo a coordenadas del frame original"""
+        dx, dy = self.relleno
+        cajas = (cajas - np.array([dx, dy, dx, dy], dtype=np.float32)) / self.escala
+        alto, ancho = self.forma_origen
+        cajas[:, [0, 2]] = np.clip(cajas[:, [0, 2]], 0, ancho)
+        cajas[:, [1, 3]] = np.clip(cajas[:, [1, 3]], 0, alto)
+        return cajas
+
+
+def nms(cajas: np.ndarray, puntuaciones: np.ndarray, umbral_iou: float = IOU_NMS) -> np.ndarray:
+    """Non-maximum suppression vectorizada; devuelve los índices que se conservan"""
+    x1, y1, x2, y2 = cajas.T
+    areas = (x2 - x1) * (y2 - y1)
+    orden = puntuaciones.argsort()[::-1]
+    conservar = []
+    while orden.size:
+        i = orden[0]
+        conservar.append(i)
+        resto = orden[1:]
+        ancho = np.clip(np.minimum(x2[i], x2[resto]) - np.maximum(x1[i], x1[resto]), 0, None)
+        alto = np.clip(np.minimum(y2[i], y2[resto]) - np.maximum(y1[i], y1[resto]), 0, None)
+        interseccion = ancho * alto
+        iou = interseccion / (areas[i] + areas[resto] - interseccion + 1e-6)
+        orden = resto[iou <= umbral_iou]
+    return np.array(conservar, dtype=np.int64)
+
+
+def postprocesar_yolov8(salida: np.ndarray, mascara_clases: np.ndarray,
+                        confianza: float = CONFIANZA_MINIMA,
+                        umbral_iou: float = IOU_NMS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodificar la salida cruda de YOLOv8 (1, 4 + num_clases, N)
+
+    Returns:
+        (cajas x1y1x2y2 en el lienzo, confianzas, ids de clase)
+    """
+    predicciones = salida[0].T  # (N, 4 + clases)
+    puntuaciones = predicciones[:, 4:]
+    clases = puntuaciones.argmax(axis=1)
+    confianzas = puntuaciones[np.arange(len(clases)), clases]
+
+    # Filtro de confianza y de clases de interés antes del NMS
+    validas = (confianzas >= confianza) & mascara_clases[clases]
+    if not validas.any():
+        vacio = np.empty((0,), dtype=np.float32)
+        return np.empty((0, 4), dtype=np.float32), vacio, vacio.astype(np.int64)
+
+    cxcywh = predicciones[validas, :4]
+    confianzas = confianzas[validas]
+    clases = clases[validas]
+    cajas = np.empty_like(cxcywh)
+    cajas[:, :2] = cxcywh[:, :2] - cxcywh[:, 2:] / 2
+    cajas[:, 2:] = cxcywh[:, :2] + cxcywh[:, 2:] / 2
+
+    # NMS por clase desplazando cada clase a una zona distinta del plano
+    conservar = nms(cajas + clases[:, None] * 4096.0, confianzas, umbral_iou)
+    return cajas[conservar], confianzas[conservar], clases[conservar]
+
+
+def a_detecciones(cajas: np.ndarray, confianzas: np.ndarray, clases: np.ndarray,
+                  nombres: List[str]) -> List[Dict]:
+    """Convertir arrays a la lista de diccionarios que usa CameraManager"""
+    cajas = cajas.astype(np.int32).tolist()
+    return [{'clase': nombres[c], 'confianza': float(p), 'bbox': tuple(b)}
+            for b, p, c in zip(cajas, confianzas.tolist(), clases.tolist())]
+
+
+# ==================== BACKENDS ====================
+class BackendInferencia(abc.ABC):
+    """Interfaz común: cargar() una vez, inferir(frame) → lista de detecciones"""
+
+    nombre = 'base'
+
+    def __init__(self, ruta_modelo: Optional[str] = None, clases: Optional[List[str]] = None,
+                 confianza: float = CONFIANZA_MINIMA, tamano: int = TAMANO_ENTRADA):
+        """
+        Args:
+            ruta_modelo: Fichero del modelo (por defecto RUTAS_MODELO[nombre])
+            clases: Nombres de clase a devolver (None = todas)
+            confianza: Confianza mínima
+            tamano: Lado de la entrada cuadrada del modelo
+        """
+        self.ruta_modelo = ruta_modelo or RUTAS_MODELO[self.nombre]
+        self.confianza = confianza
+        self.tamano = tamano
+        self.nombres = NOMBRES_COCO
+        self.clases = clases
+        self.mascara_clases = self._mascara(clases)
+
+    def _mascara(self, clases: Optional[List[str]]) -> np.ndarray:
+        """Máscara booleana por id de clase, precalculada una vez"""
+        if clases is None:
+            return np.ones(len(self.nombres), dtype=bool)
+        return np.array([nombre in clases for nombre in self.nombres], dtype=bool)
+
+    @abc.abstractmethod
+    def cargar(self):
+        """Cargar el modelo (una vez, antes de inferir)"""
+
+    @abc.abstractmethod
+    def inferir(self, frame: np.ndarray) -> List[Dict]:
+        """Detecciones de las clases configuradas en un frame BGR"""
+
+    def inferir_lote(self, frames: List[np.ndarray]) -> List[List[Dict]]:
+        """
+        Inferir varios frames (uno por cámara) en una sola llamada
+
+        Por defecto los procesa de uno en uno; los backends que admiten
+        lotes lo sobrescriben con una única invocación del modelo
+
+        Returns:
+            Lista de detecciones por frame, en el mismo orden
+        """
+        return [self.inferir(frame) for frame in frames]
+
+
+class BackendUltralytics(BackendInferencia):
+    """YOLOv8 con la librería Ultralytics (PyTorch): el más lento en ARM, pero sin exportar"""
+
+    nombre = 'ultralytics'
+
+    def cargar(self):
+        from ultralytics import YOLO  # Import pesado: solo si se usa este backend
+        self.modelo = YOLO(self.ruta_modelo)
+        self.nombres = [self.modelo.names[i] for i in sorted(self.modelo.names)]
+        self.mascara_clases = self._mascara(self.clases)
+
+    def _convertir(self, result) -> List[Dict]:
+        """Detecciones de las clases configuradas en un resultado de Ultralytics
+
+        Los tensores se pasan a NumPy una sola vez por resultado (no caja a caja)
+        y las clases se filtran con la máscara precalculada
+        """
+        cajas = result.boxes.cpu().numpy()
+        clases = cajas.cls.astype(np.int64)
+        validas = self.mascara_clases[clases]
+        return a_detecciones(cajas.xyxy[validas], cajas.conf[validas], clases[validas], self.nombres)
+
+    def inferir(self, frame: np.ndarray) -> List[Dict]:
+        resultados = self.modelo(frame, conf=self.confianza, imgsz=self.tamano, verbose=False)
+        return [d for result in resultados for d in self._convertir(result)]
+
+    def inferir_lote(self, frames: List[np.ndarray]) -> List[List[Dict]]:
+        # Ultralytics acepta una lista de imágenes y las pasa por la red como un lote
+        resultados = self.modelo(list(frames), conf=self.confianza, imgsz=self.tamano, verbose=False)
+        return [self._convertir(result) for result in resultados]
+
+
+class BackendExportado(BackendInferencia):
+    """Base de los backends que ejecutan un YOLOv8 exportado con nuestro pre/post-procesado"""
+
+    # Formato de entrada que espera el runtime
+    nhwc = False
+
+    # True si el modelo se exportó con lote dinámico (`yolo export ... dynamic=True`)
+    lote_dinamico = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.letterbox = Letterbox(self.tamano)
+        self.entrada = np.empty((1, 3, self.tamano, self.tamano), dtype=np.float32)
+
+        # Un letterbox por posición del lote (cada cámara puede tener su resolución)
+        self.letterboxes = [self.letterbox]
+        self.entrada_lote = self.entrada
+
+    def _ajustar_tamano(self, tamano_modelo):
+        """Un modelo exportado con entrada fija manda sobre el tamaño pedido"""
+        if not isinstance(tamano_modelo, int) or tamano_modelo <= 0 or tamano_modelo == self.tamano:
+            return
+        logger.warning(f'⚠️ {self.ruta_modelo} tiene entrada fija de {tamano_modelo}px: se ignora '
+                       f'tamano={self.tamano} (exportar con imgsz={self.tamano} para usarlo)')
+        self.tamano = tamano_modelo
+        self.letterbox = Letterbox(tamano_modelo)
+        self.letterboxes = [self.letterbox]
+        forma = ((1, tamano_modelo, tamano_modelo, 3) if self.nhwc
+                 else (1, 3, tamano_modelo, tamano_modelo))
+        self.entrada = np.empty(forma, dtype=np.float32)
+        self.entrada_lote = self.entrada
+
+    def _rellenar(self, frame: np.ndarray, letterbox: Letterbox, destino: np.ndarray):
+        """Letterbox + BGR→RGB + normalización a [0, 1] sobre una posición del buffer"""
+        rgb = letterbox.aplicar(frame)[:, :, ::-1]
+        if self.nhwc:
+            np.multiply(rgb, 1 / 255.0, out=destino, casting='unsafe')
+        else:
+            np.multiply(rgb.transpose(2, 0, 1), 1 / 255.0, out=destino, casting='unsafe')
+
+    def preprocesar(self, frame: np.ndarray) -> np.ndarray:
+        """Preprocesar un frame escribiendo en un buffer reutilizado"""
+        self._rellenar(frame, self.letterbox, self.entrada[0])
+        return self.entrada
+
+    def preprocesar_lote(self, frames: List[np.ndarray]) -> np.ndarray:
+        """Preprocesar varios frames en un buffer (N, ...) que solo crece si hace falta"""
+        n = len(frames)
+        if self.entrada_lote.shape[0] < n:
+            self.entrada_lote = np.empty((n,) + self.entrada.shape[1:], dtype=np.float32)
+        while len(self.letterboxes) < n:
+            self.letterboxes.append(Letterbox(self.tamano))
+        for i, frame in enumerate(frames):
+            self._rellenar(frame, self.letterboxes[i], self.entrada_lote[i])
+        return self.entrada_lote[:n]
+
+    @abc.abstractmethod
+    def ejecutar(self, entrada: np.ndarray) -> np.ndarray:
+        """Ejecutar el runtime y devolver la salida cruda (1, 84, N)"""
+
+    def inferir(self, frame: np.ndarray) -> List[Dict]:
+        salida = self.ejecutar(self.preprocesar(frame))
+        cajas, confianzas, clases = postprocesar_yolov8(salida, self.mascara_clases, self.confianza)
+        return a_detecciones(self.letterbox.deshacer(cajas), confianzas, clases, self.nombres)
+
+    def inferir_lote(self, frames: List[np.ndarray]) -> List[List[Dict]]:
+        # Con lote fijo (1) el modelo no acepta más frames: se cae al bucle de la base
+        if not self.lote_dinamico or len(frames) == 1:
+            return super().inferir_lote(frames)
+
+        salida = self.ejecutar(self.preprocesar_lote(frames))
+        resultados = []
+        for i in range(len(frames)):
+            cajas, confianzas, clases = postprocesar_yolov8(salida[i:i + 1], self.mascara_clases,
+                                                           self.confianza)
+            resultados.append(a_detecciones(self.letterboxes[i].deshacer(cajas), confianzas,
+                                            clases, self.nombres))
+        return resultados
+
+
+class BackendONNX(BackendExportado):
+    """YOLOv8 exportado a ONNX ejecutado con ONNX Runtime en CPU"""
+
+    nombre = 'onnx'
+
+    def cargar(self):
+        import onnxruntime as ort
+        opciones = ort.SessionOptions()
+        opciones.intra_op_num_threads = HILOS_CPU
+        opciones.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sesion = ort.InferenceSession(self.ruta_modelo, opciones,
+                                           providers=['CPUExecutionProvider'])
+        self.nombre_entrada = self.sesion.get_inputs()[0].name
+        forma = self.sesion.get_inputs()[0].shape
+        # Dimensión de lote simbólica ('batch') en vez de un entero fijo
+        self.lote_dinamico = not isinstance(forma[0], int)
+        self._ajustar_tamano(forma[2])
+
+    def ejecutar(self, entrada: np.ndarray) -> np.ndarray:
+        return self.sesion.run(None, {self.nombre_entrada: entrada})[0]
+
+
+class BackendOpenVINO(BackendExportado):
+    """YOLOv8 exportado a OpenVINO IR ejecutado en CPU"""
+
+    nombre = 'openvino'
+
+    def cargar(self):
+        import openvino as ov
+        core = ov.Core()
+        modelo = core.read_model(self.ruta_modelo)
+        forma = modelo.inputs[0].get_partial_shape()
+        self.lote_dinamico = forma[0].is_dynamic
+        if forma[2].is_static:
+            self._ajustar_tamano(forma[2].get_length())
+        self.compilado = core.compile_model(modelo, 'CPU', {'INFERENCE_NUM_THREADS': HILOS_CPU})
+        self.peticion = self.compilado.create_infer_request()
+
+    def ejecutar(self, entrada: np.ndarray) -> np.ndarray:
+        self.peticion.infer({0: entrada})
+        return self.peticion.get_output_tensor(0).data
+
+
+class BackendTFLite(BackendExportado):
+    """YOLOv8 exportado a TFLite (cuantizado int8) con tflite-runtime"""
+
+    nombre = 'tflite'
+    nhwc = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.entrada = np.empty((1, self.tamano, self.tamano, 3), dtype=np.float32)
+        self.entrada_lote = self.entrada
+
+    def cargar(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interprete = Interpreter(model_path=self.ruta_modelo, num_threads=HILOS_CPU)
+        self.interprete.allocate_tensors()
+        self.detalle_entrada = self.interprete.get_input_details()[0]
+        self.detalle_salida = self.interprete.get_output_details()[0]
+        self._ajustar_tamano(int(self.detalle_entrada['shape'][1]))
+
+    def ejecutar(self, entrada: np.ndarray) -> np.ndarray:
+        # Modelos cuantizados (int8/uint8): cuantizar la entrada y descuantizar la salida
+        escala, cero = self.detalle_entrada['quantization']
+        tipo = self.detalle_entrada['dtype']
+        if np.issubdtype(tipo, np.integer) and escala:
+            rango = np.iinfo(tipo)
+            entrada = np.clip(np.round(entrada / escala + cero), rango.min, rango.max).astype(tipo)
+        self.interprete.set_tensor(self.detalle_entrada['index'], entrada)
+        self.interprete.invoke()
+
+        salida = self.interprete.get_tensor(self.detalle_salida['index'])
+        escala, cero = self.detalle_salida['quantization']
+        if salida.dtype != np.float32 and escala:
+            salida = (salida.astype(np.float32) - cero) * escala
+
+        # Ultralytics exporta TFLite con las cajas normalizadas a [0, 1]
+        salida = salida.astype(np.float32, copy=True)
+        salida[:, :4] *= self.tamano
+        return salida
+
+
+BACKENDS = {
+    'ultralytics': BackendUltralytics,
+    'onnx': BackendONNX,
+    'openvino': BackendOpenVINO,
+    'tflite': BackendTFLite,
+}
+
+
+def crear_backend(nombre: str = BACKEND_INFERENCIA, **kwargs) -> BackendInferencia:
+    """
+    Crear y cargar un backend de inferencia
+
+    Args:
+        nombre: 'ultralytics', 'onnx', 'openvino' o 'tflite'
+        **kwargs: ruta_modelo, clases, confianza, tamano
+
+    Returns:
+        Backend listo para inferir
+    """
+    if nombre not in BACKENDS:
+        raise ValueError(f'Backend de inferencia desconocido: {nombre!r} (opciones: {list(BACKENDS)})')
+    backend = BACKENDS[nombre](**kwargs)
+    inicio = time.time()
+    backend.cargar()
+    logger.info(f'✅ Backend {nombre} cargado en {time.time() - inicio:.1f}s ({backend.ruta_modelo})')
+    return backend
+
+
+# ==================== COMPARATIVA ====================
+def comparar_backends(frame: Optional[np.ndarray] = None, nombres: Optional[List[str]] = None,
+                      repeticiones: int = 20, calentamiento: int = 3,
+                      tamano: Optional[int] = None, clases: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Medir la latencia de cada backend disponible sobre el mismo frame
+
+    Args:
+        tamano: Lado de la entrada del modelo (None = el de la cámara, TAMANO_INFERENCIA)
+        clases: Clases a detectar (None = las de la cámara, CLASES_DETECTAR)
+
+    Returns:
+        {backend: {'media_ms', 'p50_ms', 'p95_ms', 'detecciones'} o {'error'}}
+    """
+    if tamano is None or clases is None:
+        # Medir con la configuración con la que la cámara usa los backends
+        from camera import TAMANO_INFERENCIA, CLASES_DETECTAR
+        tamano = tamano or TAMANO_INFERENCIA
+        clases = clases if clases is not None else CLASES_DETECTAR
+    if frame is None:
+        frame = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+
+    resultados = {}
+    for nombre in nombres or list(BACKENDS):
+        try:
+            backend = crear_backend(nombre, tamano=tamano, clases=clases)
+        except Exception as e:
+            logger.warning(f'⚠️ Backend {nombre} no disponible: {e}')
+            resultados[nombre] = {'error': str(e)}
+            continue
+
+        for _ in range(calentamiento):
+            backend.inferir(frame)
+
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            detecciones = backend.inferir(frame)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        tiempos = np.array(tiempos)
+        resultados[nombre] = {
+            'media_ms': round(float(tiempos.mean()), 1),
+            'p50_ms': round(float(np.percentile(tiempos, 50)), 1),
+            'p95_ms': round(float(np.percentile(tiempos, 95)), 1),
+            'detecciones': len(detecciones)
+        }
+        logger.info(f'⏱️ {nombre}: {resultados[nombre]}')
+
+    return resultados
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        datefmt='%H:%M:%S')
+    parser = argparse.ArgumentParser(description='Backends de inferencia YOLOv8')
+    parser.add_argument('--comparar', action='store_true', help='comparar latencias')
+    parser.add_argument('--backends', nargs='*', default=None)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--imagen', default=None, help='imagen de prueba (por defecto ruido)')
+    args = parser.parse_args()
+
+    if args.comparar:
+        frame = cv2.imread(args.imagen) if args.imagen else None
+        resultados = comparar_backends(frame, args.backends, args.repeticiones)
+        print(f'\n{"Backend":<14}{"media":>10}{"p50":>10}{"p95":>10}')
+        for nombre, r in resultados.items():
+            if 'error' in r:
+                print(f'{nombre:<14}  no disponible ({r["error"]})')
+            else:
+                print(f'{nombre:<14}{r["media_ms"]:>8.1f}ms{r["p50_ms"]:>8.1f}ms{r["p95_ms"]:>8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
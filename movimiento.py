@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Detector de movimiento barato para decidir cuándo merece la pena ejecutar YOLO
+Trabaja sobre una copia pequeña en escala de grises con un fondo promediado
+"""
+
+import cv2
+import numpy as np
+import time
+import logging
+from typing import Dict
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Tamaño de la copia reducida sobre la que se calcula el movimiento
+ANCHO_MOVIMIENTO = 160
+ALTO_MOVIMIENTO = 120
+
+# Diferencia mínima de gris para considerar que un píxel cambió
+UMBRAL_PIXEL = 25
+
+# Fracción de píxeles cambiados a partir de la cual hay movimiento
+UMBRAL_ENERGIA = 0.01
+
+# Velocidad de adaptación del fondo (más alto = olvida antes)
+ALFA_FONDO = 0.05
+
+# Con la escena quieta se infiere igualmente cada INTERVALO_LATIDO segundos
+INTERVALO_LATIDO = 2.0
+
+# Tras detectar movimiento se sigue infiriendo durante este tiempo
+VENTANA_ACTIVA = 3.0
+
+
+class DetectorMovimiento:
+    """Puerta de movimiento delante del modelo: diferencia contra un fondo promediado"""
+
+    def __init__(self, umbral_energia: float = UMBRAL_ENERGIA,
+                 intervalo_latido: float = INTERVALO_LATIDO,
+                 ventana_activa: float = VENTANA_ACTIVA):
+        self.umbral_energia = umbral_energia
+        self.intervalo_latido = intervalo_latido
+        self.ventana_activa = ventana_activa
+
+        # Buffers reutilizados en cada frame
+        self.pequeno = np.empty((ALTO_MOVIMIENTO, ANCHO_MOVIMIENTO, 3), dtype=np.uint8)
+        self.gris = np.empty((ALTO_MOVIMIENTO, ANCHO_MOVIMIENTO), dtype=np.uint8)
+        self.fondo_u8 = np.empty_like(self.gris)
+        self.diferencia = np.empty_like(self.gris)
+        self.fondo = None
+
+        self.ultimo_movimiento = 0.0
+        self.ultima_inferencia = 0.0
+        self.energia = 0.0
+
+        # Estadísticas
+        self.frames_evaluados = 0
+        self.inferencias_movimiento = 0
+        self.inferencias_actividad = 0
+        self.inferencias_latido = 0
+
+    def medir(self, frame) -> float:
+        """Fracción de píxeles que cambiaron respecto al fondo (0-1)"""
+        cv2.resize(frame, (ANCHO_MOVIMIENTO, ALTO_MOVIMIENTO), dst=self.pequeno,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.pequeno, cv2.COLOR_BGR2GRAY, dst=self.gris)
+        cv2.GaussianBlur(self.gris, (5, 5), 0, dst=self.gris)
+
+        if self.fondo is None:
+            self.fondo = self.gris.astype(np.float32)
+            return 0.0
+
+        cv2.convertScaleAbs(self.fondo, dst=self.fondo_u8)
+        cv2.absdiff(self.gris, self.fondo_u8, dst=self.diferencia)
+        cv2.accumulateWeighted(self.gris, self.fondo, ALFA_FONDO)
+
+        cambiados = cv2.countNonZero(
+            cv2.threshold(self.diferencia, UMBRAL_PIXEL, 255, cv2.THRESH_BINARY,
+                          dst=self.diferencia)[1])
+        return cambiados / self.diferencia.size
+
+    def debe_inferir(self, frame, hay_detecciones: bool = False) -> bool:
+        """
+        Decidir si este frame pasa al modelo
+
+        Args:
+            frame: Frame BGR a tamaño completo
+            hay_detecciones: Si hay objetos detectados, se sigue infiriendo para seguirlos
+
+        Returns:
+            True si hay que ejecutar la inferencia
+        """
+        ahora = time.time()
+        self.frames_evaluados += 1
+        self.energia = self.medir(frame)
+
+        if self.energia >= self.umbral_energia:
+            self.ultimo_movimiento = ahora
+            self.inferencias_movimiento += 1
+        elif hay_detecciones or ahora - self.ultimo_movimiento < self.ventana_activa:
+            self.inferencias_actividad += 1
+        elif ahora - self.ultima_inferencia >= self.intervalo_latido:
+            self.inferencias_latido += 1
+        else:
+            return False
+
+        self.ultima_inferencia = ahora
+        return True
+
+    def obtener_estadisticas(self) -> Dict:
+        """Contadores de la puerta de movimiento"""
+        inferencias = (self.inferencias_movimiento + self.inferencias_actividad
+                       + self.inferencias_latido)
+        return {
+            'energia': round(self.energia, 4),
+            'umbral': self.umbral_energia,
+            'frames_evaluados': self.frames_evaluados,
+            'inferencias': inferencias,
+            'por_movimiento': self.inferencias_movimiento,
+            'por_actividad': self.inferencias_actividad,
+            'por_latido': self.inferencias_latido,
+            'tasa_paso': round(inferencias / self.frames_evaluados, 3) if self.frames_evaluados else 0.0
+        }
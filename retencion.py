@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Retención de grabaciones e índice de clips
+Un índice SQLite pequeño guarda cada segmento grabado con sus metadatos de
+detección (clases, objetos) para listarlos y filtrarlos sin recorrer la SD,
+y un thread borra los más antiguos cuando se superan la cuota de espacio,
+la antigüedad máxima o el mínimo de espacio libre en la tarjeta
+"""
+
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Cuota de espacio para todas las grabaciones (GB)
+MAX_GB_GRABACIONES = 8.0
+
+# Antigüedad máxima de un clip (días; 0 = sin límite)
+MAX_DIAS_GRABACIONES = 14
+
+# Espacio libre que se deja siempre en la tarjeta (GB)
+MIN_GB_LIBRES = 1.0
+
+# Cada cuánto se revisan las cuotas aunque no haya clips nuevos (s)
+INTERVALO_RETENCION = 60.0
+
+# Archivo del índice, dentro de la carpeta de grabaciones
+ARCHIVO_INDICE = 'clips.sqlite3'
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    camara TEXT NOT NULL,
+    archivo TEXT NOT NULL UNIQUE,
+    inicio REAL NOT NULL,
+    fin REAL NOT NULL,
+    bytes INTEGER NOT NULL,
+    frames INTEGER NOT NULL DEFAULT 0,
+    clases TEXT NOT NULL DEFAULT '',
+    objetos INTEGER NOT NULL DEFAULT 0,
+    max_simultaneos INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS clips_inicio ON clips (inicio);
+CREATE INDEX IF NOT EXISTS clips_camara_inicio ON clips (camara, inicio);
+"""
+
+
+def ruta_segmento(directorio: Path, camara_id: str, instante: float, sufijo: str = '') -> Path:
+    """
+    video_<camara>_<fecha>_<hora con ms>[_sufijo].mp4 que aún no exista
+
+    Dos segmentos del mismo segundo (rotación por tamaño, reinicio del
+    grabador) no deben pisarse: rename() sobrescribiría el archivo y el
+    índice perdería la fila del anterior
+    """
+    while True:
+        fecha = datetime.fromtimestamp(instante)
+        nombre = f'video_{camara_id}_{fecha.strftime("%Y%m%d_%H%M%S")}{fecha.microsecond // 1000:03d}'
+        ruta = Path(directorio) / (f'{nombre}_{sufijo}.mp4' if sufijo else f'{nombre}.mp4')
+        if not ruta.exists():
+            return ruta
+        instante += 0.001
+
+
+class GestorRetencion:
+    """Índice de clips y borrado por cuotas de una carpeta de grabaciones (thread-safe)"""
+
+    def __init__(self, directorio: Path, max_gb: float = MAX_GB_GRABACIONES,
+                 max_dias: float = MAX_DIAS_GRABACIONES, min_gb_libres: float = MIN_GB_LIBRES):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(exist_ok=True)
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        self.max_segundos = max_dias * 86400
+        self.min_libres = int(min_gb_libres * 1024 ** 3)
+        self.lock = threading.Lock()
+        self.conexion = sqlite3.connect(str(self.directorio / ARCHIVO_INDICE), check_same_thread=False)
+        self.conexion.row_factory = sqlite3.Row
+        # WAL: los servidores HTTP de otros procesos leen mientras se escribe
+        self.conexion.execute('PRAGMA journal_mode=WAL')
+        self.conexion.executescript(ESQUEMA)
+        self.aviso = threading.Event()
+        self.thread = None
+
+        self.borrados = 0
+        self.bytes_borrados = 0
+
+    # ---------- Índice ----------
+    def registrar(self, camara_id: str, ruta: Path, inicio: float, fin: float, frames: int = 0,
+                  clases: Iterable[str] = (), objetos: int = 0, max_simultaneos: int = 0) -> int:
+        """
+        Añadir un segmento cerrado al índice
+
+        Args:
+            camara_id: Cámara que lo grabó
+            ruta: Archivo del segmento (dentro de la carpeta de grabaciones)
+            inicio, fin: time.time() del primer y último frame
+            frames: Frames escritos
+            clases: Clases detectadas durante el segmento
+            objetos: Objetos distintos (track_id) vistos
+            max_simultaneos: Máximo de objetos a la vez en un frame
+
+        Returns:
+            id del clip
+        """
+        ruta = Path(ruta)
+        with self.lock, self.conexion:
+            cursor = self.conexion.execute(
+                'INSERT OR REPLACE INTO clips (camara, archivo, inicio, fin, bytes, frames, clases, '
+                'objetos, max_simultaneos) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (camara_id, ruta.name, inicio, fin, ruta.stat().st_size, frames,
+                 ','.join(sorted(clases)), objetos, max_simultaneos))
+        self.aviso.set()
+        return cursor.lastrowid
+
+    def _a_dict(self, fila) -> Dict:
+        clip = dict(fila)
+        clip['clases'] = clip['clases'].split(',') if clip['clases'] else []
+        clip['duracion'] = round(clip['fin'] - clip['inicio'], 2)
+        clip['url'] = f"/clips/{clip['id']}"
+        return clip
+
+    def listar(self, camara_id: Optional[str] = None, desde: Optional[float] = None,
+               hasta: Optional[float] = None, clase: Optional[str] = None,
+               limite: int = 100) -> List[Dict]:
+        """Clips más recientes primero, filtrados por cámara, intervalo y clase detectada"""
+        condiciones, parametros = [], []
+        if camara_id:
+            condiciones.append('camara = ?')
+            parametros.append(camara_id)
+        if desde is not None:
+            condiciones.append('fin >= ?')
+            parametros.append(desde)
+        if hasta is not None:
+            condiciones.append('inicio <= ?')
+            parametros.append(hasta)
+        if clase:
+            condiciones.append("(',' || clases || ',') LIKE ?")
+            parametros.append(f'%,{clase},%')
+        consulta = 'SELECT * FROM clips'
+        if condiciones:
+            consulta += ' WHERE ' + ' AND '.join(condiciones)
+        consulta += ' ORDER BY inicio DESC LIMIT ?'
+        parametros.append(limite)
+        with self.lock:
+            return [self._a_dict(f) for f in self.conexion.execute(consulta, parametros)]
+
+    def obtener(self, clip_id: int) -> Optional[Dict]:
+        """Datos de un clip, con la ruta completa del archivo"""
+        with self.lock:
+            fila = self.conexion.execute('SELECT * FROM clips WHERE id = ?', (clip_id,)).fetchone()
+        if fila is None:
+            return None
+        clip = self._a_dict(fila)
+        clip['ruta'] = self.directorio / clip['archivo']
+        return clip
+
+    def sincronizar(self, camaras: Iterable[str] = ()):
+        """Poner el índice al día con lo que hay en disco (al arrancar)
+
+        Los segmentos que quedaron a medias por un corte de luz (`.grabando_*`
+        de las cámaras indicadas) se recuperan: el MP4 fragmentado es
+        reproducible hasta el último fragmento. Los writers preparados que no
+        llegaron a recibir frames (`.preparado_*`) se borran. Los archivos sin
+        indexar se añaden sin metadatos y las filas sin archivo se eliminan
+        """
+        for camara_id in camaras:
+            for ruta in self.directorio.glob(f'.preparado_{camara_id}_*.mp4'):
+                ruta.unlink(missing_ok=True)
+            for ruta in self.directorio.glob(f'.grabando_{camara_id}_*.mp4'):
+                if ruta.stat().st_size == 0:
+                    ruta.unlink(missing_ok=True)
+                    continue
+                destino = ruta_segmento(self.directorio, camara_id, ruta.stat().st_mtime, 'recuperado')
+                ruta.rename(destino)
+                logger.warning(f'⚠️ Segmento interrumpido recuperado: {destino.name}')
+
+        with self.lock:
+            indexados = {f['archivo'] for f in self.conexion.execute('SELECT archivo FROM clips')}
+        en_disco = {r.name: r for r in self.directorio.glob('video_*.mp4')}
+
+        for nombre in indexados - en_disco.keys():
+            with self.lock, self.conexion:
+                self.conexion.execute('DELETE FROM clips WHERE archivo = ?', (nombre,))
+        for nombre in en_disco.keys() - indexados:
+            # video_<camara>_<fecha>_<hora con ms>[_recuperado].mp4
+            partes = nombre[len('video_'):-len('.mp4')].split('_')
+            camara_id = '_'.join(partes[:-3] if partes[-1] == 'recuperado' else partes[:-2]) or 'desconocida'
+            mtime = en_disco[nombre].stat().st_mtime
+            self.registrar(camara_id, en_disco[nombre], mtime, mtime)
+
+    # ---------- Cuotas ----------
+    def aplicar(self) -> int:
+        """Borrar los clips más antiguos hasta cumplir las cuotas
+
+        Returns:
+            Número de clips borrados
+        """
+        borrados = 0
+        ahora = time.time()
+        while True:
+            with self.lock:
+                fila = self.conexion.execute(
+                    'SELECT id, archivo, inicio, bytes FROM clips ORDER BY inicio LIMIT 1').fetchone()
+                total = self.conexion.execute('SELECT COALESCE(SUM(bytes), 0) FROM clips').fetchone()[0]
+            if fila is None:
+                break
+
+            caducado = self.max_segundos and ahora - fila['inicio'] > self.max_segundos
+            libres = shutil.disk_usage(self.directorio).free
+            if not (caducado or total > self.max_bytes or libres < self.min_libres):
+                break
+
+            (self.directorio / fila['archivo']).unlink(missing_ok=True)
+            with self.lock, self.conexion:
+                self.conexion.execute('DELETE FROM clips WHERE id = ?', (fila['id'],))
+            borrados += 1
+            self.borrados += 1
+            self.bytes_borrados += fila['bytes']
+
+        if borrados:
+            logger.info(f'🧹 Retención: {borrados} clip(s) antiguos borrados')
+        return borrados
+
+    def arrancar(self):
+        """Revisar las cuotas en segundo plano (cada INTERVALO_RETENCION o al registrar un clip)"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._bucle, daemon=True, name='retencion')
+            self.thread.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                self.aplicar()
+            except Exception as e:
+                logger.error(f'❌ Error aplicando retención: {e}')
+            self.aviso.wait(INTERVALO_RETENCION)
+            self.aviso.clear()
+
+    def obtener_estadisticas(self) -> Dict:
+        with self.lock:
+            clips, total = self.conexion.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM clips').fetchone()
+        return {
+            'clips': clips,
+            'mb': round(total / 1024 ** 2, 1),
+            'cuota_mb': round(self.max_bytes / 1024 ** 2, 1),
+            'libres_mb': round(shutil.disk_usage(self.directorio).free / 1024 ** 2, 1),
+            'borrados': self.borrados,
+            'mb_borrados': round(self.bytes_borrados / 1024 ** 2, 1)
+        }
+
+
+# ==================== FUNCIÓN GLOBAL ====================
+gestores: Dict[Path, GestorRetencion] = {}
+_lock_gestores = threading.Lock()
+
+
+def obtener_retencion(directorio: Path) -> GestorRetencion:
+    """Gestor de retención compartido de una carpeta de grabaciones"""
+    directorio = Path(directorio).resolve()
+    with _lock_gestores:
+        if directorio not in gestores:
+            gestores[directorio] = GestorRetencion(directorio)
+        return gestores[directorio]
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Seguimiento de objetos entre detecciones (estilo SORT)
+Filtro de Kalman de velocidad constante por objeto + asociación por IoU,
+para mantener IDs estables y predecir las cajas en los frames sin inferencia
+"""
+
+import threading
+import time
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# IoU mínimo para asociar una detección con un objeto seguido
+IOU_MINIMO = 0.3
+
+# Detecciones asociadas necesarias para dar un objeto por confirmado
+MIN_ACIERTOS = 2
+
+# Segundos sin volver a ver un objeto antes de olvidarlo
+MAX_TIEMPO_PERDIDO = 1.5
+
+# Ruido del modelo (píxeles) para el filtro de Kalman
+RUIDO_MEDIDA = 10.0
+RUIDO_PROCESO = 50.0
+
+
+def calcular_iou(cajas_a: np.ndarray, cajas_b: np.ndarray) -> np.ndarray:
+    """
+    Matriz de IoU entre dos conjuntos de cajas (x1, y1, x2, y2)
+
+    Returns:
+        Array (len(a), len(b))
+    """
+    a = cajas_a[:, None, :]
+    b = cajas_b[None, :, :]
+    ancho = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    alto = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    interseccion = ancho * alto
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return interseccion / np.maximum(area_a + area_b - interseccion, 1e-6)
+
+
+def caja_a_estado(caja) -> np.ndarray:
+    """(x1, y1, x2, y2) → (cx, cy, w, h)"""
+    x1, y1, x2, y2 = caja
+    return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float64)
+
+
+def estado_a_caja(estado: np.ndarray) -> tuple:
+    """(cx, cy, w, h) → (x1, y1, x2, y2) en enteros"""
+    cx, cy = estado[0], estado[1]
+    w, h = max(estado[2], 1.0), max(estado[3], 1.0)
+    return (int(cx - w / 2), int(cy - h / 2), int(cx + w / 2), int(cy + h / 2))
+
+
+# ==================== OBJETO SEGUIDO ====================
+class ObjetoSeguido:
+    """Un objeto con su filtro de Kalman: estado (cx, cy, w, h, vx, vy, vw, vh) por segundo"""
+
+    H = np.hstack([np.eye(4), np.zeros((4, 4))])
+    R = np.eye(4) * RUIDO_MEDIDA ** 2
+
+    def __init__(self, track_id: int, deteccion: Dict, instante: float):
+        self.track_id = track_id
+        self.clase = deteccion['clase']
+        self.confianza = deteccion['confianza']
+        self.x = np.zeros(8)
+        self.x[:4] = caja_a_estado(deteccion['bbox'])
+        self.P = np.diag([RUIDO_MEDIDA ** 2] * 4 + [1000.0 ** 2] * 4)
+        self.t_estado = instante
+        self.primer_visto = instante
+        self.ultimo_visto = instante
+        self.aciertos = 1
+
+    def predecir(self, instante: float):
+        """Avanzar el filtro hasta `instante` (paso de predicción de Kalman)"""
+        dt = instante - self.t_estado
+        if dt <= 0:
+            return
+        F = np.eye(8)
+        F[:4, 4:] = np.eye(4) * dt
+        Q = np.eye(8) * (RUIDO_PROCESO ** 2) * dt
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        self.t_estado = instante
+
+    def corregir(self, deteccion: Dict, instante: float):
+        """Paso de corrección con una detección asociada"""
+        z = caja_a_estado(deteccion['bbox'])
+        y = z - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+        self.confianza = deteccion['confianza']
+        self.ultimo_visto = instante
+        self.aciertos += 1
+
+    def caja_en(self, instante: float) -> tuple:
+        """Caja extrapolada a `instante` sin tocar el filtro (para frames sin inferencia)"""
+        dt = max(instante - self.t_estado, 0.0)
+        return estado_a_caja(self.x[:4] + self.x[4:] * dt)
+
+    def a_dict(self, instante: float) -> Dict:
+        """Formato de self.detecciones, ampliado con el seguimiento"""
+        return {
+            'clase': self.clase,
+            'confianza': self.confianza,
+            'bbox': self.caja_en(instante),
+            'track_id': self.track_id,
+            'velocidad': (round(float(self.x[4]), 1), round(float(self.x[5]), 1)),  # px/s
+            'permanencia': round(instante - self.primer_visto, 2),                  # s
+            'confirmado': self.aciertos >= MIN_ACIERTOS
+        }
+
+
+# ==================== SEGUIDOR ====================
+class SeguidorObjetos:
+    """Asocia detecciones sucesivas a objetos con ID estable (thread-safe)"""
+
+    def __init__(self, iou_minimo: float = IOU_MINIMO,
+                 max_tiempo_perdido: float = MAX_TIEMPO_PERDIDO):
+        self.iou_minimo = iou_minimo
+        self.max_tiempo_perdido = max_tiempo_perdido
+        self.objetos: List[ObjetoSeguido] = []
+        self.siguiente_id = 1
+        self.lock = threading.Lock()
+
+    def actualizar(self, detecciones: List[Dict], instante: Optional[float] = None) -> List[Dict]:
+        """
+        Incorporar las detecciones de una inferencia
+
+        Args:
+            detecciones: Lista de {'clase', 'confianza', 'bbox'}
+            instante: Momento de captura del frame inferido
+
+        Returns:
+            Objetos seguidos en `instante`
+        """
+        if instante is None:
+            instante = time.time()
+
+        with self.lock:
+            for objeto in self.objetos:
+                objeto.predecir(instante)
+
+            libres = list(range(len(detecciones)))
+            if self.objetos and detecciones:
+                predichas = np.array([estado_a_caja(o.x[:4]) for o in self.objetos], dtype=np.float64)
+                detectadas = np.array([d['bbox'] for d in detecciones], dtype=np.float64)
+                iou = calcular_iou(predichas, detectadas)
+
+                # Solo se asocian objetos y detecciones de la misma clase
+                clases_obj = np.array([o.clase for o in self.objetos])
+                clases_det = np.array([d['clase'] for d in detecciones])
+                iou[clases_obj[:, None] != clases_det[None, :]] = 0
+
+                # Asociación voraz de mayor a menor IoU
+                usados_obj, usados_det = set(), set()
+                for indice in np.argsort(-iou, axis=None):
+                    i, j = divmod(int(indice), iou.shape[1])
+                    if iou[i, j] < self.iou_minimo:
+                        break
+                    if i in usados_obj or j in usados_det:
+                        continue
+                    self.objetos[i].corregir(detecciones[j], instante)
+                    usados_obj.add(i)
+                    usados_det.add(j)
+                libres = [j for j in libres if j not in usados_det]
+
+            for j in libres:
+                self.objetos.append(ObjetoSeguido(self.siguiente_id, detecciones[j], instante))
+                self.siguiente_id += 1
+
+            self.objetos = [o for o in self.objetos
+                            if instante - o.ultimo_visto <= self.max_tiempo_perdido]
+            return [o.a_dict(instante) for o in self.objetos]
+
+    def predecir(self, instante: Optional[float] = None, solo_confirmados: bool = True) -> List[Dict]:
+        """Cajas extrapoladas a `instante` para un frame que no pasó por el modelo"""
+        if instante is None:
+            instante = time.time()
+        with self.lock:
+            return [o.a_dict(instante) for o in self.objetos
+                    if instante - o.ultimo_visto <= self.max_tiempo_perdido
+                    and (not solo_confirmados or o.aciertos >= MIN_ACIERTOS)]
+
+    def reiniciar(self):
+        """Olvidar todos los objetos"""
+        with self.lock:
+            self.objetos = []
@@ -3,23 +3,78 @@
 Servidor Socket.IO para Raspberry Pi - Control de Ventanas del Coche
 Conecta con el backend para recibir comandos y ejecutarlos mediante CAN
 Incluye sistema de cámara con detección de objetos usando YOLOv8
+
+Todo corre en un único bucle asyncio: handlers, reconexión, estado del
+vehículo, eventos de detección y stream de frames son tareas que cooperan.
+Lo que bloquea (JPEG, estado de la cámara, arranque) va a un executor acotado
+y las ráfagas CAN siguen en su hilo dedicado, que necesita temporización fina
 """
 
+import asyncio
+import functools
+import json
+import random
 import socketio
+import aiohttp
 import time
-import subprocess
 import logging
-import threading
 import numpy as np
 import cv2
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional
-# Nota: No importamos camera aquí, solo se usa en webrtc_server_mjpeg.py
+from can_bus import (TransmisorCAN, ColaComandosCAN, CacheTramasCAN,
+                     RAFAGA_NUM_TRAMAS, RAFAGA_INTERVALO_MS)
+from can_bus import formatear_id, desempaquetar_trama
+from can_codec import obtener_codec
+from can_receptor import ReceptorCAN
+from can_traza import GrabadorTraza
+from adaptacion import ControlAdaptativo
+# camera no se importa aquí: arrastra la inferencia y la grabación y crea videos_grabados/.
+# Solo se carga si este servidor abre la cámara (ver CAMARA_EN_ESTE_SERVIDOR)
 
 # ==================== CONFIGURACIÓN ====================
 BACKEND_URL = 'http://192.168.0.79:3000'  # Cambia esto por la IP real de tu backend
 MI_COCHE_ID = 'CITROEN_C4_001'
 
+# La cámara la abre normalmente webrtc_server_mjpeg.py (otro proceso); activar solo si
+# este servidor debe abrirla él mismo para servir frames por Socket.IO
+CAMARA_EN_ESTE_SERVIDOR = False
+
+# Eventos de detección del proceso que tiene la cámara (Server-Sent Events)
+URL_EVENTOS_CAMARA = 'http://127.0.0.1:8080/eventos'
+
+# Stream automático de frames por Socket.IO (JPEG como adjunto binario, sin Base64)
+FPS_STREAM = 10            # FPS por defecto si el requester no pide otros
+MAX_FPS_STREAM = 15        # Tope de FPS por espectador
+MAX_KBPS_STREAM = 1500     # Tope de ancho de banda por espectador (kbit/s)
+MAX_STREAMS = 4            # Espectadores simultáneos
+TIMEOUT_ACK_STREAM = 2.0   # Segundos sin ack tras los que se da el frame por perdido
+
+# solicitar_frame: segundos sin ack tras los que el frame se da por perdido, y sin
+# peticiones tras los que se olvida el estado de un requester
+TIMEOUT_ACK_FRAME = 2.0
+REQUESTER_INACTIVO = 60.0
+
+# Reconexión al backend: espera exponencial con jitter (s)
+RECONEXION_INICIAL = 1.0
+RECONEXION_MAXIMA = 60.0
+RECONEXION_ESTABLE = 30.0  # Una conexión que dura esto reinicia la espera
+TIMEOUT_CONEXION = 10.0
+
+# Trabajo bloqueante (JPEG, estado de cámara): hilos y tareas esperando como máximo
+HILOS_BLOQUEANTES = 2
+MAX_TRABAJOS_BLOQUEANTES = 8
+
+# Eventos de detección que se guardan sin conexión antes de descartar los más viejos
+MAX_LOTES_EVENTOS = 64
+
+# Un handler que tarde más que esto (ms) se avisa en el log
+UMBRAL_HANDLER_LENTO_MS = 50.0
+
+# Guardar una traza binaria de todo lo enviado/recibido por CAN (ver can_traza.py)
+GRABAR_TRAZA_CAN = True
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,52 +84,364 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ==================== MAPEO DE VENTANAS ====================
-# YA NO NECESITAMOS MAPEO AQUÍ, el backend envía los datos directamente
+# El backend envía los datos CAN directamente; esta tabla solo sirve para
+# precompilar al arrancar los comandos que ya sabemos que van a llegar
+# Ejemplo: 'delantera_izq_bajar': {'idCAN': '14C', 'datosCAN': '8080000080'}
 VENTANAS_CAN = {}
 
 # ==================== CLIENTE SOCKET.IO ====================
-sio = socketio.Client()
+# Sin reconexión interna: la gestiona mantener_conexion() con su propia espera
+sio = socketio.AsyncClient(reconnection=False)
 conectado = False
-camera = None
+reconexiones = 0
+
+# Bucle principal (se fija en principal()); los hilos de CAN y cámara le pasan
+# trabajo con pasar_al_bucle()
+bucle: Optional[asyncio.AbstractEventLoop] = None
+
+# Tareas de fondo del bucle por nombre (ver lanzar_tarea)
+tareas_servicio: Dict[str, asyncio.Task] = {}
+cerrando = False
+
+# Traza binaria del bus (se crea en principal())
+traza_can = None
+
+# Socket CAN persistente (sustituye a lanzar cangen por cada comando)
+transmisor_can = TransmisorCAN()
+# Cola de comandos: los handlers encolan y un hilo dedicado transmite
+cola_can = ColaComandosCAN(transmisor_can)
+# Tramas ya validadas y empaquetadas por (idCAN, datosCAN)
+cache_tramas = CacheTramasCAN()
+
+
+async def emitir(evento: str, datos: Dict, **kwargs) -> bool:
+    """
+    Emitir desde una tarea de fondo sin que una caída de la conexión la mate
+    
+    Entre comprobar `conectado` y el emit la conexión puede cerrarse; el emit
+    falla entonces con BadNamespaceError/ConnectionError
+    
+    Returns:
+        True si el evento salió
+    """
+    try:
+        await sio.emit(evento, datos, **kwargs)
+        return True
+    except Exception as e:
+        logger.warning(f'⚠️ No se pudo emitir {evento}: {e}')
+        return False
+
+
+def pasar_al_bucle(funcion, *args) -> None:
+    """Ejecutar `funcion` en el bucle desde otro hilo; se descarta si el bucle ya no existe"""
+    if bucle is None or bucle.is_closed():
+        return
+    try:
+        bucle.call_soon_threadsafe(funcion, *args)
+    except RuntimeError:
+        pass  # El bucle se cerró entre la comprobación y la llamada
+
+
+def lanzar_tarea(fabrica, nombre: str) -> asyncio.Task:
+    """Crear una tarea de fondo que se relanza (con aviso en el log) si termina por un error"""
+    tarea = asyncio.create_task(fabrica(), name=nombre)
+    tareas_servicio[nombre] = tarea
+    
+    def terminada(tarea):
+        if tarea.cancelled() or cerrando:
+            return
+        logger.error(f'❌ Tarea {nombre} terminó inesperadamente: {tarea.exception()!r}; '
+                     f'relanzando en 1 segundo')
+        bucle.call_later(1.0, lanzar_tarea, fabrica, nombre)
+    
+    tarea.add_done_callback(terminada)
+    return tarea
+
+
+# ==================== TRABAJO BLOQUEANTE ====================
+executor = ThreadPoolExecutor(max_workers=HILOS_BLOQUEANTES, thread_name_prefix='bloqueante')
+limite_bloqueantes: Optional[asyncio.Semaphore] = None  # Se crea en principal(), con el bucle
+trabajos_bloqueantes = 0
+
+
+async def en_executor(funcion, *args, **kwargs):
+    """
+    Ejecutar una función bloqueante fuera del bucle
+    
+    Como mucho MAX_TRABAJOS_BLOQUEANTES a la vez (en cola o corriendo): el resto
+    espera aquí en vez de acumularse sin límite en la cola del executor
+    """
+    global trabajos_bloqueantes
+    async with limite_bloqueantes:
+        trabajos_bloqueantes += 1
+        try:
+            return await bucle.run_in_executor(executor, functools.partial(funcion, *args, **kwargs))
+        finally:
+            trabajos_bloqueantes -= 1
+
+
+# ==================== CÁMARA LOCAL ====================
+def obtener_jpeg_local(*args, **kwargs):
+    """camera.obtener_jpeg, o (None, 0) si la cámara la tiene otro proceso"""
+    if not CAMARA_EN_ESTE_SERVIDOR:
+        return None, 0
+    from camera import obtener_jpeg
+    return obtener_jpeg(*args, **kwargs)
+
+
+def obtener_estado_camara_local(camara_id=None):
+    """camera.obtener_estado_camera, o desconectada si la cámara la tiene otro proceso"""
+    if not CAMARA_EN_ESTE_SERVIDOR:
+        return {'conectada': False, 'grabando': False}
+    from camera import obtener_estado_camera
+    return obtener_estado_camera(camara_id)
+
+
+# ==================== MÉTRICAS DE HANDLERS ====================
+latencias_handlers: Dict[str, Dict] = {}
+retraso_bucle_ms = 0.0
+retraso_bucle_maximo_ms = 0.0
+
+
+def medido(handler):
+    """Decorador: cuenta las llamadas a un handler y mide su duración en el bucle"""
+    @functools.wraps(handler)
+    async def envoltura(*args):
+        inicio = time.perf_counter()
+        try:
+            return await handler(*args)
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            metrica = latencias_handlers.setdefault(
+                handler.__name__, {'llamadas': 0, 'media_ms': 0.0, 'maximo_ms': 0.0})
+            metrica['llamadas'] += 1
+            metrica['media_ms'] += 0.1 * (ms - metrica['media_ms'])
+            metrica['maximo_ms'] = max(metrica['maximo_ms'], ms)
+            if ms > UMBRAL_HANDLER_LENTO_MS:
+                logger.warning(f'🐢 Handler {handler.__name__} lento: {ms:.1f} ms')
+    return envoltura
+
+
+async def vigilar_bucle():
+    """Medir cuánto se retrasa el bucle respecto a un sleep de 1 s (algo lo está bloqueando)"""
+    global retraso_bucle_ms, retraso_bucle_maximo_ms
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(1.0)
+        retraso = (time.perf_counter() - inicio - 1.0) * 1000
+        retraso_bucle_ms += 0.2 * (retraso - retraso_bucle_ms)
+        retraso_bucle_maximo_ms = max(retraso_bucle_maximo_ms, retraso)
+
+
+# ==================== ESTADO DEL VEHÍCULO ====================
+# Cambios de señales CAN aún sin emitir: se fusionan por señal, así que una caída
+# larga del backend no acumula nada (al volver se envía el último valor)
+cambios_vehiculo: Dict = {}
+aviso_vehiculo: Optional[asyncio.Event] = None  # Se crea en principal()
+
+
+def recibir_cambios_vehiculo(cambios: Dict) -> None:
+    """Callback del ReceptorCAN (hilo de emisión): pasar los cambios al bucle"""
+    def fusionar():
+        cambios_vehiculo.update(cambios)
+        aviso_vehiculo.set()
+    pasar_al_bucle(fusionar)
+
+
+async def reportar_estado_vehiculo():
+    """Tarea que envía al backend las señales CAN que cambiaron"""
+    while True:
+        await aviso_vehiculo.wait()
+        aviso_vehiculo.clear()
+        if not conectado or not cambios_vehiculo:
+            continue
+        cambios = dict(cambios_vehiculo)
+        cambios_vehiculo.clear()
+        enviado = await emitir('estado_vehiculo', {
+            'cocheId': MI_COCHE_ID,
+            'senales': cambios,
+            'timestamp': time.time()
+        })
+        if not enviado:
+            # Se reenvían al reconectar, salvo las señales que ya tengan un valor más nuevo
+            for senal, valor in cambios.items():
+                cambios_vehiculo.setdefault(senal, valor)
+
+
+# Escalón de calidad de cada requester de frames (ver adaptacion.py); se mide con
+# el ack del backend a cada frame_camara, que recorre el enlace móvil del coche
+controles_frame: Dict[str, ControlAdaptativo] = {}
+frames_en_vuelo: Dict[str, tuple] = {}   # requester → (instante de envío, bytes) sin ack
+requesters_con_ack = set()               # Solo se usa el retraso de acks si el backend los manda
+ultima_peticion: Dict[str, float] = {}   # requester → monotonic() de su última petición
+
+
+def leer_requester(data) -> Optional[str]:
+    """requesterId de una petición; sin él no hay a quién asociar el estado del espectador"""
+    requester_id = data.get('requesterId') if isinstance(data, dict) else None
+    if requester_id is None:
+        logger.warning('⚠️ Petición sin requesterId: ignorada')
+    return requester_id
+
+
+def olvidar_requester(requester_id) -> None:
+    """Quitar todo el estado de adaptación de un requester"""
+    controles_frame.pop(requester_id, None)
+    frames_en_vuelo.pop(requester_id, None)
+    requesters_con_ack.discard(requester_id)
+    ultima_peticion.pop(requester_id, None)
+
+
+def purgar_requesters(ahora: float) -> None:
+    """Olvidar los requesters que dejaron de pedir frames sin avisar"""
+    for requester_id, instante in list(ultima_peticion.items()):
+        if ahora - instante > REQUESTER_INACTIVO and requester_id not in streams:
+            olvidar_requester(requester_id)
+
+
+# Escucha del bus: ventanas, puertas y cierre, agrupados en un emit por intervalo
+receptor_can = ReceptorCAN(callback=recibir_cambios_vehiculo)
+
+
+# ==================== EVENTOS DE DETECCIÓN ====================
+# Copia de los objetos presentes por cámara, para quien se une a mitad
+objetos_presentes: Dict[str, Dict] = {}
+cola_eventos: Optional[asyncio.Queue] = None  # Se crea en principal()
+cancelar_eventos_camara = None                # Suscripción a la cámara local
+
+
+def encolar_eventos(lote: Dict) -> None:
+    """Añadir un lote a la cola del bucle descartando el más viejo si está llena"""
+    if cola_eventos.full():
+        cola_eventos.get_nowait()
+    cola_eventos.put_nowait(lote)
+
+
+def aplicar_eventos(lote: Dict) -> None:
+    """Actualizar la copia local de objetos presentes con un lote"""
+    presentes = objetos_presentes.setdefault(lote['camara'], {})
+    for evento in lote['eventos']:
+        if evento['tipo'] == 'entrada':
+            presentes[evento['id']] = {'id': evento['id'], 'clase': evento['clase'],
+                                       'bbox': evento['bbox'], 'desde': evento['ts']}
+        else:
+            presentes.pop(evento['id'], None)
+    for track_id, caja in lote.get('cajas', {}).items():
+        # Tras pasar por JSON las claves llegan como texto
+        objeto = presentes.get(int(track_id))
+        if objeto is not None:
+            objeto['bbox'] = caja
+
+
+def cargar_objetos_presentes(estado) -> None:
+    """Reemplazar la copia local con la instantánea de objetos de cada cámara"""
+    for camara in estado:
+        objetos_presentes[camara['camara']] = {o['id']: o for o in camara['objetos']}
+
+
+async def reenviar_eventos_deteccion():
+    """Tarea que reenvía al backend los lotes de entradas/salidas (JSON de pocos cientos de bytes)"""
+    while True:
+        lote = await cola_eventos.get()
+        aplicar_eventos(lote)
+        # Sin conexión solo se mantiene la copia local: solicitar_objetos la da al volver
+        if conectado:
+            await emitir('eventos_deteccion', {'cocheId': MI_COCHE_ID, **lote})
+
+
+async def seguir_eventos_camara():
+    """Tarea que lee los eventos del servidor de cámara (SSE); reconecta si se corta"""
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=60)
+    while True:
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as sesion:
+                async with sesion.get(URL_EVENTOS_CAMARA) as respuesta:
+                    respuesta.raise_for_status()
+                    logger.info(f'📡 Siguiendo eventos de detección en {URL_EVENTOS_CAMARA}')
+                    tipo = None
+                    async for linea in respuesta.content:
+                        linea = linea.decode().rstrip('\r\n')
+                        if linea.startswith('event: '):
+                            tipo = linea[len('event: '):]
+                        elif linea.startswith('data: '):
+                            datos = json.loads(linea[len('data: '):])
+                            if tipo == 'estado':
+                                cargar_objetos_presentes(datos)
+                            else:
+                                encolar_eventos(datos)
+                            tipo = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f'⚠️ Sin eventos de detección ({e}), reintentando en 5 segundos')
+        await asyncio.sleep(5)
+
+
+def iniciar_eventos_deteccion():
+    """Suscribirse a la cámara local o seguir la del servidor MJPEG"""
+    global cancelar_eventos_camara
+    lanzar_tarea(reenviar_eventos_deteccion, 'eventos')
+    if CAMARA_EN_ESTE_SERVIDOR:
+        from camera import obtener_camera, obtener_objetos_activos, suscribir_eventos
+        if obtener_camera() is not None:
+            cargar_objetos_presentes(obtener_objetos_activos())
+            # Los lotes llegan desde los hilos de captura
+            cancelar_eventos_camara = suscribir_eventos(
+                lambda lote: pasar_al_bucle(encolar_eventos, lote))
+            return
+    lanzar_tarea(seguir_eventos_camara, 'eventos_sse')
 
 
 @sio.event
-def connect():
+@medido
+async def connect():
     """Evento cuando se conecta al backend"""
     global conectado
     conectado = True
     logger.info('✅ Conectado al backend')
-    logger.info('📤 Iniciando envío de frames automático...')
     
     # Registrar la Raspberry como el coche
-    sio.emit('registro', {
+    await sio.emit('registro', {
         'tipo': 'coche',
         'cocheId': MI_COCHE_ID
     })
+    # Lo que cambió durante la desconexión
+    if cambios_vehiculo:
+        aviso_vehiculo.set()
 
 
 @sio.event
-def disconnect():
+@medido
+async def disconnect():
     """Evento cuando se desconecta del backend"""
     global conectado
     conectado = False
+    # Nada por requester sobrevive a la desconexión: los espectadores vuelven a pedir
+    frames_en_vuelo.clear()
+    controles_frame.clear()
+    requesters_con_ack.clear()
+    ultima_peticion.clear()
+    streams.clear()
     logger.error('❌ Desconectado del backend')
 
 
 @sio.on('comando_ventana')
-def on_comando_ventana(data):
+@medido
+async def on_comando_ventana(data):
     """Recibe comandos de ventana desde el backend"""
     procesar_comando_ventana(data)
 
 
 @sio.on('ejecutar_ventana')
-def on_ejecutar_ventana(data):
+@medido
+async def on_ejecutar_ventana(data):
     """Recibe comandos del backend con datos CAN ya procesados"""
     procesar_comando_ventana(data)
 
 
 @sio.on('ejecutar_bajar')
-def on_ejecutar_bajar(data):
+@medido
+async def on_ejecutar_bajar(data):
     """Recibe comandos del evento ejecutar_bajar (compatibilidad)"""
     procesar_comando_ventana(data)
 
@@ -82,71 +449,185 @@ def on_ejecutar_bajar(data):
 def procesar_comando_ventana(data: Dict) -> None:
     """
     Procesa un comando de ventana recibido del backend
-    El backend ya envía los datos CAN procesados
+    El backend envía los datos CAN ya procesados (idCAN/datosCAN)
+    o señales con nombre del DBC, ej: {'senales': {'ventana_del_izq': 40}}
     
     Args:
         data: Diccionario con datos CAN del backend
     """
+    instante_recepcion = time.perf_counter()
+    descripcion = data.get('descripcion', 'Comando sin descripción')
+
+    if data.get('senales'):
+        procesar_comando_senales(data, instante_recepcion, descripcion)
+        return
+
     id_can = data.get('idCAN')
     datos_can = data.get('datosCAN')
-    descripcion = data.get('descripcion', 'Comando sin descripción')
 
     # Validar datos
     if not id_can or not datos_can:
         logger.error(f'❌ Datos incompletos')
         return
 
-    # Construir comando CAN
-    comando = f"cangen can0 -g 2 -I {id_can} -L 5 -D {datos_can} -n 25"
-
     # Loguear solo lo importante
     logger.info(f'🚗 {descripcion}')
-    logger.info(f'⚙️ {comando}\n')
+    logger.info(f'⚙️ CAN {id_can}#{datos_can} x{RAFAGA_NUM_TRAMAS} cada {RAFAGA_INTERVALO_MS} ms\n')
 
     # Ejecutar comando CAN
-    ejecutar_comando_can(comando)
+    ejecutar_comando_can(id_can, datos_can, instante_recepcion,
+                         prioridad=data.get('prioridad', 0), descripcion=descripcion)
 
 
-def ejecutar_comando_can(comando: str) -> bool:
+def procesar_comando_senales(data: Dict, instante_recepcion: float, descripcion: str) -> None:
+    """Codificar señales con nombre del DBC y encolar una ráfaga por mensaje"""
+    try:
+        tramas = obtener_codec().codificar_senales(data['senales'])
+    except ValueError as e:
+        logger.error(f'❌ Comando de señales inválido: {e}')
+        return
+
+    logger.info(f'🚗 {descripcion}')
+    for can_id, payload in tramas:
+        id_can = formatear_id(can_id)
+        datos_can = payload.hex().upper()
+        logger.info(f'⚙️ CAN {id_can}#{datos_can} x{RAFAGA_NUM_TRAMAS} cada {RAFAGA_INTERVALO_MS} ms')
+        ejecutar_comando_can(id_can, datos_can, instante_recepcion,
+                             prioridad=data.get('prioridad', 0), descripcion=descripcion)
+
+
+def ejecutar_comando_can(id_can: str, datos_can: str,
+                         instante_recepcion: Optional[float] = None,
+                         prioridad: int = 0, descripcion: str = '') -> bool:
     """
-    Ejecuta un comando CAN en la Raspberry Pi
+    Encola la ráfaga CAN para el hilo transmisor (no bloquea el handler)
+    (equivale a `cangen can0 -g 2 -I <id> -D <datos> -n 25`)
     
     Args:
-        comando: Comando CAN a ejecutar
+        id_can: Identificador CAN en hexadecimal
+        datos_can: Payload en hexadecimal
+        instante_recepcion: perf_counter() de llegada del comando
+        prioridad: Mayor número = se envía antes
+        descripcion: Texto para los logs
         
     Returns:
-        True si se ejecutó correctamente, False si falló
+        True si el comando se aceptó, False si es inválido o la cola está llena
     """
     try:
-        # Ejecutar el comando CAN en la Raspberry Pi real
-        subprocess.run(comando, shell=True, check=True)
-        logger.info(f'✅ Comando CAN ejecutado correctamente')
-        return True
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f'❌ Error ejecutando comando CAN: {e}')
+        trama = cache_tramas.obtener(id_can, datos_can)
+    except ValueError as e:
+        logger.error(f'❌ Comando CAN inválido: {e}')
         return False
-    except Exception as e:
-        logger.error(f'❌ Error inesperado: {e}')
+
+    try:
+        prioridad = int(prioridad)
+    except (TypeError, ValueError):
+        prioridad = 0
+
+    if not cola_can.encolar(trama, prioridad=prioridad, descripcion=descripcion,
+                            instante_recepcion=instante_recepcion):
         return False
+    # Base de los próximos comandos por señales de ese mensaje
+    obtener_codec().recordar_comando(*desempaquetar_trama(trama))
+    return True
+
+
+@sio.on('solicitar_estado_can')
+@medido
+async def on_solicitar_estado_can(data):
+    """Solicitud de métricas del transmisor y la cola CAN"""
+    await sio.emit('estado_can', {
+        'transmisor': transmisor_can.obtener_estadisticas(),
+        'cola': cola_can.obtener_estadisticas(),
+        'cache': cache_tramas.obtener_estadisticas(),
+        'receptor': receptor_can.obtener_estadisticas()
+    })
+
+
+@sio.on('solicitar_estado_vehiculo')
+@medido
+async def on_solicitar_estado_vehiculo(data):
+    """Solicitud del último valor conocido de todas las señales CAN"""
+    await sio.emit('estado_vehiculo', {
+        'cocheId': MI_COCHE_ID,
+        'senales': receptor_can.obtener_estado(),
+        'timestamp': time.time()
+    })
+
+
+@sio.on('solicitar_estado_servidor')
+@medido
+async def on_solicitar_estado_servidor(data):
+    """Latencia de los handlers, retraso del bucle y colas internas"""
+    await sio.emit('estado_servidor', {
+        'cocheId': MI_COCHE_ID,
+        'handlers': {nombre: {'llamadas': m['llamadas'], 'media_ms': round(m['media_ms'], 2),
+                              'maximo_ms': round(m['maximo_ms'], 2)}
+                     for nombre, m in latencias_handlers.items()},
+        'retraso_bucle_ms': round(retraso_bucle_ms, 2),
+        'retraso_bucle_maximo_ms': round(retraso_bucle_maximo_ms, 2),
+        'trabajos_bloqueantes': trabajos_bloqueantes,
+        'tareas': len(asyncio.all_tasks()),
+        'reconexiones': reconexiones,
+        'cola_eventos': cola_eventos.qsize(),
+        'streams': len(streams)
+    })
 
 
 # ==================== HANDLERS DE CÁMARA ====================
 @sio.on('solicitar_frame')
-def on_solicitar_frame(data):
+@medido
+async def on_solicitar_frame(data):
     """Solicitud de frame de la cámara desde el frontend"""
     logger.info('📩 HANDLER: solicitar_frame recibido')
     try:
-        requester_id = data.get('requesterId') if isinstance(data, dict) else None
+        requester_id = leer_requester(data)
+        if requester_id is None:
+            return
         logger.info(f'👤 Requester ID: {requester_id}')
         
-        frame_b64 = obtener_frame_base64()
+        camara_id = data.get('camara')
+        # 'overlay': False para recibir el frame sin las cajas de detección
+        con_detecciones = bool(data.get('overlay', True))
+        
+        ahora = time.monotonic()
+        purgar_requesters(ahora)
+        ultima_peticion[requester_id] = ahora
+        control = controles_frame.setdefault(requester_id, ControlAdaptativo())
+        en_vuelo = frames_en_vuelo.get(requester_id)
+        if (en_vuelo is not None and requester_id in requesters_con_ack
+                and ahora - en_vuelo[0] > TIMEOUT_ACK_FRAME):
+            # El ack del frame anterior no llegó: cuenta como perdido
+            control.registrar_ack(ahora - en_vuelo[0])
+            frames_en_vuelo.pop(requester_id, None)
+        perfil = control.perfil
+        
+        # JPEG de la caché compartida en el escalón del requester; el Base64 solo
+        # se genera aquí, en el borde Socket.IO
+        frame_b64, _ = await en_executor(obtener_jpeg_local, camara_id, perfil['ancho'], perfil['alto'],
+                                         perfil['calidad'], base64_=True,
+                                         con_detecciones=con_detecciones)
         if frame_b64:
-            logger.info(f'📤 Enviando frame real: {len(frame_b64)} bytes')
-            sio.emit('frame_camara', {
+            logger.info(f'📤 Enviando frame real: {len(frame_b64)} bytes ({perfil["nombre"]})')
+            enviado = time.monotonic()
+            frames_en_vuelo[requester_id] = (enviado, len(frame_b64))
+            
+            def confirmado(*_):
+                if controles_frame.get(requester_id) is not control:
+                    return  # Requester olvidado mientras el frame viajaba
+                requesters_con_ack.add(requester_id)
+                if frames_en_vuelo.get(requester_id, (None,))[0] == enviado:
+                    frames_en_vuelo.pop(requester_id, None)
+                # RTT del enlace móvil: se compara con su mínimo, no con un tiempo de escritura
+                control.registrar_ack(time.monotonic() - enviado, len(frame_b64))
+            
+            await sio.emit('frame_camara', {
                 'frame': frame_b64,
-                'estado': obtener_estado_camera()
-            })
+                'camara': camara_id,
+                'escalon': perfil['nombre'],
+                'fps_sugerido': perfil['fps'],  # Ritmo al que conviene pedir frames
+                'estado': await en_executor(obtener_estado_camara_local, camara_id)
+            }, callback=confirmado)
         else:
             logger.warning('⚠️ No hay frame disponible')
     except Exception as e:
@@ -155,18 +636,31 @@ def on_solicitar_frame(data):
         traceback.print_exc()
 
 
+def crear_frame_prueba():
+    """Frame naranja en JPEG Base64 para diagnosticar el camino hasta el frontend"""
+    frame = np.zeros((360, 480, 3), dtype=np.uint8)
+    frame[:] = (0, 165, 255)  # Naranja en BGR
+    cv2.putText(frame, 'FRAME DE PRUEBA', (90, 190), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                (255, 255, 255), 2)
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 60])
+    if not ret:
+        return None
+    return base64.b64encode(buffer).decode('utf-8')
+
+
 @sio.on('solicitar_frame_prueba')
-def on_solicitar_frame_prueba(data):
+@medido
+async def on_solicitar_frame_prueba(data):
     """Solicitud de frame de prueba (naranja) para diagnosticar"""
     logger.info('📩 HANDLER: solicitar_frame_prueba recibido')
     try:
         requester_id = data.get('requesterId') if isinstance(data, dict) else None
         logger.info(f'👤 Requester ID: {requester_id}')
         
-        frame_b64 = crear_frame_prueba()
+        frame_b64 = await en_executor(crear_frame_prueba)
         if frame_b64:
             logger.info(f'🧪 Enviando frame naranja: {len(frame_b64)} bytes')
-            sio.emit('frame_camara', {
+            await sio.emit('frame_camara', {
                 'frame': frame_b64,
                 'estado': {
                     'conectada': False,
@@ -184,41 +678,310 @@ def on_solicitar_frame_prueba(data):
         traceback.print_exc()
 
 
+# ==================== STREAM AUTOMÁTICO ====================
+class StreamFrames:
+    """Envío continuo de frames a un requester con tope de FPS, de kbit/s y de frames sin ack"""
+    
+    def __init__(self, requester_id, camara_id=None, fps=FPS_STREAM, con_detecciones=True):
+        self.requester_id = requester_id
+        self.configurar(camara_id, fps, con_detecciones)
+        self.control = controles_frame.setdefault(requester_id, ControlAdaptativo())
+        self.siguiente_envio = 0.0
+        self.ultima_secuencia = None
+        self.en_vuelo = None        # monotonic() del frame aún sin ack
+        self.con_ack = False        # El backend ya confirmó algún frame
+        self.sin_ack = False        # El backend no manda acks: solo topes de FPS y kbit/s
+        
+        # Estadísticas
+        self.inicio = time.monotonic()
+        self.enviados = 0
+        self.saltados = 0           # Frames no enviados porque el anterior seguía en vuelo
+        self.perdidos = 0           # Frames cuyo ack no llegó en TIMEOUT_ACK_STREAM
+        self.bytes = 0
+    
+    def configurar(self, camara_id, fps, con_detecciones):
+        self.camara_id = camara_id
+        self.fps = min(max(float(fps), 0.5), float(MAX_FPS_STREAM))
+        self.con_detecciones = con_detecciones
+    
+    def intervalo(self, tamano=0):
+        """Segundos hasta el siguiente envío: el más lento de FPS pedidos, escalón y kbit/s"""
+        fps = min(self.fps, self.control.perfil['fps'])
+        return max(1.0 / fps, tamano * 8 / (MAX_KBPS_STREAM * 1000))
+    
+    def confirmar(self, enviado, tamano):
+        """Ack del backend a un frame: libera el siguiente y mide el enlace"""
+        self.con_ack = True
+        if self.en_vuelo == enviado:
+            self.en_vuelo = None
+            # El siguiente sale en cuanto lo permitan los topes, sin esperar a otra vuelta
+            self.siguiente_envio = enviado + self.intervalo(tamano)
+            aviso_streams.set()
+        # RTT frente al mínimo del enlace (ver ControlAdaptativo.registrar_ack)
+        self.control.registrar_ack(time.monotonic() - enviado, tamano)
+    
+    def a_dict(self):
+        duracion = max(time.monotonic() - self.inicio, 1e-6)
+        return {
+            'camara': self.camara_id,
+            'fps_pedidos': self.fps,
+            'fps_reales': round(self.enviados / duracion, 1),
+            'kbps': round(self.bytes * 8 / duracion / 1000, 1),
+            'escalon': self.control.perfil['nombre'],
+            'rtt_ms': self.control.obtener_estadisticas()['rtt_ms'],
+            'rtt_base_ms': self.control.obtener_estadisticas()['rtt_base_ms'],
+            'enviados': self.enviados,
+            'saltados': self.saltados,
+            'perdidos': self.perdidos
+        }
+
+
+streams: Dict[str, StreamFrames] = {}
+aviso_streams: Optional[asyncio.Event] = None  # Se crea en principal()
+
+
+async def enviar_frame_stream(stream: StreamFrames, ahora: float) -> None:
+    """Enviar el frame actual a un espectador si le toca y no tiene otro en vuelo"""
+    if stream.en_vuelo is not None:
+        if ahora - stream.en_vuelo < TIMEOUT_ACK_STREAM:
+            # Se reintenta con el ack (confirmar despierta la tarea) o al vencer el timeout
+            stream.saltados += 1
+            stream.siguiente_envio = stream.en_vuelo + TIMEOUT_ACK_STREAM
+            return
+        if not stream.con_ack:
+            # Nunca llegó ninguno: el backend no confirma, no esperar más
+            logger.warning(f'⚠️ {stream.requester_id} no confirma frames, stream sin control por ack')
+            stream.sin_ack = True
+        else:
+            # El ack no llegó: cuenta como enlace saturado y se sigue
+            stream.perdidos += 1
+            stream.control.registrar_ack(ahora - stream.en_vuelo)
+        stream.en_vuelo = None
+    
+    perfil = stream.control.perfil
+    jpeg, secuencia = await en_executor(obtener_jpeg_local, stream.camara_id, perfil['ancho'],
+                                        perfil['alto'], perfil['calidad'],
+                                        con_detecciones=stream.con_detecciones)
+    if not jpeg or secuencia == stream.ultima_secuencia:
+        # Sin frame nuevo: volver a mirar pronto sin gastar el turno entero
+        stream.siguiente_envio = ahora + stream.intervalo() / 2
+        return
+    
+    stream.ultima_secuencia = secuencia
+    if not stream.sin_ack:
+        stream.en_vuelo = ahora
+    stream.siguiente_envio = ahora + stream.intervalo(len(jpeg))
+    stream.enviados += 1
+    stream.bytes += len(jpeg)
+    
+    # bytes → adjunto binario de Socket.IO, sin el 33% de Base64
+    await sio.emit('frame_camara', {
+        'frame': jpeg,
+        'formato': 'jpeg',
+        'camara': stream.camara_id,
+        'secuencia': secuencia,
+        'escalon': perfil['nombre'],
+        'requesterId': stream.requester_id
+    }, callback=lambda *_: stream.confirmar(ahora, len(jpeg)))
+
+
+async def enviar_streams():
+    """Tarea que reparte frames a todos los streams activos según su ritmo"""
+    while True:
+        activos = list(streams.values())
+        if not activos or not conectado:
+            aviso_streams.clear()
+            await aviso_streams.wait()
+            continue
+        
+        ahora = time.monotonic()
+        for stream in activos:
+            if ahora >= stream.siguiente_envio and streams.get(stream.requester_id) is stream:
+                try:
+                    await enviar_frame_stream(stream, ahora)
+                except Exception as e:
+                    logger.error(f'❌ Error en stream de {stream.requester_id}: {e}')
+                    stream.siguiente_envio = ahora + 1.0
+        
+        espera = min(s.siguiente_envio for s in activos) - time.monotonic()
+        if espera > 0:
+            aviso_streams.clear()
+            try:
+                await asyncio.wait_for(aviso_streams.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+
+
 @sio.on('solicitar_stream_automatico')
-def on_solicitar_stream_automatico(data):
-    """El frontend solicita que empiece el stream automático"""
-    logger.info('📩 HANDLER: solicitar_stream_automatico recibido')
-    logger.info('✅ Stream automático ya está activo')
+@medido
+async def on_solicitar_stream_automatico(data):
+    """Empezar (o reconfigurar) el envío continuo de frames a un requester
+    
+    data: {'requesterId', 'camara', 'fps', 'overlay'}; los frames llegan como
+    `frame_camara` con el JPEG en binario y conviene confirmarlos con ack
+    """
+    requester_id = leer_requester(data)
+    if requester_id is None:
+        return
+    try:
+        fps = float(data.get('fps', FPS_STREAM))
+    except (TypeError, ValueError):
+        fps = FPS_STREAM
+    con_detecciones = bool(data.get('overlay', True))
+    
+    stream = streams.get(requester_id)
+    if stream is not None:
+        stream.configurar(data.get('camara'), fps, con_detecciones)
+    elif len(streams) >= MAX_STREAMS:
+        logger.warning(f'⚠️ Stream rechazado para {requester_id}: {MAX_STREAMS} activos')
+        await sio.emit('stream_rechazado', {'requesterId': requester_id, 'motivo': 'max_streams'})
+        return
+    else:
+        stream = streams[requester_id] = StreamFrames(requester_id, data.get('camara'),
+                                                      fps, con_detecciones)
+    aviso_streams.set()
+    logger.info(f'▶️ Stream automático para {requester_id}: {stream.fps} FPS '
+                f'({len(streams)} activo(s))')
+
+
+@sio.on('detener_stream_automatico')
+@medido
+async def on_detener_stream_automatico(data):
+    """Dejar de enviar frames a un requester"""
+    requester_id = leer_requester(data)
+    stream = streams.pop(requester_id, None)
+    if stream is not None:
+        olvidar_requester(requester_id)
+        logger.info(f'⏹️ Stream automático detenido para {requester_id}: {stream.a_dict()}')
+
+
+@sio.on('solicitar_estado_streams')
+@medido
+async def on_solicitar_estado_streams(data):
+    """FPS, kbit/s y frames saltados de cada stream automático"""
+    await sio.emit('estado_streams', {
+        'cocheId': MI_COCHE_ID,
+        'streams': {requester_id: stream.a_dict() for requester_id, stream in streams.items()}
+    })
+
+
+@sio.on('solicitar_objetos')
+@medido
+async def on_solicitar_objetos(data):
+    """Objetos presentes ahora mismo; después basta con seguir eventos_deteccion"""
+    camara_id = data.get('camara') if isinstance(data, dict) else None
+    objetos = {camara: list(presentes.values()) for camara, presentes in objetos_presentes.items()
+               if camara_id is None or camara == camara_id}
+    await sio.emit('objetos_deteccion', {'cocheId': MI_COCHE_ID, 'objetos': objetos})
 
 
 @sio.on('solicitar_estado_camera')
-def on_solicitar_estado_camera(data):
-    """Solicitud del estado de la cámara - no se usa en este servidor"""
-    logger.info('📩 HANDLER: solicitar_estado_camera recibido (ignorado)')
+@medido
+async def on_solicitar_estado_camera(data):
+    """Solicitud del estado de la cámara"""
+    logger.info('📩 HANDLER: solicitar_estado_camera recibido')
+    camara_id = data.get('camara') if isinstance(data, dict) else None
+    await sio.emit('estado_camera', {
+        'camara': camara_id,
+        'estado': await en_executor(obtener_estado_camara_local, camara_id)
+    })
 
 
-def main():
-    """Función principal - Solo controla ventanas CAN, no cámara"""
+# ==================== CONEXIÓN ====================
+async def mantener_conexion():
+    """Conectar al backend y reconectar tras cada caída, sin recursión
+    
+    La espera crece al doble en cada fallo hasta RECONEXION_MAXIMA, con jitter
+    para que varios coches no reconecten a la vez cuando el backend vuelve
+    """
+    global reconexiones
+    espera = RECONEXION_INICIAL
+    while True:
+        try:
+            logger.info('🔌 Conectando al backend para recibir comandos CAN...')
+            await sio.connect(BACKEND_URL, wait_timeout=TIMEOUT_CONEXION)
+            inicio = time.monotonic()
+            logger.info('✅ Sistema listo, esperando comandos...')
+            await sio.wait()  # Vuelve cuando se pierde la conexión
+            if time.monotonic() - inicio >= RECONEXION_ESTABLE:
+                espera = RECONEXION_INICIAL
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'❌ Error: {e}')
+        
+        reconexiones += 1
+        retraso = espera * random.uniform(0.5, 1.0)
+        logger.info(f'⏳ Reintentando en {retraso:.1f} segundos...')
+        await asyncio.sleep(retraso)
+        espera = min(espera * 2, RECONEXION_MAXIMA)
+
+
+async def principal():
+    """Función principal - Controla ventanas CAN (y la cámara si CAMARA_EN_ESTE_SERVIDOR)"""
+    global bucle, traza_can, cerrando
+    global limite_bloqueantes, aviso_vehiculo, cola_eventos, aviso_streams
+    bucle = asyncio.get_running_loop()
+    # Primitivas de asyncio dentro del bucle que las usa, no al importar el módulo
+    limite_bloqueantes = asyncio.Semaphore(MAX_TRABAJOS_BLOQUEANTES)
+    aviso_vehiculo = asyncio.Event()
+    cola_eventos = asyncio.Queue(maxsize=MAX_LOTES_EVENTOS)
+    aviso_streams = asyncio.Event()
     
     logger.info('🚀 Servidor Raspberry Pi iniciado')
     logger.info(f'🔗 Backend: {BACKEND_URL}')
     logger.info(f'🚗 Coche: {MI_COCHE_ID}\n')
     
+    # Abrir el socket CAN una sola vez y arrancar el hilo transmisor
+    if GRABAR_TRAZA_CAN and traza_can is None:
+        traza_can = GrabadorTraza()
+        transmisor_can.traza = traza_can
+        receptor_can.traza = traza_can
+    transmisor_can.abrir()
+    cache_tramas.precalentar(VENTANAS_CAN.values())
+    cola_can.iniciar()
+    receptor_can.iniciar()
+    
+    if CAMARA_EN_ESTE_SERVIDOR:
+        from camera import inicializar_camera, obtener_camera
+        if obtener_camera() is None:
+            # Cargar el modelo tarda segundos: fuera del bucle
+            await en_executor(inicializar_camera, cargar_yolo=True)
+    
+    lanzar_tarea(vigilar_bucle, 'vigilar_bucle')
+    lanzar_tarea(reportar_estado_vehiculo, 'estado_vehiculo')
+    lanzar_tarea(enviar_streams, 'streams')
+    iniciar_eventos_deteccion()
     try:
-        # Conectar al backend PRIMERO
-        logger.info('🔌 Conectando al backend para recibir comandos CAN...')
-        sio.connect(BACKEND_URL)
-        time.sleep(1)  # Esperar confirmación de conexión
-        
-        # Mantener la conexión abierta
-        logger.info('✅ Sistema listo, esperando comandos...')
-        sio.wait()
-        
-    except Exception as e:
-        logger.error(f'❌ Error: {e}')
-        logger.info('⏳ Reintentando en 5 segundos...')
-        time.sleep(5)
-        main()
+        await mantener_conexion()
+    finally:
+        cerrando = True
+        # Los hilos de recepción dejan de pasar trabajo antes de que el bucle se cierre
+        receptor_can.detener()
+        if cancelar_eventos_camara is not None:
+            cancelar_eventos_camara()
+        tareas = list(tareas_servicio.values())
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        if sio.connected:
+            await sio.disconnect()
+
+
+def main():
+    try:
+        asyncio.run(principal())
+    except KeyboardInterrupt:
+        logger.info('⏹️ Servidor detenido')
+    finally:
+        cola_can.detener()
+        if traza_can is not None:
+            # Sin esto se pierde el último bloque aún en memoria
+            traza_can.cerrar()
+        if CAMARA_EN_ESTE_SERVIDOR:
+            from camera import cerrar_camera
+            cerrar_camera()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 if __name__ == '__main__':
@@ -39,12 +39,12 @@ try:
     # Esperar primer frame
     print("5️⃣  Esperando primer frame...")
     for i in range(50):
-        if camera.frame_actual is not None:
+        if camera.secuencia > 0:
             print(f"   ✅ Recibido en {i*0.1:.1f}s\n")
             break
         time.sleep(0.1)
     
-    if camera.frame_actual is None:
+    if camera.secuencia == 0:
         print("   ❌ ERROR: No se recibió frame de la cámara\n")
         sys.exit(1)
     
@@ -57,7 +57,7 @@ try:
     frame_count = 0
     while True:
         # Obtener frame
-        frame = camera.frame_actual
+        frame, _ = camera.obtener_frame()  # Con las detecciones dibujadas
         detecciones = camera.detecciones
         estado = camera.obtener_estado()
         
@@ -41,12 +41,12 @@ try:
     
     print("5️⃣  Esperando primer frame (5 segundos max)...")
     for i in range(50):
-        if manager.frame_actual is not None:
+        if manager.secuencia > 0:
             print(f"   ✅ ¡Frame recibido en {i*0.1:.1f} segundos!\n")
             break
         time.sleep(0.1)
     
-    if manager.frame_actual is None:
+    if manager.secuencia == 0:
         print("   ❌ Timeout - no hay frames\n")
         sys.exit(1)
     
@@ -57,7 +57,7 @@ try:
     import cv2
     frame_count = 0
     while True:
-        frame = manager.frame_actual
+        frame, _ = manager.obtener_frame()  # Con las detecciones dibujadas
         if frame is not None:
             cv2.imshow('Test Directo - YOLOv8', frame)
             frame_count += 1
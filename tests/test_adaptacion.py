@@ -0,0 +1,101 @@
+"""Escalera de calidad: histéresis al bajar/subir y retraso de cola sobre el RTT mínimo"""
+
+import pytest
+
+import adaptacion
+from adaptacion import ESCALONES, ESPERA_BAJAR, ESPERA_SUBIR, ControlAdaptativo
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(adaptacion.time, 'time', reloj)
+    return reloj
+
+
+def nombre(control):
+    return control.perfil['nombre']
+
+
+def test_baja_un_escalon_por_espera(reloj):
+    control = ControlAdaptativo()
+    # Recién creado no baja hasta pasada la espera
+    assert not control.registrar_envio(1.0)
+    reloj.ahora += ESPERA_BAJAR
+    assert control.registrar_envio(1.0) and nombre(control) == 'baja'
+    assert not control.registrar_envio(1.0)
+    reloj.ahora += ESPERA_BAJAR
+    assert control.registrar_envio(1.0) and nombre(control) == 'minima'
+    reloj.ahora += ESPERA_BAJAR
+    # Ya en el último escalón no hay a dónde bajar
+    assert not control.registrar_envio(1.0)
+    assert control.escalon == len(ESCALONES) - 1 and control.bajadas == 2
+
+
+def test_sube_tras_un_rato_holgado(reloj):
+    control = ControlAdaptativo()
+    reloj.ahora += ESPERA_SUBIR - 1
+    assert not control.registrar_envio(0.0)
+    reloj.ahora += 1
+    assert control.registrar_envio(0.0) and nombre(control) == 'alta'
+    reloj.ahora += ESPERA_SUBIR
+    # Ya en el primer escalón
+    assert not control.registrar_envio(0.0) and control.subidas == 1
+
+
+def test_congestion_reinicia_la_espera_para_subir(reloj):
+    control = ControlAdaptativo(escalon=2)
+    reloj.ahora += ESPERA_SUBIR
+    control.registrar_envio(0.0, bytes_pendientes=10_000, tamano_frame=5_000)
+    assert nombre(control) == 'minima'
+    reloj.ahora += ESPERA_SUBIR / 2
+    assert not control.registrar_envio(0.0)
+    reloj.ahora += ESPERA_SUBIR / 2
+    assert control.registrar_envio(0.0) and nombre(control) == 'baja'
+
+
+def test_ack_lento_pero_estable_no_es_congestion(reloj):
+    control = ControlAdaptativo()
+    for _ in range(20):
+        reloj.ahora += 1
+        control.registrar_ack(0.4, tamano_frame=1000)
+    assert control.rtt_base == 0.4 and control.latencia == 0.0
+    assert nombre(control) == 'alta'
+
+    # La cola crece sobre el mínimo: baja
+    for _ in range(5):
+        reloj.ahora += ESPERA_BAJAR
+        control.registrar_ack(1.0, tamano_frame=1000)
+    assert control.escalon > 0 and control.bajadas
+
+
+def test_ack_perdido_baja(reloj):
+    control = ControlAdaptativo()
+    reloj.ahora += ESPERA_BAJAR
+    assert control.registrar_ack(5.0, tamano_frame=0) and nombre(control) == 'baja'
+    # Un frame perdido no rebaja el mínimo de la ventana
+    assert control.rtt_base_ventana == float('inf')
+
+
+def test_rtcp_con_rtt_alto_y_estable_sube(reloj):
+    control = ControlAdaptativo(escalon=len(ESCALONES) - 1)
+    for _ in range(20):
+        reloj.ahora += 1
+        control.registrar_rtcp(0.0, 0.3)
+    assert nombre(control) != 'minima' and not control.bajadas
+
+
+def test_rtcp_con_perdidas_baja(reloj):
+    control = ControlAdaptativo()
+    reloj.ahora += ESPERA_BAJAR
+    assert control.registrar_rtcp(0.2, None) and nombre(control) == 'baja'
+    # Sin RTT en el informe el retraso de cola no cambia
+    assert control.rtt == 0.0
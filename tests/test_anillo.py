@@ -0,0 +1,80 @@
+"""Anillo de frames de la captura: préstamos, reutilización de ranuras y ampliación"""
+
+import numpy as np
+import pytest
+
+from camera import AnilloFrames
+
+
+FORMA = (4, 6, 3)
+
+
+@pytest.fixture
+def anillo():
+    return AnilloFrames(num_ranuras=3, forma=FORMA)
+
+
+def capturar(anillo, valor):
+    """Lo que hace la captura: rellenar una ranura libre y publicarla"""
+    ranura = anillo.libre()
+    ranura.buffer[:] = valor
+    anillo.publicar(ranura)
+    return ranura
+
+
+def test_publicar_suelta_la_anterior(anillo):
+    primera = capturar(anillo, 1)
+    assert primera.refs == 1
+    segunda = capturar(anillo, 2)
+    assert (primera.refs, segunda.refs) == (0, 1)
+    assert anillo.obtener_estadisticas()['prestadas'] == 1
+
+
+def test_ranura_prestada_no_se_sobrescribe(anillo):
+    prestada = capturar(anillo, 1)
+    assert anillo.prestar() is prestada and prestada.refs == 2
+
+    # La captura sigue: nunca vuelve a la ranura prestada aunque ya no sea la actual
+    for valor in range(2, 10):
+        assert capturar(anillo, valor) is not prestada
+    assert np.all(prestada.buffer == 1)
+
+    anillo.soltar(prestada)
+    assert prestada.refs == 0
+    assert prestada in {capturar(anillo, v) for v in range(10, 13)}
+
+
+def test_retener_para_el_grabador(anillo):
+    ranura = capturar(anillo, 1)
+    anillo.retener(ranura)
+    capturar(anillo, 2)
+    # Ya no es la actual, pero el grabador la mantiene hasta soltarla
+    assert ranura.refs == 1
+    anillo.soltar(ranura)
+    assert ranura.refs == 0
+
+
+def test_sin_ranuras_libres_el_anillo_crece(anillo):
+    prestadas = []
+    for valor in range(3):
+        capturar(anillo, valor)
+        prestadas.append(anillo.prestar())
+    nueva = anillo.libre()
+    assert nueva not in prestadas
+    estadisticas = anillo.obtener_estadisticas()
+    assert estadisticas['ranuras'] == 4 and estadisticas['ampliaciones'] == 1
+
+    for ranura in prestadas:
+        anillo.soltar(ranura)
+    assert anillo.obtener_estadisticas()['prestadas'] == 1  # Solo la publicada
+
+
+def test_vista_de_solo_lectura_con_overlay_compartido(anillo):
+    ranura = capturar(anillo, 0)
+    ranura.reiniciar([{'clase': 'person', 'confianza': 0.9, 'bbox': (0, 0, 3, 3)}])
+    limpia = ranura.vista(con_detecciones=False)
+    dibujada = ranura.vista()
+    assert not limpia.flags.writeable and not dibujada.flags.writeable
+    # El overlay se pinta en una copia: el frame de la captura queda limpio
+    assert np.all(ranura.buffer == 0) and dibujada.any()
+    assert ranura.vista().base is dibujada.base
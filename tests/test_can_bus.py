@@ -0,0 +1,112 @@
+"""Empaquetado de tramas, caché LRU y cola de comandos CAN"""
+
+import pytest
+
+from can_bus import (CAN_EFF_FLAG, TAMANO_TRAMA, CacheTramasCAN, ColaComandosCAN,
+                     construir_trama, desempaquetar_trama, empaquetar_trama,
+                     es_eco_propio, formatear_id, marcar_eco, parsear_datos_can,
+                     parsear_id_can)
+
+
+# ==================== EMPAQUETADO ====================
+def test_parsear_id_estandar_y_extendido():
+    assert parsear_id_can('14C') == 0x14C
+    assert parsear_id_can('0x14C') == 0x14C
+    # Más de 3 dígitos o mayor de 0x7FF: extendido, como cangen
+    assert parsear_id_can('014C') == 0x14C | CAN_EFF_FLAG
+    assert parsear_id_can('800') == 0x800 | CAN_EFF_FLAG
+
+
+@pytest.mark.parametrize('id_can', ['XYZ', '20000000', '-1'])
+def test_parsear_id_invalido(id_can):
+    with pytest.raises(ValueError):
+        parsear_id_can(id_can)
+
+
+def test_parsear_datos():
+    assert parsear_datos_can('80.80 00') == b'\x80\x80\x00'
+    assert parsear_datos_can('') == b''
+    for invalido in ('808', 'ZZ', '00' * 9):
+        with pytest.raises(ValueError):
+            parsear_datos_can(invalido)
+
+
+def test_empaquetar_y_desempaquetar():
+    trama = empaquetar_trama(0x14C, b'\x01\x02\x03')
+    assert len(trama) == TAMANO_TRAMA
+    assert trama[4] == 3  # can_dlc
+    assert desempaquetar_trama(trama) == (0x14C, b'\x01\x02\x03')
+    # Los comandos del backend salen con DLC 5 como con `cangen -L 5`
+    assert desempaquetar_trama(construir_trama('18DAF110', '0102')) == (
+        0x18DAF110 | CAN_EFF_FLAG, b'\x01\x02\x00\x00\x00')
+    assert desempaquetar_trama(construir_trama('14C', '0102030405060708'))[1] == bytes(range(1, 9))
+
+
+def test_formatear_id():
+    assert formatear_id(0x14C) == '14C'
+    assert formatear_id(0x14C | CAN_EFF_FLAG) == '0000014C'
+
+
+def test_marca_eco_no_toca_id_ni_payload():
+    trama = empaquetar_trama(0x14C, b'\xAA' * 8)
+    marcada = marcar_eco(trama)
+    assert es_eco_propio(marcada) and not es_eco_propio(trama)
+    assert desempaquetar_trama(marcada) == desempaquetar_trama(trama)
+
+
+# ==================== CACHÉ ====================
+def test_cache_aciertos_y_expulsion_lru():
+    cache = CacheTramasCAN(capacidad=2)
+    trama = cache.obtener('14C', '01')
+    assert cache.obtener('14C', '01') is trama
+    cache.obtener('14D', '02')
+    cache.obtener('14C', '01')       # 14C pasa a ser el más reciente
+    cache.obtener('14E', '03')       # Expulsa 14D
+    assert set(cache.tramas) == {('14C', '01'), ('14E', '03')}
+
+    estadisticas = cache.obtener_estadisticas()
+    assert estadisticas['aciertos'] == 2
+    assert estadisticas['fallos'] == 3
+    assert estadisticas['expulsiones'] == 1
+
+
+def test_cache_no_guarda_invalidos():
+    cache = CacheTramasCAN()
+    with pytest.raises(ValueError):
+        cache.obtener('14C', 'ZZ')
+    assert not cache.tramas
+    assert cache.precalentar([{'idCAN': '14C', 'datosCAN': '01'},
+                              {'idCAN': 'XYZ', 'datosCAN': '01'}]) == 1
+
+
+# ==================== COLA ====================
+def test_cola_fusiona_mismo_can_id():
+    cola = ColaComandosCAN(transmisor=None)
+    assert cola.encolar(empaquetar_trama(0x14C, b'\x01'))
+    assert cola.encolar(empaquetar_trama(0x14C, b'\x02'), prioridad=5)
+    assert cola.coalescidos == 1
+    assert len(cola.pendientes) == 1
+
+    can_id, comando = cola._siguiente()
+    assert can_id == 0x14C
+    assert comando['trama'] == empaquetar_trama(0x14C, b'\x02')
+    assert comando['prioridad'] == 5
+    # La entrada obsoleta del heap se descarta
+    assert cola._siguiente() == (None, None)
+
+
+def test_cola_orden_por_prioridad_y_llegada():
+    cola = ColaComandosCAN(transmisor=None)
+    cola.encolar(empaquetar_trama(0x100, b''), prioridad=0)
+    cola.encolar(empaquetar_trama(0x200, b''), prioridad=1)
+    cola.encolar(empaquetar_trama(0x300, b''), prioridad=0)
+    assert [cola._siguiente()[0] for _ in range(3)] == [0x200, 0x100, 0x300]
+
+
+def test_cola_llena_expulsa_solo_menos_prioritarios():
+    cola = ColaComandosCAN(transmisor=None, capacidad=1)
+    cola.encolar(empaquetar_trama(0x100, b''), prioridad=1)
+    assert not cola.encolar(empaquetar_trama(0x200, b''), prioridad=1)
+    assert cola.encolar(empaquetar_trama(0x300, b''), prioridad=2)
+    assert list(cola.pendientes) == [0x300]
+    assert cola.descartados == 2
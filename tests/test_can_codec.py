@@ -0,0 +1,115 @@
+"""Extracción de bits del DBC: Intel, Motorola, signo y escala"""
+
+import numpy as np
+import pytest
+
+from can_bus import CAN_EFF_FLAG
+from can_codec import CodecCAN
+
+DBC = '''
+BO_ 256 PRUEBA: 8 RPI
+ SG_ intel_16 : 8|16@1+ (0.5,-10) [-10|32757.5] "" BCM
+ SG_ intel_signo : 24|8@1- (1,0) [-128|127] "" BCM
+ SG_ moto_16 : 39|16@0+ (1,0) [0|65535] "" BCM
+ SG_ moto_signo : 51|4@0- (1,0) [-8|7] "" BCM
+ SG_ moto_bit : 63|1@0+ (1,0) [0|1] "" BCM
+
+BO_ 2565865488 EXTENDIDO: 1 BCM
+ SG_ bit : 0|1@1+ (1,0) [0|1] "" RPI
+'''
+
+#                byte:  0     1     2     3     4     5     6     7
+PAYLOAD = bytes([0x00, 0x34, 0x12, 0xFE, 0xAB, 0xCD, 0x0B, 0x80])
+
+
+@pytest.fixture(scope='module')
+def codec(tmp_path_factory):
+    ruta = tmp_path_factory.mktemp('dbc') / 'prueba.dbc'
+    ruta.write_text(DBC)
+    return CodecCAN(ruta)
+
+
+def test_decodificar_intel(codec):
+    valores = codec.decodificar(256, PAYLOAD)
+    # Bytes 1-2 en little-endian, con factor y offset
+    assert valores['intel_16'] == 0x1234 * 0.5 - 10
+    assert valores['intel_signo'] == -2
+
+
+def test_decodificar_motorola(codec):
+    valores = codec.decodificar(256, PAYLOAD)
+    # MSB en el bit 7 del byte 4: bytes 4-5 en big-endian
+    assert valores['moto_16'] == 0xABCD
+    # Nibble bajo del byte 6 (0xB) con signo
+    assert valores['moto_signo'] == -5
+    assert valores['moto_bit'] == 1
+
+
+def test_motorola_cruzando_bytes(tmp_path):
+    ruta = tmp_path / 'cruzada.dbc'
+    ruta.write_text('BO_ 1 M: 2 RPI\n SG_ s : 3|12@0+ (1,0) [0|4095] "" BCM\n')
+    # MSB en el bit 3 del byte 0: nibble bajo del byte 0 seguido del byte 1
+    assert CodecCAN(ruta).decodificar(1, bytes([0xF5, 0xA7]))['s'] == 0x5A7
+
+
+def test_senal_fuera_del_payload(tmp_path):
+    ruta = tmp_path / 'mal.dbc'
+    ruta.write_text('BO_ 1 M: 8 RPI\n SG_ s : 59|12@0+ (1,0) [0|4095] "" BCM\n')
+    with pytest.raises(ValueError):
+        CodecCAN(ruta)
+
+
+def test_decodificar_lote_igual_que_tramas_sueltas(codec):
+    otro = bytes([0xFF, 0x00, 0x00, 0x7F, 0x00, 0x01, 0x07, 0x00])
+    ids = np.array([256, 999, 256], dtype=np.uint32)
+    datos = np.frombuffer(PAYLOAD + bytes(8) + otro, dtype=np.uint8).reshape(-1, 8)
+
+    lote = codec.decodificar_lote(ids, datos)
+    assert list(lote) == ['PRUEBA']
+    assert lote['PRUEBA']['indices'].tolist() == [0, 2]
+    for fila, payload in enumerate((PAYLOAD, otro)):
+        for nombre, valor in codec.decodificar(256, payload).items():
+            assert lote['PRUEBA'][nombre][fila] == valor
+
+
+def test_id_extendido(codec):
+    assert (0x18F00010 | CAN_EFF_FLAG) in codec.ids()
+    assert codec.decodificar(0x18F00010 | CAN_EFF_FLAG, b'\x01') == {'bit': 1}
+    assert codec.decodificar(0x7FF, PAYLOAD) == {}
+
+
+def test_codificar_ida_y_vuelta(codec):
+    valores = {'intel_16': 100.5, 'intel_signo': -7, 'moto_16': 0x1234, 'moto_signo': 3,
+               'moto_bit': 1}
+    can_id, payload = codec.codificar('PRUEBA', valores)
+    assert can_id == 256 and len(payload) == 8
+    assert codec.decodificar(can_id, payload) == valores
+    # Los valores fuera de [min|max] del DBC se recortan
+    _, payload = codec.codificar('PRUEBA', {'moto_signo': 20}, base=payload)
+    assert codec.decodificar(256, payload)['moto_signo'] == 7
+
+
+def test_comando_parcial_sin_base_se_rechaza(tmp_path):
+    ruta = tmp_path / 'prueba.dbc'
+    ruta.write_text(DBC)
+    codec = CodecCAN(ruta)
+    with pytest.raises(ValueError, match='intel_signo'):
+        codec.codificar_senales({'intel_16': 0})
+
+
+def test_comando_parcial_conserva_el_ultimo_mandado(tmp_path):
+    ruta = tmp_path / 'prueba.dbc'
+    ruta.write_text(DBC)
+    codec = CodecCAN(ruta)
+    codec.recordar_comando(256, PAYLOAD)
+
+    (can_id, payload), = codec.codificar_senales({'moto_16': 0x0102})
+    antes, despues = codec.decodificar(256, PAYLOAD), codec.decodificar(can_id, payload)
+    assert despues.pop('moto_16') == 0x0102
+    antes.pop('moto_16')
+    assert despues == antes
+
+
+def test_ids_sin_los_mensajes_propios(codec):
+    assert codec.ids(excluir_emisor='RPI') == [0x18F00010 | CAN_EFF_FLAG]
+    assert codec.ids(excluir_emisor='BCM') == [256]
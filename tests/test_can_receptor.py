@@ -0,0 +1,66 @@
+"""Receptor CAN sobre el bus loopback: solo mensajes ajenos y sin ecos propios"""
+
+import time
+
+import pytest
+
+from can_bus import TransmisorCAN, empaquetar_trama
+from can_codec import CodecCAN
+from can_receptor import ReceptorCAN
+
+DBC = '''
+BO_ 332 VENTANAS_CMD: 1 RPI
+ SG_ ventana : 0|8@1+ (1,0) [0|100] "%" BCM
+
+BO_ 333 VENTANAS_POS: 1 BCM
+ SG_ pos_ventana : 0|8@1+ (1,0) [0|100] "%" RPI
+'''
+
+
+class TrazaFalsa:
+    def __init__(self):
+        self.tramas = []
+
+    def registrar_trama(self, trama, tx=False, timestamp=None):
+        self.tramas.append((bytes(trama[:5]), tx))
+
+
+@pytest.fixture
+def bus(tmp_path):
+    ruta = tmp_path / 'coche.dbc'
+    ruta.write_text(DBC)
+    traza = TrazaFalsa()
+    cambios = []
+    receptor = ReceptorCAN(cambios.append, codec=CodecCAN(ruta), interfaz='no_existe',
+                           respaldo=[], intervalo_emision=0.02, traza=traza)
+    receptor.iniciar()
+    nosotros = TransmisorCAN('no_existe', respaldo=[], traza=traza)
+    coche = TransmisorCAN('no_existe', respaldo=[], marcar=False)
+    assert nosotros.abrir() and coche.abrir()
+    yield receptor, nosotros, coche, traza, cambios
+    receptor.detener()
+    time.sleep(0.6)  # Que el hilo lector suelte el socket compartido
+
+
+def esperar(condicion, timeout=2.0):
+    limite = time.time() + timeout
+    while not condicion() and time.time() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+def test_solo_escucha_mensajes_de_otros_nodos(bus):
+    receptor, *_ = bus
+    assert receptor.ids == {333}
+
+
+def test_ignora_el_eco_de_lo_que_enviamos(bus):
+    receptor, nosotros, coche, traza, cambios = bus
+    nosotros.enviar_trama(empaquetar_trama(333, b'\x28'))
+    coche.enviar_trama(empaquetar_trama(333, b'\x32'))
+
+    assert esperar(lambda: receptor.obtener_estado())
+    assert esperar(lambda: receptor.tramas_eco == 1)
+    assert receptor.obtener_estado() == {'pos_ventana': 50}
+    # Nuestra trama queda una vez como TX; la del coche como RX
+    assert [tx for _, tx in traza.tramas] == [True, False]
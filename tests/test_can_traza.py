@@ -0,0 +1,101 @@
+"""Trazas CAN: ida y vuelta por disco y búsqueda binaria por instante"""
+
+import os
+
+import pytest
+
+from can_bus import empaquetar_trama
+from can_traza import (TAMANO_CABECERA, TAMANO_REGISTRO, GrabadorTraza, LectorTraza,
+                       aplicar_retencion_trazas)
+
+
+def grabar(ruta, tramas, registros_por_bloque=4):
+    """Grabar (timestamp, can_id, datos, tx) y cerrar la traza"""
+    grabador = GrabadorTraza(ruta, registros_por_bloque=registros_por_bloque)
+    for timestamp, can_id, datos, tx in tramas:
+        grabador.registrar(can_id, datos, tx, timestamp)
+    grabador.cerrar()
+
+
+@pytest.fixture
+def traza(tmp_path):
+    """Traza de 25 tramas a 1 por segundo (t = 100..124), en bloques de 4"""
+    ruta = tmp_path / 'traza.bin'
+    tramas = [(100.0 + i, 0x100 + i % 3, bytes([i] * (i % 9)), i % 2 == 0) for i in range(25)]
+    grabar(ruta, tramas)
+    return ruta, tramas
+
+
+def test_ida_y_vuelta(traza):
+    ruta, tramas = traza
+    with LectorTraza(ruta) as lector:
+        assert len(lector) == len(tramas)
+        assert list(lector.leer()) == tramas
+
+        registros = lector.leer_array()
+        assert registros['can_id'].tolist() == [t[1] for t in tramas]
+        assert registros['timestamp'].tolist() == [t[0] for t in tramas]
+
+
+@pytest.mark.parametrize('instante', [50.0, 100.0, 103.0, 103.5, 104.0, 111.2, 124.0])
+def test_buscar_primer_hueco_no_anterior(traza, instante):
+    ruta, tramas = traza
+    with LectorTraza(ruta) as lector:
+        hueco = lector.buscar(instante)
+        primera = next(lector.leer(desde=instante))
+        assert primera == min((t for t in tramas if t[0] >= instante), key=lambda t: t[0])
+        # Todo lo anterior al hueco es más antiguo que el instante buscado
+        assert all(t < instante for t, *_ in lector.leer(hasta=instante))
+        assert lector._timestamp(hueco) >= instante
+
+
+def test_buscar_despues_del_final(traza):
+    ruta, _ = traza
+    with LectorTraza(ruta) as lector:
+        assert lector.buscar(1000.0) == lector.huecos
+        assert list(lector.leer(desde=1000.0)) == []
+
+
+def test_leer_rango(traza):
+    ruta, tramas = traza
+    with LectorTraza(ruta) as lector:
+        assert list(lector.leer(desde=105.0, hasta=110.0)) == tramas[5:10]
+        assert len(lector.leer_array(desde=105.0, hasta=110.0)) == 5
+
+
+def test_timestamps_nunca_retroceden(tmp_path):
+    ruta = tmp_path / 'reloj.bin'
+    grabar(ruta, [(10.0, 1, b'', False), (9.0, 2, b'', False), (11.0, 3, b'', False)])
+    with LectorTraza(ruta) as lector:
+        assert [t for t, *_ in lector.leer()] == [10.0, 10.0, 11.0]
+
+
+def test_continuar_traza_existente_con_registro_a_medias(tmp_path):
+    ruta = tmp_path / 'cortada.bin'
+    grabar(ruta, [(1.0 + i, 0x10, b'\x01', False) for i in range(6)])
+    with open(ruta, 'ab') as f:
+        f.write(b'\x00' * (TAMANO_REGISTRO // 2))  # Corte de luz a mitad de un registro
+
+    grabador = GrabadorTraza(ruta)
+    grabador.registrar_trama(empaquetar_trama(0x20, b'\x02'), tx=True, timestamp=0.5)
+    grabador.cerrar()
+
+    assert (ruta.stat().st_size - TAMANO_CABECERA) % TAMANO_REGISTRO == 0
+    with LectorTraza(ruta) as lector:
+        tramas = list(lector.leer())
+    assert len(tramas) == 7
+    # Sigue desde el último timestamp escrito aunque se pida uno anterior
+    assert tramas[-1] == (6.0, 0x20, b'\x02', True)
+
+
+def test_retencion_borra_las_trazas_mas_antiguas(tmp_path):
+    rutas = []
+    for i in range(4):
+        ruta = tmp_path / f'can_2025010{i + 1}_120000.bin'
+        ruta.write_bytes(b'\x00' * 1024 * 1024)
+        os.utime(ruta, (1000.0 + i, 1000.0 + i))
+        rutas.append(ruta)
+
+    assert aplicar_retencion_trazas(tmp_path, max_mb=2.5, max_dias=0, conservar=rutas[0]) == 2
+    # La traza en curso se conserva aunque sea la más antigua
+    assert [r.exists() for r in rutas] == [True, False, False, True]
@@ -0,0 +1,87 @@
+"""Eventos de detección: histéresis de entrada/salida y agrupación en lotes"""
+
+import pytest
+
+from eventos import EventosDeteccion
+
+
+def objeto(track_id, bbox=(0, 0, 100, 100), clase='person', confirmado=True):
+    return {'track_id': track_id, 'clase': clase, 'confianza': 0.8, 'bbox': bbox,
+            'confirmado': confirmado}
+
+
+@pytest.fixture
+def eventos():
+    """Lote en cada actualización para ver los eventos según se producen"""
+    eventos = EventosDeteccion('frontal', ventana_entrada=0.5, ventana_salida=1.0, intervalo=0.0)
+    eventos.lotes_recibidos = []
+    eventos.suscribir(eventos.lotes_recibidos.append)
+    return eventos
+
+
+def tipos(eventos):
+    return [(e['tipo'], e['id']) for lote in eventos.lotes_recibidos for e in lote['eventos']]
+
+
+def test_entrada_tras_la_ventana(eventos):
+    for instante in (0.0, 0.2, 0.4):
+        eventos.actualizar([objeto(1)], instante)
+    assert tipos(eventos) == []
+
+    eventos.actualizar([objeto(1)], 0.5)
+    assert tipos(eventos) == [('entrada', 1)]
+    entrada = eventos.lotes_recibidos[-1]['eventos'][0]
+    assert entrada['ts'] == 0.0  # Desde que se vio por primera vez
+
+
+def test_parpadeo_no_se_anuncia(eventos):
+    eventos.actualizar([objeto(1)], 0.0)
+    eventos.actualizar([], 0.1)
+    eventos.actualizar([objeto(1)], 0.2)
+    eventos.actualizar([objeto(1)], 0.6)
+    assert tipos(eventos) == []
+    assert eventos.descartados == 1
+
+
+def test_salida_tras_la_ventana(eventos):
+    eventos.actualizar([objeto(1)], 0.0)
+    eventos.actualizar([objeto(1)], 0.5)
+    # Una ausencia más corta que la ventana de salida no lo da por ido
+    eventos.actualizar([], 1.0)
+    eventos.actualizar([objeto(1)], 1.4)
+    eventos.actualizar([], 2.0)
+    assert tipos(eventos) == [('entrada', 1)]
+
+    eventos.actualizar([], 2.4)
+    assert tipos(eventos) == [('entrada', 1), ('salida', 1)]
+    salida = eventos.lotes_recibidos[-1]['eventos'][0]
+    assert salida['duracion'] == 1.4
+
+
+def test_no_confirmados_se_ignoran(eventos):
+    eventos.actualizar([objeto(1, confirmado=False)], 0.0)
+    eventos.actualizar([objeto(1, confirmado=False)], 1.0)
+    assert tipos(eventos) == [] and not eventos.pendientes
+
+
+def test_lote_con_cajas_movidas(eventos):
+    eventos.actualizar([objeto(1)], 0.0)
+    eventos.actualizar([objeto(1)], 0.5)
+    eventos.actualizar([objeto(1, bbox=(2, 0, 102, 100))], 0.6)
+    eventos.actualizar([objeto(1, bbox=(20, 0, 120, 100))], 0.7)
+    # Sin eventos ni movimiento suficiente no hay lote; con movimiento, solo la caja
+    assert len(eventos.lotes_recibidos) == 2
+    assert eventos.lotes_recibidos[-1]['eventos'] == []
+    assert eventos.lotes_recibidos[-1]['cajas'] == {1: [20, 0, 120, 100]}
+
+
+def test_agrupacion_por_intervalo():
+    eventos = EventosDeteccion('frontal', ventana_entrada=0.0, intervalo=1.0)
+    lotes = []
+    eventos.suscribir(lotes.append)
+    eventos.actualizar([objeto(1)], 1.0)
+    eventos.actualizar([objeto(2)], 1.5)
+    assert len(lotes) == 1
+    eventos.actualizar([objeto(3)], 2.0)
+    assert len(lotes) == 2
+    assert [e['id'] for e in lotes[-1]['eventos']] == [2, 3]
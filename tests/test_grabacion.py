@@ -0,0 +1,105 @@
+"""Grabador de clips: cola acotada, pre-grabación y partición en segmentos"""
+
+import numpy as np
+import pytest
+
+import grabacion
+from grabacion import BufferPregrabacion, GrabadorClips
+
+
+class EscritorFalso:
+    """Escritor sin códec: un byte por frame"""
+
+    def __init__(self, ruta, fps, tamano):
+        # Abierto como los de verdad: sigue escribiendo aunque se renombre
+        self.archivo = open(ruta, 'wb')
+
+    def escribir(self, frame, instante):
+        self.archivo.write(b'\x00')
+        self.archivo.flush()
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+class RetencionFalsa:
+    def __init__(self):
+        self.segmentos = []
+
+    def registrar(self, camara_id, ruta, inicio, fin, frames=0, **kwargs):
+        self.segmentos.append((ruta, inicio, fin, frames))
+
+
+def frame():
+    return np.zeros((8, 8, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def grabador(tmp_path, monkeypatch):
+    monkeypatch.setattr(grabacion, 'crear_escritor', EscritorFalso)
+    monkeypatch.setattr(grabacion, 'SEGUNDOS_SEGMENTO', 1.0)
+    soltadas = []
+    grabador = GrabadorClips('frontal', tmp_path, soltar=soltadas.append, max_cola=2,
+                             retencion=RetencionFalsa())
+    grabador.soltadas = soltadas
+    return grabador
+
+
+def test_cola_llena_descarta_y_suelta_la_ranura(grabador):
+    assert grabador.agregar_frame(frame(), 0.0, ranura=1)
+    assert grabador.agregar_frame(frame(), 0.1, ranura=2)
+    assert not grabador.agregar_frame(frame(), 0.2, ranura=3)
+    assert grabador.frames_descartados == 1
+    # Solo la ranura descartada vuelve al anillo; las encoladas son del worker
+    assert grabador.soltadas == [3]
+    assert grabador.cola.qsize() == 2
+
+
+def test_pregrabacion_y_segmentos(grabador, tmp_path):
+    # Antes de la detección los frames van al buffer (y su ranura se suelta)
+    for i, instante in enumerate((100.0, 100.5)):
+        grabador._procesar_frame(frame(), instante, i, None)
+    assert grabador.soltadas == [0, 1]
+    assert grabador.pregrabacion.obtener_estadisticas()['frames'] == 2
+
+    grabador._abrir_clip(100.6)
+    for instante in (101.0, 101.5, 102.0, 102.5, 103.0):
+        grabador._procesar_frame(frame(), instante, None, [{'clase': 'person', 'track_id': 7}])
+    grabador._cerrar_clip()
+    grabador._descartar_preparado()
+
+    segmentos = [s[1:] for s in grabador.retencion.segmentos]
+    assert segmentos == [(100.0, 100.5, 2), (101.0, 101.5, 2), (102.0, 102.5, 2),
+                         (103.0, 103.0, 1)]
+    assert grabador.frames_pregrabados == 2 and grabador.frames_escritos == 7
+    # Cada segmento en su archivo definitivo, con sus frames
+    assert [s[0].stat().st_size for s in grabador.retencion.segmentos] == [2, 2, 2, 1]
+    assert not list(tmp_path.glob('.preparado_*'))
+
+
+def test_buffer_pregrabacion_acotado_por_tiempo():
+    buffer = BufferPregrabacion(segundos=1.0)
+    for i in range(5):
+        buffer.agregar(frame(), i * 0.5)
+    assert [instante for instante, _ in buffer.frames] == [1.0, 1.5, 2.0]
+    assert buffer.descartados == 2
+
+
+def test_corte_de_luz_deja_preparado_y_grabando(grabador, tmp_path):
+    grabador._procesar_frame(frame(), 100.0, None, None)
+    grabador.pregrabacion.vaciar()
+    grabador._abrir_clip(100.0)
+    assert [r.name.split('_')[0] for r in tmp_path.glob('.*.mp4')] == ['.preparado']
+    grabador._procesar_frame(frame(), 100.5, None, None)
+    # El segmento en curso ya tiene frames; el siguiente writer espera sin ninguno
+    nombres = sorted(r.name.split('_')[0] for r in tmp_path.glob('.*.mp4'))
+    assert nombres == ['.grabando', '.preparado']
+
+
+def test_clip_sin_frames_no_se_guarda(grabador, tmp_path):
+    grabador._procesar_frame(frame(), 100.0, None, None)
+    grabador.pregrabacion.vaciar()
+    grabador._abrir_clip(100.0)
+    grabador._cerrar_clip()
+    grabador._descartar_preparado()
+    assert grabador.retencion.segmentos == [] and not list(tmp_path.iterdir())
@@ -0,0 +1,101 @@
+"""Backends de inferencia: interfaz, letterbox, decodificación YOLOv8, NMS y comparativa"""
+
+import numpy as np
+import pytest
+
+import inferencia
+from inferencia import (NOMBRES_COCO, BackendExportado, BackendInferencia, Letterbox,
+                        a_detecciones, comparar_backends, nms, postprocesar_yolov8)
+
+
+def salida_yolov8(predicciones, num_clases=len(NOMBRES_COCO)):
+    """Salida cruda (1, 4 + clases, N) a partir de [(cx, cy, w, h, clase, puntuación)]"""
+    salida = np.zeros((1, 4 + num_clases, len(predicciones)), dtype=np.float32)
+    for i, (cx, cy, w, h, clase, puntuacion) in enumerate(predicciones):
+        salida[0, :4, i] = (cx, cy, w, h)
+        salida[0, 4 + clase, i] = puntuacion
+    return salida
+
+
+def todas():
+    return np.ones(len(NOMBRES_COCO), dtype=bool)
+
+
+def test_nms_conserva_la_mejor_de_cada_grupo():
+    cajas = np.array([[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60], [0, 0, 10, 9]],
+                     dtype=np.float32)
+    puntuaciones = np.array([0.6, 0.9, 0.7, 0.5], dtype=np.float32)
+    assert nms(cajas, puntuaciones, umbral_iou=0.45).tolist() == [1, 2]
+    # Con un umbral alto no se suprime nada
+    assert sorted(nms(cajas, puntuaciones, umbral_iou=0.99).tolist()) == [0, 1, 2, 3]
+
+
+def test_postprocesar_filtra_por_confianza_y_clase():
+    salida = salida_yolov8([(50, 50, 20, 20, 0, 0.9),     # persona
+                            (150, 50, 20, 20, 0, 0.3),    # poca confianza
+                            (250, 50, 20, 20, 2, 0.8)])   # coche, fuera de la máscara
+    mascara = np.zeros(len(NOMBRES_COCO), dtype=bool)
+    mascara[0] = True
+
+    cajas, confianzas, clases = postprocesar_yolov8(salida, mascara, confianza=0.5)
+    assert cajas.tolist() == [[40, 40, 60, 60]]
+    assert confianzas.tolist() == [np.float32(0.9)] and clases.tolist() == [0]
+
+
+def test_postprocesar_nms_por_clase():
+    # Persona y perro solapados del todo: cada clase tiene su propio NMS
+    salida = salida_yolov8([(50, 50, 20, 20, 0, 0.9), (51, 50, 20, 20, 0, 0.8),
+                            (50, 50, 20, 20, 16, 0.7)])
+    cajas, confianzas, clases = postprocesar_yolov8(salida, todas())
+    assert clases.tolist() == [0, 16]
+    assert [d['clase'] for d in a_detecciones(cajas, confianzas, clases, NOMBRES_COCO)] == [
+        'person', 'dog']
+
+
+def test_postprocesar_sin_detecciones():
+    cajas, confianzas, clases = postprocesar_yolov8(salida_yolov8([(5, 5, 2, 2, 0, 0.1)]), todas())
+    assert cajas.shape == (0, 4) and len(confianzas) == 0 and len(clases) == 0
+
+
+def test_letterbox_ida_y_vuelta():
+    letterbox = Letterbox(tamano=100)
+    lienzo = letterbox.aplicar(np.zeros((100, 200, 3), dtype=np.uint8))
+    assert lienzo.shape == (100, 100, 3)
+    assert letterbox.escala == 0.5 and letterbox.relleno == (0, 25)
+    # Una caja del lienzo vuelve a coordenadas del frame original (recortada a sus bordes)
+    cajas = letterbox.deshacer(np.array([[10, 25, 60, 75], [-5, 0, 10, 30]], dtype=np.float32))
+    assert cajas.tolist() == [[20, 0, 120, 100], [0, 0, 20, 10]]
+
+
+def test_interfaz_abstracta():
+    with pytest.raises(TypeError):
+        BackendInferencia()
+    with pytest.raises(TypeError):
+        BackendExportado(ruta_modelo='modelo.onnx')
+
+
+class BackendFijo(BackendExportado):
+    """Runtime falso: siempre la misma persona en el centro del lienzo"""
+
+    nombre = 'fijo'
+    creados = []
+
+    def cargar(self):
+        BackendFijo.creados.append(self)
+
+    def ejecutar(self, entrada):
+        centro = self.tamano / 2
+        return salida_yolov8([(centro, centro, 40, 80, 0, 0.9)])
+
+
+def test_comparar_con_la_configuracion_de_la_camara(monkeypatch):
+    import camera
+    monkeypatch.setitem(inferencia.RUTAS_MODELO, 'fijo', 'fijo.onnx')
+    monkeypatch.setattr(inferencia, 'BACKENDS', {'fijo': BackendFijo})
+    BackendFijo.creados.clear()
+
+    resultados = comparar_backends(repeticiones=2, calentamiento=0)
+    backend, = BackendFijo.creados
+    assert backend.tamano == camera.TAMANO_INFERENCIA
+    assert backend.clases == camera.CLASES_DETECTAR
+    assert resultados['fijo']['detecciones'] == 1
@@ -0,0 +1,86 @@
+"""Índice de clips, recuperación al arrancar y cuotas de retención"""
+
+import os
+import time
+
+import pytest
+
+from retencion import GestorRetencion, ruta_segmento
+
+
+@pytest.fixture
+def gestor(tmp_path):
+    gestor = GestorRetencion(tmp_path, max_gb=1.0, max_dias=0, min_gb_libres=0)
+    yield gestor
+    gestor.conexion.close()
+
+
+def clip(gestor, camara_id, inicio, tamano=1000, **kwargs):
+    """Crear un segmento de `tamano` bytes e indexarlo"""
+    ruta = ruta_segmento(gestor.directorio, camara_id, inicio)
+    ruta.write_bytes(b'\x00' * tamano)
+    gestor.registrar(camara_id, ruta, inicio, inicio + 60, **kwargs)
+    return ruta
+
+
+def test_ruta_segmento_no_pisa(tmp_path):
+    primera = ruta_segmento(tmp_path, 'frontal', 1000.0)
+    primera.touch()
+    segunda = ruta_segmento(tmp_path, 'frontal', 1000.0)
+    assert segunda != primera and not segunda.exists()
+    assert ruta_segmento(tmp_path, 'frontal', 1000.0, 'recuperado').name.endswith('_recuperado.mp4')
+
+
+def test_listar_filtra_y_ordena(gestor):
+    clip(gestor, 'frontal', 1000.0, clases={'person', 'dog'}, objetos=2)
+    clip(gestor, 'trasera', 2000.0, clases={'car'})
+    clip(gestor, 'frontal', 3000.0)
+
+    assert [c['inicio'] for c in gestor.listar()] == [3000.0, 2000.0, 1000.0]
+    assert [c['inicio'] for c in gestor.listar(camara_id='frontal')] == [3000.0, 1000.0]
+    con_perro, = gestor.listar(clase='dog')
+    assert con_perro['clases'] == ['dog', 'person'] and con_perro['objetos'] == 2
+    assert gestor.listar(clase='do') == []
+    assert [c['inicio'] for c in gestor.listar(desde=1500.0, hasta=2500.0)] == [2000.0]
+
+
+def test_cuota_borra_los_mas_antiguos(gestor):
+    rutas = [clip(gestor, 'frontal', 1000.0 + i) for i in range(4)]
+    gestor.max_bytes = 2500
+
+    assert gestor.aplicar() == 2
+    assert [r.exists() for r in rutas] == [False, False, True, True]
+    assert [c['inicio'] for c in gestor.listar()] == [1003.0, 1002.0]
+    assert gestor.aplicar() == 0
+
+
+def test_antiguedad_maxima(gestor):
+    viejo = clip(gestor, 'frontal', time.time() - 3 * 86400)
+    nuevo = clip(gestor, 'frontal', time.time())
+    gestor.max_segundos = 86400
+
+    assert gestor.aplicar() == 1
+    assert not viejo.exists() and nuevo.exists()
+
+
+def test_sincronizar_recupera_y_limpia(gestor):
+    directorio = gestor.directorio
+    huerfano = clip(gestor, 'frontal', 1000.0)
+    huerfano.unlink()
+    sin_indexar = ruta_segmento(directorio, 'cam_trasera', 2000.0)
+    sin_indexar.write_bytes(b'\x00' * 10)
+    grabando = directorio / '.grabando_frontal_123.mp4'
+    grabando.write_bytes(b'\x00' * 10)
+    os.utime(grabando, (3000.0, 3000.0))
+    (directorio / '.grabando_frontal_456.mp4').touch()  # Vacío: se descarta
+    # Writer preparado que no llegó a recibir frames: solo cabecera, se descarta
+    (directorio / '.preparado_frontal_789.mp4').write_bytes(b'\x00' * 10)
+
+    gestor.sincronizar(camaras=['frontal'])
+
+    clips = {c['archivo']: c for c in gestor.listar()}
+    assert huerfano.name not in clips
+    assert clips[sin_indexar.name]['camara'] == 'cam_trasera'
+    recuperado, = [c for c in clips.values() if c['archivo'].endswith('_recuperado.mp4')]
+    assert recuperado['camara'] == 'frontal' and recuperado['inicio'] == 3000.0
+    assert not list(directorio.glob('.*.mp4'))
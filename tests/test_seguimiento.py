@@ -0,0 +1,58 @@
+"""Seguimiento de objetos: IDs estables, confirmación, predicción y olvido"""
+
+import numpy as np
+
+from seguimiento import MAX_TIEMPO_PERDIDO, SeguidorObjetos, calcular_iou
+
+
+def deteccion(bbox, clase='person', confianza=0.9):
+    return {'clase': clase, 'confianza': confianza, 'bbox': bbox}
+
+
+def test_calcular_iou():
+    a = np.array([[0, 0, 10, 10]], dtype=np.float64)
+    b = np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]], dtype=np.float64)
+    assert np.allclose(calcular_iou(a, b), [[1.0, 50 / 150, 0.0]])
+
+
+def test_id_estable_y_confirmacion():
+    seguidor = SeguidorObjetos()
+    primero = seguidor.actualizar([deteccion((100, 100, 200, 200))], instante=0.0)
+    assert len(primero) == 1 and not primero[0]['confirmado']
+
+    segundo = seguidor.actualizar([deteccion((105, 100, 205, 200))], instante=0.1)
+    assert segundo[0]['track_id'] == primero[0]['track_id']
+    assert segundo[0]['confirmado']
+
+
+def test_clases_distintas_no_se_asocian():
+    seguidor = SeguidorObjetos()
+    seguidor.actualizar([deteccion((100, 100, 200, 200), 'person')], instante=0.0)
+    objetos = seguidor.actualizar([deteccion((100, 100, 200, 200), 'dog')], instante=0.1)
+    assert sorted(o['track_id'] for o in objetos) == [1, 2]
+
+
+def test_prediccion_sigue_el_movimiento():
+    seguidor = SeguidorObjetos()
+    # 100 px/s hacia la derecha
+    for i in range(6):
+        x = 100 + 10 * i
+        seguidor.actualizar([deteccion((x, 100, x + 100, 200))], instante=0.1 * i)
+
+    predicho, = seguidor.predecir(instante=0.7)
+    assert abs(predicho['bbox'][0] - 170) <= 5
+    assert predicho['velocidad'][0] > 50
+
+
+def test_solo_confirmados_en_prediccion():
+    seguidor = SeguidorObjetos()
+    seguidor.actualizar([deteccion((100, 100, 200, 200))], instante=0.0)
+    assert seguidor.predecir(instante=0.05) == []
+    assert len(seguidor.predecir(instante=0.05, solo_confirmados=False)) == 1
+
+
+def test_olvida_objetos_perdidos():
+    seguidor = SeguidorObjetos()
+    seguidor.actualizar([deteccion((100, 100, 200, 200))], instante=0.0)
+    assert len(seguidor.actualizar([], instante=MAX_TIEMPO_PERDIDO)) == 1
+    assert seguidor.actualizar([], instante=MAX_TIEMPO_PERDIDO + 0.1) == []
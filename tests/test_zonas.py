@@ -0,0 +1,52 @@
+"""Zonas de interés: recorte, reproyección de cajas y filtro por punto de apoyo"""
+
+import numpy as np
+
+from zonas import ZonaInteres
+
+
+def deteccion(bbox, clase='person'):
+    return {'clase': clase, 'confianza': 0.9, 'bbox': bbox}
+
+
+def test_sin_poligonos_es_el_frame_completo():
+    zona = ZonaInteres()
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    assert zona.recortar(frame).shape == frame.shape
+    detecciones = [deteccion((10, 10, 50, 50))]
+    assert zona.reproyectar(detecciones) == [deteccion((10, 10, 50, 50))]
+
+
+def test_recorte_es_una_vista_con_margen():
+    # Mitad derecha del frame, margen de 10 px (0.1 de 100)
+    zona = ZonaInteres([[(0.5, 0.0), (1.0, 0.0), (1.0, 1.0), (0.5, 1.0)]], margen=0.1)
+    frame = np.zeros((100, 100, 3), dtype=np.uint8)
+    recorte = zona.recortar(frame)
+    assert zona.rect == (40, 0, 100, 100)
+    assert recorte.base is frame and recorte.shape == (100, 60, 3)
+
+
+def test_reproyectar_suma_el_origen_y_filtra_por_apoyo():
+    zona = ZonaInteres([[(0.5, 0.5), (1.0, 0.5), (1.0, 1.0), (0.5, 1.0)]], margen=0.0)
+    zona.recortar(np.zeros((100, 100, 3), dtype=np.uint8))
+    assert zona.rect == (50, 50, 100, 100)
+
+    dentro = deteccion((10, 10, 30, 40))          # Pisa en (70, 89): dentro
+    esquina = deteccion((0, 0, 10, 5))             # Pisa en (55, 54): dentro
+    cabeza = deteccion((-40, -40, -20, -1))        # Asoma por encima: pisa en (20, 48)
+    resultado = zona.reproyectar([dentro, esquina, cabeza])
+
+    assert [d['bbox'] for d in resultado] == [(60, 60, 80, 90), (50, 50, 60, 55)]
+    assert zona.rechazadas == 1
+    # Las detecciones originales no se modifican
+    assert dentro['bbox'] == (10, 10, 30, 40)
+
+
+def test_poligono_no_rectangular():
+    # Triángulo inferior izquierdo: una caja que pisa en la otra mitad se descarta
+    zona = ZonaInteres([[(0.0, 0.0), (1.0, 1.0), (0.0, 1.0)]], margen=0.0)
+    zona.recortar(np.zeros((100, 100, 3), dtype=np.uint8))
+    dentro = deteccion((0, 60, 20, 90))
+    fuera = deteccion((70, 10, 90, 30))
+    assert zona.reproyectar([dentro, fuera]) == [deteccion((0, 60, 20, 90))]
+    assert zona.obtener_estadisticas()['rechazadas'] == 1
@@ -7,58 +7,66 @@ Mucho más eficiente que Socket.IO + Base64
 import asyncio
 import logging
 from aiohttp import web
-from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCRtpSender, VideoStreamTrack
 from av import VideoFrame
 import cv2
 import threading
-from camera import inicializar_camera, obtener_frame_base64, cerrar_camera
+from camera import (inicializar_camera, obtener_camera, cerrar_camera, listar_camaras,
+                    DIBUJAR_DETECCIONES)
+from adaptacion import ControlAdaptativo
 import numpy as np
 
 # ==================== CONFIGURACIÓN ====================
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Codificar cada cámara una sola vez a H.264 y compartirla entre todas las conexiones
+# (ver codificador_h264.py); si no, aiortc codifica por separado para cada espectador
+USAR_H264_COMPARTIDO = True
+
+# Cada cuánto se revisan los informes RTCP para adaptar el escalón de calidad (s)
+INTERVALO_ADAPTACION = 2.0
+
 # ==================== TRACK DE VIDEO ====================
 class CameraVideoTrack(VideoStreamTrack):
     """Track de video que obtiene frames de la cámara"""
     
-    def __init__(self):
+    def __init__(self, camara_id=None, con_detecciones=DIBUJAR_DETECCIONES):
+        """
+        Args:
+            camara_id: Cámara a emitir (None = la de por defecto)
+            con_detecciones: Emitir con las cajas dibujadas o el frame limpio
+        """
         super().__init__()
+        self.camara_id = camara_id
+        self.con_detecciones = con_detecciones
         self.counter = 0
-        logger.info('✅ CameraVideoTrack inicializado')
+        logger.info(f'✅ CameraVideoTrack inicializado ({camara_id or "por defecto"})')
     
     async def recv(self):
         """Recibir frame de la cámara y enviarlo por WebRTC"""
         pts, time_base = await self.next_timestamp()
         
         try:
-            # Obtener frame en Base64
-            frame_b64 = obtener_frame_base64()
+            # Frame crudo de la cámara (BGR), sin JPEG ni Base64 de por medio;
+            # prestado del anillo de captura solo mientras PyAV lo copia
+            camara = obtener_camera(self.camara_id)
+            frame = None
+            if camara is not None:
+                with camara.prestar_frame(self.con_detecciones) as (frame_bgr, _):
+                    if frame_bgr is not None:
+                        # PyAV convierte BGR al formato del codificador
+                        frame = VideoFrame.from_ndarray(frame_bgr, format="bgr24")
             
-            if frame_b64:
-                import base64
-                try:
-                    # Decodificar Base64 a imagen
-                    frame_data = base64.b64decode(frame_b64)
-                    nparr = np.frombuffer(frame_data, np.uint8)
-                    frame_cv = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                    
-                    if frame_cv is not None:
-                        # Convertir BGR a RGB
-                        frame_rgb = cv2.cvtColor(frame_cv, cv2.COLOR_BGR2RGB)
-                        
-                        # Crear VideoFrame para aiortc
-                        frame = VideoFrame.from_ndarray(frame_rgb, format="rgb24")
-                        frame.pts = pts
-                        frame.time_base = time_base
-                        
-                        self.counter += 1
-                        if self.counter % 60 == 0:
-                            logger.info(f'✅ {self.counter} frames enviados por WebRTC')
-                        
-                        return frame
-                except Exception as decode_error:
-                    logger.error(f'❌ Error decodificando frame: {decode_error}')
+            if frame is not None:
+                frame.pts = pts
+                frame.time_base = time_base
+                
+                self.counter += 1
+                if self.counter % 60 == 0:
+                    logger.info(f'✅ {self.counter} frames enviados por WebRTC')
+                
+                return frame
         except Exception as e:
             logger.error(f'❌ Error en recv(): {e}')
         
@@ -73,12 +81,67 @@ class CameraVideoTrack(VideoStreamTrack):
 # ==================== SERVIDOR WEB ====================
 pcs = set()
 
+def crear_track_video(pc, camara_id, con_detecciones=DIBUJAR_DETECCIONES):
+    """Añadir a `pc` el track de la cámara: H.264 compartido si se puede, si no frames crudos
+    
+    Returns:
+        (track, transceptor) con transceptor None si no se usa el H.264 compartido
+    """
+    if USAR_H264_COMPARTIDO:
+        track = None
+        try:
+            from codificador_h264 import PistaH264, obtener_codificador
+            track = PistaH264(obtener_codificador(camara_id, con_detecciones=con_detecciones))
+            transceptor = pc.addTransceiver(track, direction='sendonly')
+            
+            # Los paquetes ya vienen en H.264: hay que negociar ese codec
+            codecs = RTCRtpSender.getCapabilities('video').codecs
+            transceptor.setCodecPreferences([c for c in codecs if c.mimeType == 'video/H264'])
+            return track, transceptor
+        except Exception as e:
+            if track is not None:
+                track.stop()
+            logger.warning(f'⚠️ H.264 compartido no disponible, se codifica por conexión: {e}')
+    
+    track = CameraVideoTrack(camara_id, con_detecciones)
+    pc.addTrack(track)
+    return track, None
+
+
+async def adaptar_calidad(pc, transceptor, track, camara_id, con_detecciones=DIBUJAR_DETECCIONES):
+    """Mover la conexión por la escalera de calidad según los informes RTCP del navegador"""
+    from codificador_h264 import obtener_codificador
+    control = ControlAdaptativo()
+    track.control = control
+    
+    while pc.connectionState not in ("closed", "failed"):
+        await asyncio.sleep(INTERVALO_ADAPTACION)
+        try:
+            informe = await transceptor.sender.getStats()
+        except Exception as e:
+            logger.warning(f'⚠️ No se pudieron leer las estadísticas RTCP: {e}')
+            continue
+        for estadistica in informe.values():
+            if estadistica.type != 'remote-inbound-rtp':
+                continue
+            if control.registrar_rtcp(estadistica.fractionLost, estadistica.roundTripTime):
+                track.cambiar_codificador(obtener_codificador(camara_id, control.escalon,
+                                                              con_detecciones))
+
 async def offer(request):
     """Endpoint para recibir oferta WebRTC"""
     try:
         params = await request.json()
         logger.info('📡 Oferta WebRTC recibida')
         
+        # Cámara a emitir (campo opcional "camara"; por defecto la primera)
+        camara_id = params.get("camara")
+        if camara_id is not None and camara_id not in listar_camaras():
+            return web.json_response({"error": f"Cámara desconocida: {camara_id}"}, status=404)
+        
+        # Campo opcional "overlay": false = vídeo sin las cajas de detección
+        con_detecciones = bool(params.get("overlay", DIBUJAR_DETECCIONES))
+        
         # Parsear oferta
         offer_sdp = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
@@ -87,19 +150,20 @@ async def offer(request):
         pcs.add(pc)
         logger.info('✅ PeerConnection creada')
 
+        # Agregar track de VIDEO de la cámara pedida
+        video_track, transceptor = crear_track_video(pc, camara_id, con_detecciones)
+        logger.info('✅ Track de video agregado')
+
         # Manejar cambios de estado
         @pc.on("connectionstatechange")
         async def on_connectionstatechange():
             logger.info(f'📡 Estado WebRTC: {pc.connectionState}')
             if pc.connectionState == "failed":
                 await pc.close()
+            if pc.connectionState in ("failed", "closed"):
+                video_track.stop()  # Deja de recibir paquetes del codificador compartido
                 pcs.discard(pc)
 
-        # Agregar track de VIDEO
-        video_track = CameraVideoTrack()
-        pc.addTrack(video_track)
-        logger.info('✅ Track de video agregado')
-
         # Procesar oferta remota
         logger.info('🔄 Procesando oferta remota...')
         await pc.setRemoteDescription(offer_sdp)
@@ -114,6 +178,11 @@ async def offer(request):
         await pc.setLocalDescription(answer)
         logger.info('✅ Descripción local establecida')
 
+        # Adaptar resolución/bitrate a lo que aguante el enlace de este espectador
+        if transceptor is not None:
+            asyncio.ensure_future(adaptar_calidad(pc, transceptor, video_track, camara_id,
+                                                  con_detecciones))
+
         logger.info('✅ Oferta WebRTC procesada correctamente')
         return web.json_response({
             "sdp": pc.localDescription.sdp,
@@ -173,7 +242,9 @@ async def index(request):
                     headers: {'Content-Type': 'application/json'},
                     body: JSON.stringify({
                         sdp: pc.localDescription.sdp,
-                        type: pc.localDescription.type
+                        type: pc.localDescription.type,
+                        camara: new URLSearchParams(location.search).get('camara'),
+                        overlay: new URLSearchParams(location.search).get('overlay') !== '0'
                     })
                 });
 
@@ -5,6 +5,7 @@ Más simple y confiable que Aiortc
 """
 
 import asyncio
+import json
 import logging
 from aiohttp import web
 from av import VideoFrame
@@ -12,7 +13,11 @@ import cv2
 import numpy as np
 import threading
 import time
-from camera import inicializar_camera, obtener_frame_base64, cerrar_camera
+from camera import (inicializar_camera, obtener_camera, cerrar_camera,
+                    listar_camaras, obtener_estado_camaras, VIDEO_OUTPUT_DIR,
+                    DIBUJAR_DETECCIONES, suscribir_eventos, obtener_objetos_activos)
+from retencion import obtener_retencion
+from adaptacion import ControlAdaptativo, ESCALONES
 
 # Para WebRTC alternativa, usamos una solución basada en MJPEG que es más simple
 # y funciona mejor en Windows
@@ -20,67 +25,246 @@ from camera import inicializar_camera, obtener_frame_base64, cerrar_camera
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Lotes de eventos que se guardan para un cliente lento antes de descartar los más viejos
+MAX_LOTES_CLIENTE = 64
+
+# Comentario SSE cada tantos segundos sin eventos, para que proxies no corten la conexión
+INTERVALO_LATIDO_EVENTOS = 15.0
+
+class ClienteMJPEG:
+    """Contadores de un cliente conectado al stream"""
+    
+    def __init__(self, remoto, con_detecciones=DIBUJAR_DETECCIONES):
+        self.remoto = remoto
+        self.con_detecciones = con_detecciones  # Con las cajas dibujadas o el frame limpio
+        self.inicio = time.time()
+        self.frames = 0
+        self.bytes = 0
+        self.saltados = 0  # Frames que no llegó a recibir por ir lento
+        self.fps = 0.0
+        self.frames_ventana = 0
+        self.inicio_ventana = time.time()
+        # Escalón de resolución/calidad/FPS según lo que aguante su enlace
+        self.control = ControlAdaptativo()
+    
+    def contar(self, num_bytes, saltados):
+        self.frames += 1
+        self.bytes += num_bytes
+        self.saltados += saltados
+        self.frames_ventana += 1
+        transcurrido = time.time() - self.inicio_ventana
+        if transcurrido >= 2.0:
+            self.fps = self.frames_ventana / transcurrido
+            self.frames_ventana = 0
+            self.inicio_ventana = time.time()
+    
+    def a_dict(self):
+        duracion = max(time.time() - self.inicio, 1e-6)
+        return {
+            'remoto': self.remoto,
+            'con_detecciones': self.con_detecciones,
+            'segundos': round(duracion, 1),
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'saltados': self.saltados,
+            'fps': round(self.fps, 1),
+            'kbps': round(self.bytes * 8 / duracion / 1000, 1),
+            **self.control.obtener_estadisticas()
+        }
+
+
 class MJPEGStreamer:
-    """Servidor MJPEG (Motion JPEG) - más simple que WebRTC pero muy eficaz"""
+    """Servidor MJPEG (Motion JPEG) - más simple que WebRTC pero muy eficaz
+    
+    Publicación/suscripción: cada frame nuevo se publica una vez como parte
+    multipart ya montada (una por escalón de calidad y overlay en uso) y los clientes
+    esperan a que cambie el número de secuencia. Un cliente lento no acumula
+    cola: al volver a escribir coge el frame más reciente y se salta los
+    intermedios, y si sigue sin dar abasto baja de escalón
+    """
     
-    def __init__(self):
-        self.clients = set()
-        self.frame_buffer = None
-        self.lock = threading.Lock()
+    def __init__(self, loop=None):
+        """
+        Args:
+            loop: Event loop de aiohttp (los frames se publican desde otro thread)
+        """
+        self.loop = loop
+        self.clients = {}              # response → ClienteMJPEG
+        self.partes = {}               # (escalón, overlay) → última parte multipart lista para escribir
+        self.secuencia = 0             # Secuencia de cámara de `self.partes`
+        self.condicion = asyncio.Condition()
         
     async def stream(self, request):
-        """Streamer MJPEG"""
+        """Streamer MJPEG (?overlay=0 para el vídeo sin las cajas de detección)"""
+        con_detecciones = request.query.get('overlay', '1' if DIBUJAR_DETECCIONES else '0') != '0'
         response = web.StreamResponse()
         response.content_type = 'multipart/x-mixed-replace; boundary=--frame'
         await response.prepare(request)
         
-        self.clients.add(response)
+        cliente = ClienteMJPEG(request.remote, con_detecciones)
+        self.clients[response] = cliente
         logger.info(f'✅ Cliente MJPEG conectado ({len(self.clients)} total)')
         
         try:
+            ultima_secuencia = None
+            siguiente_envio = 0.0
             while True:
-                with self.lock:
-                    if self.frame_buffer:
-                        frame_data = self.frame_buffer
-                    else:
-                        frame_data = None
+                # No enviar más rápido que los FPS del escalón del cliente
+                espera = siguiente_envio - time.monotonic()
+                if espera > 0:
+                    await asyncio.sleep(espera)
                 
-                if frame_data:
-                    await response.write(b'--frame\r\n')
-                    await response.write(b'Content-Type: image/jpeg\r\n')
-                    await response.write(f'Content-Length: {len(frame_data)}\r\n\r\n'.encode())
-                    await response.write(frame_data)
-                    await response.write(b'\r\n')
+                # Dormir hasta que haya un frame distinto del último enviado en su escalón
+                clave = (cliente.control.escalon, cliente.con_detecciones)
+                async with self.condicion:
+                    await self.condicion.wait_for(
+                        lambda: clave in self.partes and self.secuencia != ultima_secuencia)
+                    parte, secuencia = self.partes[clave], self.secuencia
                 
-                await asyncio.sleep(0.0167)  # 60 FPS
+                saltados = secuencia - ultima_secuencia - 1 if ultima_secuencia is not None else 0
+                ultima_secuencia = secuencia
+                
+                # Una sola escritura por frame; espera a que el socket drene
+                inicio = time.monotonic()
+                await response.write(parte)
+                cliente.contar(len(parte), max(saltados, 0))
+                
+                # Medir el enlace: tiempo de escritura y bytes que siguen en cola
+                pendientes = request.transport.get_write_buffer_size() if request.transport else 0
+                cliente.control.registrar_envio(time.monotonic() - inicio, pendientes, len(parte))
+                siguiente_envio = inicio + 1.0 / cliente.control.perfil['fps']
+        except ConnectionResetError:
+            pass  # El cliente cerró la conexión: es como termina siempre un stream MJPEG
+        except asyncio.CancelledError:
+            # aiohttp cancela el handler al cerrarse la conexión o al parar el servidor
+            raise
         except Exception as e:
             logger.error(f'❌ Error en stream MJPEG: {e}')
         finally:
-            self.clients.discard(response)
-            logger.info(f'📴 Cliente MJPEG desconectado ({len(self.clients)} total)')
+            self.clients.pop(response, None)
+            logger.info(f'📴 Cliente MJPEG desconectado ({len(self.clients)} total): '
+                        f'{cliente.a_dict()}')
         
         return response
     
-    def update_frame(self, frame_base64):
-        """Actualizar frame para todos los clientes"""
-        if frame_base64:
-            import base64
-            try:
-                frame_data = base64.b64decode(frame_base64)
-                with self.lock:
-                    self.frame_buffer = frame_data
-            except Exception as e:
-                logger.error(f'❌ Error decodificando frame: {e}')
+    def variantes_en_uso(self):
+        """(escalón, overlay) que necesita algún cliente conectado"""
+        return {(cliente.control.escalon, cliente.con_detecciones)
+                for cliente in list(self.clients.values())}
+    
+    async def _publicar(self, partes, secuencia):
+        async with self.condicion:
+            self.partes = partes
+            self.secuencia = secuencia
+            self.condicion.notify_all()
+    
+    def update_frame(self, frames_jpeg, secuencia):
+        """Publicar un frame para todos los clientes (thread-safe)
+        
+        Args:
+            frames_jpeg: {(escalón, overlay): bytes JPEG}
+            secuencia: Número de frame de la cámara
+        """
+        partes = {clave: b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                           + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n'
+                  for clave, jpeg in frames_jpeg.items() if jpeg}
+        if partes:
+            asyncio.run_coroutine_threadsafe(self._publicar(partes, secuencia), self.loop)
+    
+    def obtener_estadisticas(self):
+        """Contadores por cliente conectado"""
+        return {
+            'clientes': [c.a_dict() for c in list(self.clients.values())],
+            'secuencia': self.secuencia
+        }
 
-# Instancia global
-streamer = MJPEGStreamer()
+# Un streamer por cámara (se crean al arrancar, una vez conectadas)
+streamers = {}
 
 async def video_feed(request):
-    """Endpoint para video feed MJPEG"""
-    return await streamer.stream(request)
+    """Endpoint para video feed MJPEG (/video_feed o /video_feed/{camara_id})"""
+    camara_id = request.match_info.get('camara_id')
+    if camara_id is None and streamers:
+        camara_id = next(iter(streamers))
+    if camara_id not in streamers:
+        raise web.HTTPNotFound(text=f'Cámara desconocida: {camara_id}')
+    return await streamers[camara_id].stream(request)
+
+async def camaras(request):
+    """Estado de todas las cámaras (JSON)"""
+    return web.json_response(obtener_estado_camaras())
+
+async def clientes_mjpeg(request):
+    """FPS y bytes enviados a cada cliente MJPEG, por cámara (JSON)"""
+    return web.json_response({camara_id: streamer.obtener_estadisticas()
+                              for camara_id, streamer in streamers.items()})
+
+async def listar_clips(request):
+    """Clips grabados, más recientes primero (JSON)
+    
+    Filtros opcionales: ?camara=, ?clase=, ?desde= y ?hasta= (epoch), ?limite=
+    """
+    consulta = request.query
+    try:
+        desde = float(consulta['desde']) if 'desde' in consulta else None
+        hasta = float(consulta['hasta']) if 'hasta' in consulta else None
+        limite = min(int(consulta.get('limite', 100)), 1000)
+    except ValueError:
+        raise web.HTTPBadRequest(text='desde/hasta/limite deben ser numéricos')
+    clips = obtener_retencion(VIDEO_OUTPUT_DIR).listar(
+        camara_id=consulta.get('camara'), desde=desde, hasta=hasta,
+        clase=consulta.get('clase'), limite=limite)
+    return web.json_response(clips)
+
+async def descargar_clip(request):
+    """Archivo de un clip; admite peticiones Range para saltar dentro del vídeo"""
+    clip = obtener_retencion(VIDEO_OUTPUT_DIR).obtener(int(request.match_info['clip_id']))
+    if clip is None or not clip['ruta'].exists():
+        raise web.HTTPNotFound(text='Clip no encontrado')
+    # FileResponse resuelve Range/If-Range y envía con sendfile sin cargar el archivo
+    return web.FileResponse(clip['ruta'], headers={'Content-Type': 'video/mp4'})
+
+async def eventos(request):
+    """Eventos de detección como Server-Sent Events
+    
+    Primero un evento `estado` con los objetos presentes y luego un `data:` por
+    lote (entradas, salidas y cajas que se movieron); lo usa server.py para
+    reenviarlos al backend sin pedir frames
+    """
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                           'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    
+    loop = asyncio.get_running_loop()
+    cola = asyncio.Queue(maxsize=MAX_LOTES_CLIENTE)
+    
+    def encolar(lote):
+        if cola.full():
+            cola.get_nowait()
+        cola.put_nowait(lote)
+    
+    # Los lotes llegan desde los threads de captura
+    cancelar = suscribir_eventos(lambda lote: loop.call_soon_threadsafe(encolar, lote))
+    try:
+        estado = json.dumps(obtener_objetos_activos(), separators=(',', ':'))
+        await response.write(f'event: estado\ndata: {estado}\n\n'.encode())
+        while True:
+            try:
+                lote = await asyncio.wait_for(cola.get(), INTERVALO_LATIDO_EVENTOS)
+            except asyncio.TimeoutError:
+                await response.write(b': latido\n\n')
+                continue
+            await response.write(b'data: ' + json.dumps(lote, separators=(',', ':')).encode() + b'\n\n')
+    except ConnectionResetError:
+        pass
+    finally:
+        cancelar()
+    return response
 
 async def index(request):
-    """Página HTML para visualizar video"""
+    """Página HTML para visualizar video (?camara=<id> para elegir cámara)"""
+    camara_id = request.query.get('camara') or next(iter(streamers), '')
+    enlaces = ' | '.join(f'<a href="/?camara={c}">{c}</a>' for c in streamers)
     html = """
     <!DOCTYPE html>
     <html>
@@ -135,12 +319,13 @@ async def index(request):
     <body>
         <div class="container">
             <h1>📹 Streaming de Cámara en Vivo</h1>
-            <img id="video" src="/video_feed" alt="Video Stream">
+            <img id="video" src="/video_feed/__CAMARA__" alt="Video Stream">
             <div class="status">
-                <p>🟢 Conectado - MJPEG Stream @ 60 FPS</p>
+                <p>🟢 Conectado - MJPEG Stream a los FPS de la cámara</p>
             </div>
             <div class="info">
-                <p>Resolución: 480x360 | Calidad: 60%</p>
+                <p>Cámara: __CAMARA__ | Cámaras: __ENLACES__</p>
+                <p>Resolución y calidad adaptadas a la conexión (de 640x480 a 160x120)</p>
                 <p>Sin latencia de codificación WebRTC</p>
             </div>
         </div>
@@ -152,34 +337,46 @@ async def index(request):
             img.onerror = function() {
                 console.log('❌ Error en stream, reconectando...');
                 setTimeout(() => {
-                    img.src = '/video_feed?t=' + Date.now();
+                    img.src = '/video_feed/__CAMARA__?t=' + Date.now();
                 }, 2000);
             };
-            
-            // Forzar recarga periódica para evitar cache
-            setInterval(() => {
-                img.src = '/video_feed?t=' + Date.now();
-            }, 5000);
         </script>
     </body>
     </html>
     """
+    html = html.replace('__CAMARA__', camara_id).replace('__ENLACES__', enlaces)
     return web.Response(text=html, content_type='text/html')
 
-def frame_feed_thread():
-    """Thread para actualizar frames continuamente"""
-    logger.info('▶️ Thread de frames iniciado')
+def frame_feed_thread(camara_id, streamer):
+    """Thread que publica cada frame nuevo de una cámara (uno por cámara)
+    
+    Se despierta con cada frame capturado en vez de sondear a 60 Hz, y sin
+    clientes conectados no codifica nada
+    """
+    logger.info(f'▶️ Thread de frames iniciado ({camara_id})')
+    camara = obtener_camera(camara_id)
     contador = 0
+    ultima_secuencia = 0
     
     while True:
         try:
-            frame_b64 = obtener_frame_base64()
-            if frame_b64:
-                streamer.update_frame(frame_b64)
+            secuencia = camara.esperar_frame(ultima_secuencia)
+            if secuencia == ultima_secuencia or not streamer.clients:
+                ultima_secuencia = secuencia
+                continue
+            
+            # Un JPEG por escalón y overlay en uso, de la caché compartida (sin Base64)
+            frames_jpeg = {}
+            for escalon, con_detecciones in streamer.variantes_en_uso():
+                perfil = ESCALONES[escalon]
+                frames_jpeg[escalon, con_detecciones], ultima_secuencia = camara.obtener_jpeg(
+                    perfil['ancho'], perfil['alto'], perfil['calidad'],
+                    con_detecciones=con_detecciones)
+            if frames_jpeg:
+                streamer.update_frame(frames_jpeg, ultima_secuencia)
                 contador += 1
-                if contador % 60 == 0:
-                    logger.info(f'✅ {contador} frames enviados')
-            time.sleep(0.0167)  # 60 FPS
+                if contador % 300 == 0:
+                    logger.info(f'✅ {contador} frames publicados ({camara_id})')
         except Exception as e:
             logger.error(f'❌ Error en thread de frames: {e}')
             time.sleep(0.5)
@@ -188,18 +385,27 @@ async def main():
     """Función principal"""
     logger.info('🚀 Iniciando servidor MJPEG...')
     
-    # Inicializar cámara CON YOLOv8 para detección
-    logger.info('📷 Inicializando cámara CON YOLOv8...')
+    # Inicializar cámaras CON YOLOv8 para detección (un solo modelo, inferencia por lotes)
+    logger.info('📷 Inicializando cámaras CON YOLOv8...')
     inicializar_camera(cargar_yolo=True)
     
-    # Iniciar thread de frames
-    frame_thread = threading.Thread(target=frame_feed_thread, daemon=True)
-    frame_thread.start()
+    # Iniciar un thread de frames por cámara
+    for camara_id in listar_camaras():
+        streamers[camara_id] = MJPEGStreamer(asyncio.get_running_loop())
+        frame_thread = threading.Thread(target=frame_feed_thread,
+                                        args=(camara_id, streamers[camara_id]), daemon=True)
+        frame_thread.start()
     
     # Crear app web
     app = web.Application()
     app.router.add_get('/', index)
     app.router.add_get('/video_feed', video_feed)
+    app.router.add_get('/video_feed/{camara_id}', video_feed)
+    app.router.add_get('/camaras', camaras)
+    app.router.add_get('/clientes_mjpeg', clientes_mjpeg)
+    app.router.add_get('/clips', listar_clips)
+    app.router.add_get(r'/clips/{clip_id:\d+}', descargar_clip)
+    app.router.add_get('/eventos', eventos)
     
     runner = web.AppRunner(app)
     await runner.setup()
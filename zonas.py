@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Zonas de interés por cámara
+Cada cámara puede limitar la detección a uno o varios polígonos alrededor del
+coche: al modelo solo le llega el recorte del rectángulo que los contiene
+(menos píxeles que reducir y, a igual tamaño de entrada, más resolución útil),
+las cajas vuelven a coordenadas del frame completo sumando el origen del
+recorte y se descartan las que quedan fuera de los polígonos
+"""
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# ==================== CONFIGURACIÓN ====================
+logger = logging.getLogger(__name__)
+
+# Margen alrededor del rectángulo de las zonas (fracción del frame), para no
+# cortar justo por el borde a un objeto que entra
+MARGEN_RECORTE = 0.02
+
+
+class ZonaInteres:
+    """Polígonos de una cámara con su recorte y su máscara precalculados por resolución"""
+
+    def __init__(self, poligonos: Optional[Sequence[Sequence[Tuple[float, float]]]] = None,
+                 margen: float = MARGEN_RECORTE):
+        """
+        Args:
+            poligonos: Lista de polígonos [(x, y), ...] en coordenadas relativas (0-1);
+                None o vacío = frame completo
+            margen: Margen del recorte alrededor de los polígonos (fracción del frame)
+        """
+        self.poligonos = [np.asarray(p, dtype=np.float64) for p in (poligonos or [])]
+        self.margen = margen
+        self.forma = None
+        self.rect = None           # (x0, y0, x1, y1) del recorte en píxeles
+        self.desplazamiento = None  # (x0, y0, x0, y0) para reproyectar cajas
+        self.mascara = None        # bool (alto, ancho) del frame completo; None = todo vale
+        self.rechazadas = 0
+
+    def _preparar(self, forma):
+        """Recorte y máscara para una resolución (se hace una vez, no por frame)"""
+        alto, ancho = forma[:2]
+        self.forma = (alto, ancho)
+        if not self.poligonos:
+            self.rect = (0, 0, ancho, alto)
+            self.mascara = None
+        else:
+            escala = np.array([ancho, alto], dtype=np.float64)
+            puntos = [np.round(p * escala).astype(np.int32) for p in self.poligonos]
+            mascara = np.zeros((alto, ancho), dtype=np.uint8)
+            cv2.fillPoly(mascara, puntos, 1)
+            self.mascara = mascara.astype(bool)
+
+            todos = np.vstack(puntos)
+            mx, my = int(ancho * self.margen), int(alto * self.margen)
+            x0, y0 = np.maximum(todos.min(axis=0) - (mx, my), 0)
+            x1, y1 = np.minimum(todos.max(axis=0) + (mx, my) + 1, (ancho, alto))
+            self.rect = (int(x0), int(y0), int(x1), int(y1))
+        x0, y0, x1, y1 = self.rect
+        self.desplazamiento = np.array([x0, y0, x0, y0], dtype=np.int32)
+        logger.info(f'🎯 Zona de inferencia {x1 - x0}x{y1 - y0} en ({x0}, {y0}) '
+                    f'de {ancho}x{alto} ({len(self.poligonos)} polígono(s))')
+
+    def recortar(self, frame: np.ndarray) -> np.ndarray:
+        """Vista (sin copia) del rectángulo que contiene las zonas"""
+        if frame.shape[:2] != self.forma:
+            self._preparar(frame.shape)
+        x0, y0, x1, y1 = self.rect
+        return frame[y0:y1, x0:x1]
+
+    def reproyectar(self, detecciones: List[Dict]) -> List[Dict]:
+        """
+        Llevar las cajas del recorte al frame completo y quitar las de fuera de las zonas
+
+        Se decide por el punto de apoyo (centro del borde inferior de la caja):
+        una persona cuya cabeza asoma sobre la zona pero que pisa fuera no cuenta
+
+        Returns:
+            Detecciones dentro de las zonas, con 'bbox' en coordenadas del frame
+        """
+        if not detecciones or self.forma is None:
+            return detecciones
+
+        cajas = np.array([d['bbox'] for d in detecciones], dtype=np.int32) + self.desplazamiento
+        dentro = np.ones(len(cajas), dtype=bool)
+        if self.mascara is not None:
+            alto, ancho = self.forma
+            x = np.clip((cajas[:, 0] + cajas[:, 2]) // 2, 0, ancho - 1)
+            y = np.clip(cajas[:, 3] - 1, 0, alto - 1)
+            dentro = self.mascara[y, x]
+            self.rechazadas += int((~dentro).sum())
+
+        return [dict(d, bbox=tuple(caja)) for d, caja, ok
+                in zip(detecciones, cajas.tolist(), dentro.tolist()) if ok]
+
+    def obtener_estadisticas(self) -> Dict:
+        if self.forma is None:
+            return {'poligonos': len(self.poligonos)}
+        x0, y0, x1, y1 = self.rect
+        alto, ancho = self.forma
+        return {
+            'poligonos': len(self.poligonos),
+            'recorte': [x0, y0, x1, y1],
+            'fraccion_inferida': round((x1 - x0) * (y1 - y0) / (ancho * alto), 3),
+            'rechazadas': self.rechazadas
+        }